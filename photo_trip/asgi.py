@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "photo_trip.settings")
+# Pooled connections for the web server only, see: DATABASE_POOL in settings.py
+os.environ.setdefault("PHOTO_TRIP_DATABASE_POOL", "1")
 
 application = get_asgi_application()
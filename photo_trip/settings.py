@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "utils.profiling.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "photo_trip.urls"
@@ -74,6 +76,12 @@ WSGI_APPLICATION = "photo_trip.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# psycopg_pool when PHOTO_TRIP_DATABASE_POOL=1, which wsgi.py and asgi.py set.
+# Management commands fork workers and run for hours, every process would keep
+# min_size idle connections.
+# https://docs.djangoproject.com/en/5.1/ref/databases/#connection-pool
+DATABASE_POOL = os.environ.get("PHOTO_TRIP_DATABASE_POOL") == "1"
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -82,6 +90,16 @@ DATABASES = {
         "PASSWORD": "photo_trip",
         "HOST": "localhost",
         "PORT": "5432",
+        "OPTIONS": (
+            {
+                "pool": {
+                    "min_size": 2,
+                    "max_size": 8,
+                },
+            }
+            if DATABASE_POOL
+            else {}
+        ),
     }
 }
 
@@ -126,3 +144,68 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+# Range partition photos_photo by taken_on year, for catalogs of tens of
+# millions of photos. Applied by migration 0009 or later with
+# ./manage.py partition_photos --convert, see: photos.partitions
+PHOTO_PARTITIONING = False
+
+
+# Extracted metadata cache shared by every database importing the same files,
+# see: utils.exifcache and ./manage.py exif_cache. None disables it.
+EXIF_CACHE_PATH = None
+
+EXIF_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+
+
+# Profiles of requests under PROFILE_REQUEST_PATHS slower than
+# PROFILE_REQUEST_THRESHOLD seconds are written to PROFILE_DIR/requests, see:
+# utils.profiling. None disables the middleware.
+PROFILE_DIR = None
+
+PROFILE_REQUEST_THRESHOLD = 1.0
+
+PROFILE_REQUEST_PATHS = ["/admin/"]
+
+
+# Logging
+# https://docs.djangoproject.com/en/5.1/topics/logging/
+
+# "queue" formats and writes records on a background thread so logging never
+# stalls imports, "console" writes them synchronously
+LOG_HANDLER = "console"
+
+LOG_LEVEL = "INFO"
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "default": {
+            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "default",
+        },
+        "queue": {
+            "class": "utils.logging.QueueStreamHandler",
+            "formatter": "default",
+        },
+    },
+    "loggers": {
+        "photos": {
+            "handlers": [LOG_HANDLER],
+            "level": LOG_LEVEL,
+            "propagate": False,
+        },
+        "utils": {
+            "handlers": [LOG_HANDLER],
+            "level": LOG_LEVEL,
+            "propagate": False,
+        },
+    },
+}
@@ -16,7 +16,7 @@ Including another URLconf
 """
 
 from django.contrib import admin
-from django.urls import path
+from django.urls import include, path
 from django.utils.translation import gettext as _
 
 
@@ -28,4 +28,5 @@ admin.site.site_title = _("PhotoTrip")
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("api/", include("photos.urls")),
 ]
@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "photo_trip.settings")
+# Pooled connections for the web server only, see: DATABASE_POOL in settings.py
+os.environ.setdefault("PHOTO_TRIP_DATABASE_POOL", "1")
 
 application = get_wsgi_application()
@@ -1,13 +1,114 @@
-import json
+import datetime
 
 from django.contrib import admin
-from django.urls import reverse
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Min
+from django.http import Http404, JsonResponse
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.urls import path, reverse
 from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 
 from utils.admin import DATETIME_FORMAT, BaseModelAdmin, ReadOnlyModelAdmin
 from utils.formatting import bytes_to_human_readable
-from .models import Photo, FileType, MimeType, Camera, Lens
+from utils.tags import TagPredicateException, tag_predicate_to_q
+from . import partitions
+from .duplicates import get_duplicate_content_hashes, get_duplicate_groups
+from .metadata import (
+    HEADINGS_CACHE_TIMEOUT,
+    get_headings_cache_key,
+    get_metadata_group,
+    get_metadata_groups,
+)
+from .models import Photo, FileType, MimeType, Camera, Lens, ImportRun
+
+
+class MetadataFilter(admin.SimpleListFilter):
+    # Any predicate can be passed in the URL e.g. ?metadata=EXIF.ISO>3200
+    # See: utils.tags.parse_tag_predicate()
+    title = _("metadata")
+    parameter_name = "metadata"
+
+    def lookups(self, request, model_admin):
+        return [
+            ("EXIF.ISO>3200", "EXIF.ISO > 3200"),
+            ("EXIF.Flash=Fired", "EXIF.Flash = Fired"),
+            ("EXIF.Orientation=Rotate 90 CW", "EXIF.Orientation = Rotate 90 CW"),
+            ("QuickTime.Rotation=90", "QuickTime.Rotation = 90"),
+            ("Composite.GPSLatitude", "Composite.GPSLatitude"),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            return queryset.filter(tag_predicate_to_q(self.value()))
+        except TagPredicateException as e:
+            raise IncorrectLookupParameters(e)
+
+
+class GroupFilter(admin.SimpleListFilter):
+    # Live Photos and bursts, see: photos.grouping
+    title = _("group")
+    parameter_name = "group"
+
+    def lookups(self, request, model_admin):
+        return [
+            ("primary", _("One per group")),
+            ("member", _("Group members")),
+        ]
+
+    def queryset(self, request, queryset):
+        if self.value() == "primary":
+            return queryset.filter(primary__isnull=True)
+        if self.value() == "member":
+            return queryset.filter(primary__isnull=False)
+        return queryset
+
+
+class YearFilter(admin.SimpleListFilter):
+    # Filters on the bounds of a partition, only it is scanned when
+    # PHOTO_PARTITIONING is set. date_hierarchy would scan every partition for
+    # its list of dates.
+    title = _("year taken (UTC)")
+    parameter_name = "year"
+
+    def lookups(self, request, model_admin):
+        with connection.cursor() as cursor:
+            if partitions.is_partitioned(cursor):
+                prefix = partitions.get_partition_name("")
+                years = [
+                    int(name.removeprefix(prefix))
+                    for name, _bounds, _rows in partitions.get_partitions(cursor)
+                    if name != partitions.DEFAULT_PARTITION
+                ]
+            else:
+                # Both ends of the taken_on index
+                bounds = Photo.objects.aggregate(
+                    first=Min("taken_on"), last=Max("taken_on")
+                )
+                years = []
+                if bounds["first"] is not None:
+                    years = range(
+                        bounds["first"].astimezone(datetime.UTC).year,
+                        bounds["last"].astimezone(datetime.UTC).year + 1,
+                    )
+        return [(str(x), str(x)) for x in sorted(years, reverse=True)]
+
+    def queryset(self, request, queryset):
+        if self.value() is None:
+            return queryset
+        try:
+            start, end = partitions.get_bounds(int(self.value()))
+        except (ValueError, OverflowError) as e:
+            raise IncorrectLookupParameters(e)
+        return queryset.filter(taken_on__gte=start, taken_on__lt=end)
 
 
 @admin.register(Photo)
@@ -21,10 +122,14 @@ class PhotoAdmin(BaseModelAdmin, ReadOnlyModelAdmin):
         "file_size_display",
     ]
     list_filter = [
+        YearFilter,
+        "is_video",
         "file_type",
         "mime_type",
         "camera",
         "lens",
+        GroupFilter,
+        MetadataFilter,
     ]
     fieldsets = [
         [
@@ -72,8 +177,73 @@ class PhotoAdmin(BaseModelAdmin, ReadOnlyModelAdmin):
                 ],
             },
         ],
+        [
+            "Group",
+            {
+                "fields": [
+                    "content_identifier",
+                    "burst_uuid",
+                    "primary",
+                    "members_display",
+                ],
+            },
+        ],
     ]
 
+    class Media:
+        js = [
+            "admin/photos/metadata.js",
+        ]
+
+    def get_queryset(self, request):
+        # Metadata can be megabytes for videos, groups are loaded on demand
+        # see: metadata_display()
+        return super().get_queryset(request).defer("metadata")
+
+    def get_urls(self):
+        urls = [
+            path(
+                "duplicates/",
+                self.admin_site.admin_view(self.duplicates_view),
+                name="photos_photo_duplicates",
+            ),
+            path(
+                "<int:object_id>/metadata/<str:group>/",
+                self.admin_site.admin_view(self.metadata_view),
+                name="photos_photo_metadata",
+            ),
+        ]
+        return urls + super().get_urls()
+
+    def metadata_view(self, request, object_id, group):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        tags = get_metadata_group(object_id, group)
+        if tags is None:
+            raise Http404
+        return JsonResponse({"group": group, "tags": tags})
+
+    def duplicates_view(self, request):
+        # Hashes are computed by: ./manage.py duplicates
+        paginator = Paginator(get_duplicate_content_hashes(), 50)
+        page = paginator.get_page(request.GET.get("p"))
+        content_hashes = [x["content_hash"] for x in page.object_list]
+        groups = [
+            {
+                "photos": group,
+                "file_size": bytes_to_human_readable(group[0].file_size),
+            }
+            for group in get_duplicate_groups(content_hashes)
+        ]
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": _("Duplicate photos"),
+            "page": page,
+            "groups": groups,
+        }
+        return TemplateResponse(request, "admin/photos/photo/duplicates.html", context)
+
     @admin.display(
         description=_("Thumbnail"),
     )
@@ -136,14 +306,37 @@ class PhotoAdmin(BaseModelAdmin, ReadOnlyModelAdmin):
         else:
             return ""
 
+    @admin.display(
+        description=_("Members"),
+    )
+    def members_display(self, obj):
+        url = reverse("admin:photos_photo_changelist")
+        url = f"{url}?primary__id__exact={obj.id}"
+        text = _("group members")
+        return format_html('<a href="{}">{}</a>', url, text)
+
     @admin.display(
         description=_("Metadata"),
     )
     def metadata_display(self, obj):
-        return format_html(
-            "<pre>{}</pre>",
-            json.dumps(obj.metadata, indent=4, sort_keys=True),
-        )
+        # Collapsed group headings, the tags of a group are fetched from
+        # metadata_view() when it's expanded, see: metadata.js
+        key = get_headings_cache_key(obj)
+        html = cache.get(key)
+        if html is None:
+            groups = [
+                {
+                    "name": name,
+                    "tags": tags,
+                    "url": reverse("admin:photos_photo_metadata", args=[obj.id, name]),
+                }
+                for name, tags in get_metadata_groups(obj.id)
+            ]
+            html = render_to_string(
+                "admin/photos/photo/metadata.html", {"groups": groups}
+            )
+            cache.set(key, html, HEADINGS_CACHE_TIMEOUT)
+        return mark_safe(html)
 
 
 @admin.register(FileType)
@@ -273,3 +466,45 @@ class LensAdmin(BaseModelAdmin, ReadOnlyModelAdmin):
         url = f"{url}?lens__id__exact={obj.id}"
         text = _("matching photos")
         return format_html('<a href="{}">{}</a>', url, text)
+
+
+@admin.register(ImportRun)
+class ImportRunAdmin(BaseModelAdmin, ReadOnlyModelAdmin):
+    search_fields = [
+        "path",
+    ]
+    list_display = [
+        "created_on_display",
+        "path",
+        "profile",
+        "shard",
+        "progress_display",
+        "elapsed",
+        "finished_on",
+    ]
+    list_filter = [
+        "profile",
+        "shard",
+    ]
+    readonly_fields = [
+        "created_on_display",
+        "updated_on_display",
+        "path",
+        "profile",
+        "shard",
+        "total_files",
+        "files",
+        "bytes",
+        "imported",
+        "skipped",
+        "errors",
+        "elapsed",
+        "finished_on",
+        "metrics",
+    ]
+
+    @admin.display(
+        description=_("Progress"),
+    )
+    def progress_display(self, obj):
+        return f"{obj.files} / {obj.total_files}"
@@ -0,0 +1,67 @@
+from photos.models import Camera, FileType, Lens, MimeType
+from utils import exif
+from utils.datetime import extract_datetime
+from utils.db import get_or_create_conflict_safe
+
+
+# Photo fields computed from (file_path, metadata) alone
+DERIVED_FIELDS = [
+    "image_width",
+    "image_height",
+    "megapixels",
+    "taken_on",
+    "duration",
+    "gps_latitude",
+    "gps_longitude",
+    "gps_altitude",
+    "camera",
+    "lens",
+    "content_identifier",
+    "burst_uuid",
+]
+
+
+def derive_fields(file_path, metadata):
+    # camera and lens are (make, model) tuples, see: get_camera(), get_lens()
+    image_width, image_height = exif.get_image_width_image_height(metadata)
+    gps_latitude, gps_longitude = exif.get_gps_latitude_gps_longitude(metadata)
+    return {
+        "image_width": image_width,
+        "image_height": image_height,
+        "megapixels": exif.get_megapixels(metadata),
+        "taken_on": exif.get_taken_on(metadata) or extract_datetime(file_path),
+        "duration": exif.get_duration(metadata),
+        "gps_latitude": gps_latitude,
+        "gps_longitude": gps_longitude,
+        "gps_altitude": exif.get_gps_altitude(metadata),
+        "camera": exif.get_camera_make_camera_model(metadata),
+        "lens": exif.get_lens_make_lens_model(metadata),
+        "content_identifier": exif.get_content_identifier(metadata),
+        "burst_uuid": exif.get_burst_uuid(metadata),
+    }
+
+
+def get_file_type(name):
+    return get_or_create_conflict_safe(FileType, {"name": name})
+
+
+def get_mime_type(name):
+    return get_or_create_conflict_safe(MimeType, {"name": name})
+
+
+def get_camera(camera_make, camera_model):
+    if camera_make is None and camera_model is None:
+        return None
+    return get_or_create_conflict_safe(
+        Camera,
+        {"make": camera_make or "", "model": camera_model or ""},
+    )
+
+
+def get_lens(lens_make, lens_model):
+    if lens_make is None and lens_model is None:
+        return None
+    return get_or_create_conflict_safe(
+        Lens,
+        {"make": lens_make or "", "model": lens_model or ""},
+    )
@@ -0,0 +1,99 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.models import Count
+
+from photos.models import Photo
+from utils.hashing import get_content_hash, get_partial_hash
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+BATCH_SIZE = 1000
+
+WORKERS = 8
+
+
+def hash_photos(
+    photos, field_name, hash_function, workers=WORKERS, exceptions=(OSError,)
+):
+    def hash_photo(photo):
+        try:
+            return hash_function(photo.file_path)
+        except exceptions:
+            logger.exception("Could not hash file: %s", photo.file_path)
+            return None
+
+    # Hashing is I/O bound and hashlib releases the GIL on large buffers
+    batch = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for photo, hash in zip(photos, executor.map(hash_photo, photos)):
+            if hash is None:
+                continue
+            setattr(photo, field_name, hash)
+            batch.append(photo)
+            if len(batch) >= BATCH_SIZE:
+                Photo.objects.bulk_update(batch, [field_name])
+                batch = []
+    Photo.objects.bulk_update(batch, [field_name])
+
+
+def get_duplicate_file_sizes():
+    return (
+        Photo.objects.values("file_size")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .values("file_size")
+    )
+
+
+def get_duplicate_partial_hashes():
+    # The partial hash includes the file size
+    return (
+        Photo.objects.filter(partial_hash__isnull=False)
+        .values("partial_hash")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .values("partial_hash")
+    )
+
+
+def get_duplicate_content_hashes():
+    return (
+        Photo.objects.filter(content_hash__isnull=False)
+        .values("content_hash")
+        .annotate(count=Count("id"))
+        .filter(count__gt=1)
+        .order_by("-count", "content_hash")
+    )
+
+
+def update_hashes(workers=WORKERS):
+    # 1. Only files sharing a file_size can be duplicates
+    photos = Photo.objects.filter(
+        file_size__in=get_duplicate_file_sizes(),
+        partial_hash__isnull=True,
+    ).only("id", "file_path")
+    logger.info("Computing partial hashes for %d files", photos.count())
+    hash_photos(list(photos), "partial_hash", get_partial_hash, workers=workers)
+
+    # 2. Only files sharing a partial_hash need to be read in full
+    photos = Photo.objects.filter(
+        partial_hash__in=get_duplicate_partial_hashes(),
+        content_hash__isnull=True,
+    ).only("id", "file_path")
+    logger.info("Computing content hashes for %d files", photos.count())
+    hash_photos(list(photos), "content_hash", get_content_hash, workers=workers)
+
+
+def get_duplicate_groups(content_hashes):
+    photos = (
+        Photo.objects.filter(content_hash__in=content_hashes)
+        .only("id", "file_name", "file_path", "file_size", "content_hash")
+        .order_by("content_hash", "file_path")
+    )
+    groups = {}
+    for photo in photos:
+        groups.setdefault(photo.content_hash, []).append(photo)
+    return [groups[x] for x in content_hashes if x in groups]
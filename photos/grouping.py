@@ -0,0 +1,50 @@
+from django.db import connection
+
+from photos.models import Photo
+
+
+# Live Photos: the still image and the video share a ContentIdentifier, the
+# still represents the group. Bursts: every frame shares a BurstUUID, the first
+# frame represents the group, a Live Photo video keeps pointing at its still.
+# Members are ordered by file path rather than id so that sharded imports,
+# which insert in any order, pick the same primary.
+GROUP_SQL = """
+WITH keys AS (
+    SELECT content_identifier, burst_uuid FROM {table}
+    WHERE content_identifier = ANY(%(content_identifiers)s)
+    OR burst_uuid = ANY(%(burst_uuids)s)
+), members AS (
+    SELECT id, CASE
+        WHEN burst_uuid IS NULL THEN first_value(id) OVER (
+            PARTITION BY content_identifier ORDER BY is_video IS TRUE, file_path
+        )
+        ELSE first_value(id) OVER (
+            PARTITION BY burst_uuid ORDER BY taken_on, file_path
+        )
+    END AS primary_id
+    FROM {table}
+    WHERE content_identifier IN (SELECT content_identifier FROM keys)
+    OR burst_uuid IN (SELECT burst_uuid FROM keys)
+)
+UPDATE {table} AS photo
+SET primary_id = nullif(members.primary_id, photo.id), updated_on = now()
+FROM members
+WHERE photo.id = members.id
+AND photo.primary_id IS DISTINCT FROM nullif(members.primary_id, photo.id)
+"""
+
+
+def update_groups(content_identifiers, burst_uuids):
+    # Regroups every photo sharing one of the identifiers in a single
+    # statement, using photo_content_identifier_idx and photo_burst_uuid_idx.
+    # Returns the number of photos whose primary changed.
+    content_identifiers = list({x for x in content_identifiers if x is not None})
+    burst_uuids = list({x for x in burst_uuids if x is not None})
+    if len(content_identifiers) == 0 and len(burst_uuids) == 0:
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            GROUP_SQL.format(table=connection.ops.quote_name(Photo._meta.db_table)),
+            {"content_identifiers": content_identifiers, "burst_uuids": burst_uuids},
+        )
+        return cursor.rowcount
@@ -0,0 +1,379 @@
+import contextlib
+import hashlib
+import os
+import pathlib
+
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Q
+
+from photos.derive import (
+    derive_fields,
+    get_camera,
+    get_file_type,
+    get_lens,
+    get_mime_type,
+)
+from photos.grouping import update_groups
+from photos.models import Photo
+from utils import exif, phash
+from utils.datetime import timestamp_to_datetime
+from utils.db import copy_from_objects
+from utils.logging import ProgressReporter, get_logger
+from utils.metrics import Metrics
+from utils.prefetch import Prefetcher, order_file_paths
+from utils.sidecars import pair_sidecars
+
+
+logger = get_logger(__name__)
+
+
+BATCH_SIZE = 100
+
+
+class ImporterException(Exception):
+    pass
+
+
+def walk(path):
+    path = pathlib.Path(path)
+    if not path.exists():
+        raise ImporterException(f"Path does not exist: {path}")
+    if path.is_dir():
+        file_paths = path.glob("**/*")
+    elif path.is_file():
+        file_paths = [path]
+    else:
+        raise ImporterException(f"Path is neither a directory nor a file: {path}")
+    file_paths = sorted([x for x in file_paths if x.is_file()])
+    if len(file_paths) == 0:
+        raise ImporterException(f"No files found at: {path}")
+    return file_paths
+
+
+def get_shard(key, count):
+    # Stable across hosts and processes, unlike hash()
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def walk_shard(path, index, count, by="path"):
+    # Files under path assigned to shard index of count, by their path relative
+    # to path or by their top-level directory. Sidecars are assigned to the
+    # shard of their file. file_path is stored as found, every host must mount
+    # path at the same absolute path or would import its files again.
+    path = pathlib.Path(path)
+    if by == "directory" and path.is_dir():
+        # Only the top-level directories of this shard are walked
+        file_paths = []
+        for child in path.iterdir():
+            if get_shard(child.name, count) != index:
+                continue
+            if child.is_file():
+                file_paths.append(child)
+            elif child.is_dir():
+                file_paths.extend(x for x in child.glob("**/*") if x.is_file())
+        return sorted(file_paths)
+    file_paths, sidecars, unpaired = pair_sidecars(walk(path))
+    file_paths = [
+        x
+        for x in [*file_paths, *unpaired]
+        if get_shard(x.relative_to(path).as_posix(), count) == index
+    ]
+    return sorted({*file_paths, *(sidecars[x] for x in file_paths if x in sidecars)})
+
+
+class Importer:
+    def __init__(
+        self,
+        profile=exif.DEFAULT_PROFILE,
+        metrics=None,
+        batch_size=BATCH_SIZE,
+        synchronous_commit=True,
+        copy=False,
+        cache=None,
+        import_run=None,
+        shard=None,
+        shard_by="path",
+        order="path",
+        prefetch=0,
+        prefetch_mode=None,
+        phash=False,
+    ):
+        self.profile = profile
+        self.metrics = metrics or Metrics()
+        self.progress = ProgressReporter(logger)
+        self.batch_size = batch_size
+        self.synchronous_commit = synchronous_commit
+        self.copy = copy
+        self.cache = cache
+        # Progress is saved after every batch, see: ImportRun
+        self.import_run = import_run
+        # (index, count) to only import part of the files, see: walk_shard()
+        self.shard = shard
+        self.shard_by = shard_by
+        # Read scheduling, see: utils.prefetch
+        self.order = order
+        self.prefetch = prefetch
+        self.prefetch_mode = prefetch_mode
+        self.prefetcher = None
+        # Perceptual hashes may run exiftool up to 3 more times per image, see:
+        # utils.phash.open_image(). Otherwise ./manage.py near_duplicates
+        # computes the missing ones.
+        self.phash = phash
+        # FileType, MimeType, Camera and Lens rows by lookup arguments
+        self.dimensions = {}
+        # {file path: XMP sidecar path}, see: utils.sidecars
+        self.sidecars = {}
+        # (content_identifier, burst_uuid) of re-imported photos whose
+        # identifiers changed, their previous groups are updated by import_batch()
+        self.previous_identifiers = []
+
+    def walk(self, path):
+        with self.metrics.stage("walk"):
+            if self.shard is None:
+                return walk(path)
+            return walk_shard(path, *self.shard, by=self.shard_by)
+
+    def run(self, file_paths):
+        if self.copy and Photo.objects.exists():
+            raise ImporterException("COPY can only be used to load an empty library")
+        with self.metrics.stage("pair"):
+            file_paths, self.sidecars, unpaired = pair_sidecars(file_paths)
+        for file_path in unpaired:
+            logger.debug("Sidecar without a file, skipping: %s", file_path)
+        self.metrics.increment("files", len(unpaired))
+        self.metrics.increment("skipped", len(unpaired))
+        with self.metrics.stage("order"):
+            file_paths = order_file_paths(file_paths, self.order)
+        if self.prefetch > 0:
+            self.prefetcher = Prefetcher(
+                file_paths, distance=self.prefetch, mode=self.prefetch_mode
+            )
+        try:
+            with self.prefetcher or contextlib.nullcontext():
+                self.import_batches(file_paths)
+        finally:
+            self.prefetcher = None
+        # Perceptual hashes may run exiftool up to 3 more times per image, see:
+        # utils.phash.open_image(). Otherwise ./manage.py near_duplicates
+        # computes the missing ones.
+        self.phash = phash
+
+    def import_batches(self, file_paths):
+        for index in range(0, len(file_paths), self.batch_size):
+            self.metrics.set_gauge("pending_files", len(file_paths) - index)
+            self.import_batch(
+                [(x, None) for x in file_paths[index : index + self.batch_size]]
+            )
+            self.progress.update(
+                min(index + self.batch_size, len(file_paths)),
+                len(file_paths),
+                self.metrics.rate(),
+            )
+            if self.import_run is not None:
+                self.import_run.update_from_metrics(self.metrics)
+                self.import_run.save()
+        self.metrics.set_gauge("pending_files", 0)
+
+    def import_batch(self, items):
+        # items: [(file_path, metadata or None to run exiftool), ...]
+        # Files are extracted before the transaction starts, it only holds locks
+        # for as long as the writes take.
+        photos = []
+        for file_path, metadata in items:
+            photo = self.import_file(file_path, metadata=metadata)
+            if photo is not None:
+                photos.append(photo)
+            # Sidecars are counted along with their file
+            self.metrics.increment("files", 2 if file_path in self.sidecars else 1)
+            if self.prefetcher is not None:
+                self.prefetcher.done()
+        # One transaction per batch instead of one per save()
+        with transaction.atomic():
+            if not self.synchronous_commit:
+                # Commits return before the WAL is flushed to disk, a crash may
+                # lose the last few batches but never corrupts the database
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL synchronous_commit = off")
+            with self.metrics.stage("db_write"):
+                if self.copy:
+                    copy_from_objects(Photo, photos)
+                else:
+                    photos = [
+                        x for x in self.skip_concurrent_inserts(photos) if self.save(x)
+                    ]
+        # After the commit, groups may span batches and other shards' imports
+        identifiers = [
+            *[(x.content_identifier, x.burst_uuid) for x in photos],
+            *self.previous_identifiers,
+        ]
+        self.previous_identifiers = []
+        with self.metrics.stage("group"):
+            grouped = update_groups(
+                [x[0] for x in identifiers], [x[1] for x in identifiers]
+            )
+        self.metrics.increment("imported", len(photos))
+        self.metrics.increment("grouped", grouped)
+        return photos
+
+    def save(self, photo):
+        # One savepoint per photo, a failing row doesn't roll back its batch.
+        # Returns whether the photo was saved.
+        try:
+            with transaction.atomic():
+                photo.save()
+        except (IntegrityError, DataError):
+            logger.exception("Could not save photo: %s", photo.file_path)
+            self.metrics.increment("errors")
+            return False
+        return True
+
+    def skip_concurrent_inserts(self, photos):
+        # Files inserted by another import since import_file() looked them up,
+        # e.g. the watcher's, are skipped like INSERT ... ON CONFLICT DO NOTHING.
+        # Partitioned, the unique index on (file_path, taken_on) would let a
+        # different taken_on insert the file twice, see: photos.partitions.
+        # Run inside the batch transaction, the locks are held until it commits.
+        file_paths = sorted({str(x.file_path) for x in photos if x.id is None})
+        if len(file_paths) == 0:
+            return photos
+        with connection.cursor() as cursor:
+            # Sorted, concurrent batches lock in the same order
+            cursor.execute(
+                "SELECT pg_advisory_xact_lock(hashtextextended(%s || x, 0)) "
+                "FROM unnest(%s::text[]) AS x",
+                [f"{Photo._meta.db_table}:", file_paths],
+            )
+        existing = set(
+            Photo.objects.filter(file_path__in=file_paths).values_list(
+                "file_path", flat=True
+            )
+        )
+        for file_path in existing:
+            logger.debug("Imported concurrently, skipping: %s", file_path)
+        return [
+            x for x in photos if x.id is not None or str(x.file_path) not in existing
+        ]
+
+    def get_dimension(self, function, *args):
+        # Each row is looked up once per import instead of once per file
+        key = (function, *args)
+        if key not in self.dimensions:
+            self.dimensions[key] = function(*args)
+        return self.dimensions[key]
+
+    def sync(self, changed, deleted):
+        # Applies a batch of changes from utils.watch.watch()
+        if len(deleted) > 0:
+            q = Q()
+            for path in deleted:
+                # Deleted or moved away directories are reported once
+                q |= Q(file_path=path) | Q(file_path__startswith=f"{path}{os.sep}")
+            photos = Photo.objects.filter(q)
+            # Members of a deleted primary are set to NULL, their groups get a
+            # new primary
+            identifiers = list(
+                photos.filter(
+                    Q(content_identifier__isnull=False) | Q(burst_uuid__isnull=False)
+                ).values_list("content_identifier", "burst_uuid")
+            )
+            with self.metrics.stage("db_write"):
+                count, _ = photos.delete()
+            self.metrics.increment("deleted", count)
+            logger.info("Deleted %d photos", count)
+            with self.metrics.stage("group"):
+                grouped = update_groups(
+                    [x[0] for x in identifiers], [x[1] for x in identifiers]
+                )
+            self.metrics.increment("grouped", grouped)
+        changed = [x for x in changed if x.is_file()]
+        if len(changed) > 0:
+            logger.info("Importing %d changed files", len(changed))
+            self.run(changed)
+
+    def import_file(self, file_path, metadata=None):
+        # Returns an unsaved Photo, or None if the file was skipped
+        logger.debug("Processing: %s", file_path)
+        if metadata is None:
+            sidecar_path = self.sidecars.get(file_path)
+            if sidecar_path is not None:
+                self.metrics.increment("sidecars")
+            try:
+                with self.metrics.stage("extract"):
+                    metadata = exif.get_metadata(
+                        file_path=file_path,
+                        profile=self.profile,
+                        cache=self.cache,
+                        sidecar_path=sidecar_path,
+                    )
+            except exif.ExifException:
+                logger.exception("Could not retrieve file metadata: %s", file_path)
+                self.metrics.increment("errors")
+                return None
+        file_type = exif.get_file_type(metadata)
+        mime_type = exif.get_mime_type(metadata)
+        if not (mime_type.startswith("image/") or mime_type.startswith("video/")):
+            logger.debug(
+                "File is neither an image nor a video, skipping: %s", file_path
+            )
+            self.metrics.increment("skipped")
+            return None
+
+        with self.metrics.stage("derive"):
+            file_type = self.get_dimension(get_file_type, file_type)
+            mime_type = self.get_dimension(get_mime_type, mime_type)
+            fields = derive_fields(file_path, metadata)
+            camera = self.get_dimension(get_camera, *fields.pop("camera"))
+            lens = self.get_dimension(get_lens, *fields.pop("lens"))
+
+        with self.metrics.stage("stat"):
+            stat = os.stat(file_path)
+        self.metrics.increment("bytes", stat.st_size)
+
+        photo = None
+        if not self.copy:
+            with self.metrics.stage("db_read"):
+                photo = Photo.objects.filter(file_path=file_path).first()
+        if photo is None:
+            photo = Photo()
+        if photo.file_size != stat.st_size or photo.file_mtime != timestamp_to_datetime(
+            stat.st_mtime
+        ):
+            # File contents may have changed, see: ./manage.py duplicates and
+            # ./manage.py near_duplicates
+            photo.partial_hash = None
+            photo.content_hash = None
+            photo.perceptual_hash = None
+        previous_identifiers = (photo.content_identifier, photo.burst_uuid)
+        photo.file_name = file_path.name
+        photo.file_path = file_path
+        photo.file_size = stat.st_size
+        photo.file_atime = timestamp_to_datetime(stat.st_atime)
+        photo.file_mtime = timestamp_to_datetime(stat.st_mtime)
+        photo.file_ctime = timestamp_to_datetime(stat.st_ctime)
+        photo.file_type = file_type
+        photo.mime_type = mime_type
+        for field_name, value in fields.items():
+            setattr(photo, field_name, value)
+        if photo.id is not None and previous_identifiers != (
+            photo.content_identifier,
+            photo.burst_uuid,
+        ):
+            # Ungrouped until import_batch() regroups both the previous and the
+            # current identifiers
+            photo.primary_id = None
+            self.previous_identifiers.append(previous_identifiers)
+        photo.camera = camera
+        photo.lens = lens
+        photo.metadata = metadata
+        if (
+            self.phash
+            and photo.perceptual_hash is None
+            and mime_type.name.startswith("image/")
+        ):
+            try:
+                with self.metrics.stage("phash"):
+                    photo.perceptual_hash = phash.get_perceptual_hash(file_path)
+            except phash.PerceptualHashException:
+                logger.exception("Could not compute perceptual hash: %s", file_path)
+        return photo
@@ -0,0 +1,193 @@
+import asyncio
+import collections
+import http
+import json
+import os
+import pathlib
+
+from asgiref.sync import sync_to_async
+
+from utils import exif
+from utils.logging import get_logger
+from utils.sidecars import is_sidecar, pair_sidecars
+
+
+logger = get_logger(__name__)
+
+
+# Paths waiting for exiftool, IngestService.submit() waits while it is full
+QUEUE_SIZE = 10000
+
+# Extracted metadata waiting for the database, exiftool waits while it is full
+WRITE_QUEUE_SIZE = 500
+
+CONCURRENCY = os.cpu_count()
+
+# Seconds POST /batches waits for room in the queue before answering 503
+SUBMIT_TIMEOUT = 5
+
+
+class IngestService:
+    def __init__(
+        self,
+        importer,
+        concurrency=CONCURRENCY,
+        queue_size=QUEUE_SIZE,
+        write_queue_size=WRITE_QUEUE_SIZE,
+    ):
+        self.importer = importer
+        self.concurrency = concurrency
+        self.paths = asyncio.Queue(maxsize=queue_size)
+        self.results = asyncio.Queue(maxsize=write_queue_size)
+        self.extracting = 0
+        self.writing = 0
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [
+            asyncio.create_task(self.extract()) for _ in range(self.concurrency)
+        ]
+        self.tasks.append(asyncio.create_task(self.write()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def join(self):
+        await self.paths.join()
+        await self.results.join()
+
+    async def submit(self, paths, timeout=None):
+        # Returns the number of paths accepted before timeout. Files are queued
+        # with their XMP sidecar, a sidecar submitted without its file queues
+        # the file, see: utils.sidecars
+        paths = [pathlib.Path(x) for x in paths]
+        _, sidecars, _ = await asyncio.to_thread(pair_sidecars, paths)
+        submitted = set(paths)
+        files_by_sidecar = collections.defaultdict(list)
+        for file_path, sidecar_path in sidecars.items():
+            if file_path not in submitted:
+                files_by_sidecar[sidecar_path].append(file_path)
+        accepted = 0
+        try:
+            async with asyncio.timeout(timeout):
+                for path in paths:
+                    if is_sidecar(path):
+                        items = [(x, path) for x in files_by_sidecar[path]]
+                    else:
+                        items = [(path, sidecars.get(path))]
+                    for item in items:
+                        await self.paths.put(item)
+                    accepted += 1
+        except TimeoutError:
+            pass
+        self.importer.metrics.set_gauge("pending_files", self.paths.qsize())
+        return accepted
+
+    async def extract(self):
+        metrics = self.importer.metrics
+        while True:
+            path, sidecar_path = await self.paths.get()
+            # Any error is counted rather than ending the task, join() waits
+            # for every path to be marked done
+            try:
+                if sidecar_path is not None:
+                    metrics.increment("sidecars")
+                self.extracting += 1
+                try:
+                    with metrics.stage("extract"):
+                        metadata = await exif.get_metadata_async(
+                            path,
+                            profile=self.importer.profile,
+                            cache=self.importer.cache,
+                            sidecar_path=sidecar_path,
+                        )
+                except Exception:
+                    logger.exception("Could not retrieve file metadata: %s", path)
+                    metrics.increment("errors")
+                    metrics.increment("files")
+                    metadata = None
+                finally:
+                    self.extracting -= 1
+                if metadata is not None:
+                    # Waits while the database falls behind
+                    await self.results.put((path, metadata))
+                    metrics.set_gauge("pending_writes", self.results.qsize())
+            finally:
+                self.paths.task_done()
+
+    async def write(self):
+        metrics = self.importer.metrics
+        while True:
+            items = [await self.results.get()]
+            while len(items) < self.importer.batch_size and not self.results.empty():
+                items.append(self.results.get_nowait())
+            self.writing = len(items)
+            try:
+                # The ORM is synchronous, batches are written in a single thread
+                await sync_to_async(self.importer.import_batch)(items)
+            except Exception:
+                logger.exception("Could not import batch of %d files", len(items))
+                metrics.increment("errors", len(items))
+            finally:
+                self.writing = 0
+            for _ in items:
+                self.results.task_done()
+
+    def status(self):
+        metrics = self.importer.metrics
+        return {
+            "queued": self.paths.qsize(),
+            "queue_size": self.paths.maxsize,
+            "extracting": self.extracting,
+            "pending_writes": self.results.qsize(),
+            "writing": self.writing,
+            "files_per_second": metrics.rate(),
+            **metrics.to_dict(),
+        }
+
+    async def route(self, method, target, body):
+        if target == "/status" and method == "GET":
+            return http.HTTPStatus.OK, self.status()
+        if target == "/batches" and method == "POST":
+            paths = json.loads(body)["paths"]
+            if not isinstance(paths, list) or not all(
+                isinstance(x, str) for x in paths
+            ):
+                raise ValueError("paths must be a list of strings")
+            accepted = await self.submit(paths, timeout=SUBMIT_TIMEOUT)
+            if accepted < len(paths):
+                return http.HTTPStatus.SERVICE_UNAVAILABLE, {"accepted": accepted}
+            return http.HTTPStatus.ACCEPTED, {"accepted": accepted}
+        return http.HTTPStatus.NOT_FOUND, {"error": f"Not found: {method} {target}"}
+
+    async def handle_request(self, reader, writer):
+        # Minimal HTTP/1.1, one request per connection
+        try:
+            method, target, _ = (await reader.readline()).decode().split(" ", 2)
+            headers = {}
+            while (line := await reader.readline()) not in [b"\r\n", b"\n", b""]:
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            status, response = await self.route(method, target, body)
+        except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError) as e:
+            status, response = http.HTTPStatus.BAD_REQUEST, {"error": str(e)}
+        data = json.dumps(response).encode()
+        writer.write(
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n"
+            "\r\n".encode()
+            + data
+        )
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle_request, host, port)
+        logger.info("Listening on http://%s:%d", host, port)
+        return server
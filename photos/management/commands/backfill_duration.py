@@ -0,0 +1,28 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from .reprocess import CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute Photo.duration from stored metadata, without running exiftool. "
+        "Same as: ./manage.py reprocess --fields duration"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of rows fetched and updated per query",
+        )
+
+    def handle(self, *args, **options):
+        call_command(
+            "reprocess",
+            fields=["duration"],
+            chunk_size=options["batch_size"],
+            stdout=self.stdout,
+            stderr=self.stderr,
+        )
@@ -0,0 +1,248 @@
+import contextlib
+import json
+import pathlib
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from photos.derive import derive_fields
+from photos.models import Photo
+from utils import exif, fastexif, prefetch
+from utils.formatting import bytes_to_human_readable
+from utils.tags import tag_predicate_to_q
+
+
+METADATA_SEARCH_PREDICATES = [
+    "EXIF.ISO=3200",
+    "QuickTime.Rotation=90",
+    "EXIF.Make=Apple",
+    "EXIF.ISO>3200",
+]
+
+
+def get_file_paths(path, limit):
+    path = pathlib.Path(path)
+    file_paths = [path] if path.is_file() else path.glob("**/*")
+    file_paths = sorted(x for x in file_paths if x.is_file())
+    return file_paths[:limit]
+
+
+def time_it(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return result, min(timings)
+
+
+class Command(BaseCommand):
+    help = "Run performance benchmarks against the current database"
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+        parser_metadata_search = subparsers.add_parser(
+            "metadata_search",
+            help="Compare metadata tag queries with and without the GIN index",
+        )
+        parser_metadata_search.add_argument(
+            "predicates",
+            nargs="*",
+            default=METADATA_SEARCH_PREDICATES,
+            help="Tag predicates e.g. EXIF.ISO>3200",
+        )
+        parser_metadata_search.add_argument("--repeat", type=int, default=5)
+
+        parser_exif_profiles = subparsers.add_parser(
+            "exif_profiles",
+            help="Compare exiftool extraction profiles",
+        )
+        parser_exif_profiles.add_argument("path", type=str)
+        parser_exif_profiles.add_argument(
+            "--profiles",
+            nargs="+",
+            choices=exif.PROFILES,
+            default=list(exif.PROFILES),
+        )
+        parser_exif_profiles.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Maximum number of files to extract",
+        )
+
+        parser_fast_exif = subparsers.add_parser(
+            "fast_exif",
+            help="Compare utils.fastexif with exiftool on a mixed corpus",
+        )
+        parser_fast_exif.add_argument("path", type=str)
+        parser_fast_exif.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Maximum number of files to read",
+        )
+
+        parser_io_order = subparsers.add_parser(
+            "io_order",
+            help="Compare file orders and prefetching on a cold page cache",
+        )
+        parser_io_order.add_argument("path", type=str)
+        parser_io_order.add_argument(
+            "--orders",
+            nargs="+",
+            choices=prefetch.ORDERS,
+            default=prefetch.ORDERS,
+        )
+        parser_io_order.add_argument(
+            "--distance",
+            type=int,
+            default=prefetch.PREFETCH_DISTANCE,
+            help="Prefetch distance of the runs with prefetching",
+        )
+        parser_io_order.add_argument(
+            "--profile",
+            choices=exif.PROFILES,
+            default="catalog",
+        )
+        parser_io_order.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Maximum number of files to extract",
+        )
+
+    def handle(self, *args, **options):
+        getattr(self, f"benchmark_{options['benchmark']}")(**options)
+
+    def benchmark_metadata_search(self, predicates, repeat, **options):
+        row = "{:<32} {:>10} {:>14} {:>14} {:>8}"
+        self.stdout.write(
+            row.format("predicate", "rows", "index (ms)", "seq scan (ms)", "speedup")
+        )
+        for predicate in predicates:
+            queryset = Photo.objects.filter(tag_predicate_to_q(predicate))
+            count, index_time = time_it(queryset.count, repeat)
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_bitmapscan = off")
+                    cursor.execute("SET LOCAL enable_indexscan = off")
+                _, seq_scan_time = time_it(queryset.count, repeat)
+            self.stdout.write(
+                row.format(
+                    predicate,
+                    count,
+                    f"{index_time * 1000:.2f}",
+                    f"{seq_scan_time * 1000:.2f}",
+                    f"{seq_scan_time / index_time:.1f}x",
+                )
+            )
+            self.stdout.write(f"    {queryset.explain().splitlines()[0]}")
+
+    def benchmark_exif_profiles(self, path, profiles, limit, **options):
+        file_paths = get_file_paths(path, limit)
+        row = "{:<12} {:>8} {:>8} {:>12} {:>14} {:>12}"
+        self.stdout.write(
+            row.format(
+                "profile", "files", "errors", "files/sec", "JSON bytes", "tags/file"
+            )
+        )
+        for profile in profiles:
+            errors = 0
+            json_bytes = 0
+            tags = 0
+            start = time.perf_counter()
+            for file_path in file_paths:
+                try:
+                    metadata = exif.get_metadata(file_path=file_path, profile=profile)
+                except exif.ExifException:
+                    errors += 1
+                    continue
+                # Size of the parsed JSON, minus exiftool's indentation
+                json_bytes += len(json.dumps(metadata))
+                tags += sum(len(x) for x in metadata.values() if isinstance(x, dict))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                row.format(
+                    profile,
+                    len(file_paths),
+                    errors,
+                    f"{len(file_paths) / elapsed:.1f}",
+                    bytes_to_human_readable(json_bytes),
+                    f"{tags / max(len(file_paths) - errors, 1):.1f}",
+                )
+            )
+
+    def benchmark_fast_exif(self, path, limit, **options):
+        file_paths = get_file_paths(path, limit)
+        results = {}
+        row = "{:<18} {:>8} {:>8} {:>12}"
+        self.stdout.write(row.format("reader", "files", "read", "files/sec"))
+        for reader, get_metadata in [
+            ("fastexif", fastexif.get_metadata),
+            (
+                "exiftool catalog",
+                lambda x: exif.get_metadata(file_path=x, profile="catalog"),
+            ),
+            ("fast profile", lambda x: exif.get_metadata(file_path=x, profile="fast")),
+        ]:
+            results[reader] = {}
+            start = time.perf_counter()
+            for file_path in file_paths:
+                try:
+                    results[reader][file_path] = get_metadata(file_path)
+                except (fastexif.FastExifException, exif.ExifException):
+                    pass
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                row.format(
+                    reader,
+                    len(file_paths),
+                    len(results[reader]),
+                    f"{len(file_paths) / elapsed:.1f}",
+                )
+            )
+        # Files read by both for which the derived Photo fields differ
+        mismatches = [
+            file_path
+            for file_path, metadata in results["fastexif"].items()
+            if file_path in results["exiftool catalog"]
+            and derive_fields(file_path, metadata)
+            != derive_fields(file_path, results["exiftool catalog"][file_path])
+        ]
+        self.stdout.write(f"Derived field mismatches: {len(mismatches)}")
+        for file_path in mismatches[:10]:
+            self.stdout.write(f"    {file_path}")
+
+    def benchmark_io_order(self, path, orders, distance, profile, limit, **options):
+        # Pages of the files are dropped before every run with
+        # posix_fadvise(POSIX_FADV_DONTNEED), which needs no root but only drops
+        # clean pages of this host: a NAS's own cache stays warm.
+        file_paths = get_file_paths(path, limit)
+        row = "{:<12} {:>10} {:>8} {:>12}"
+        self.stdout.write(row.format("order", "prefetch", "files", "files/sec"))
+        for order in orders:
+            ordered = prefetch.order_file_paths(file_paths, order)
+            for prefetch_distance in [0, distance]:
+                for file_path in ordered:
+                    prefetch.evict(file_path)
+                prefetcher = prefetch.Prefetcher(ordered, distance=prefetch_distance)
+                start = time.perf_counter()
+                with prefetcher if prefetch_distance else contextlib.nullcontext():
+                    for file_path in ordered:
+                        try:
+                            exif.get_metadata(file_path=file_path, profile=profile)
+                        except exif.ExifException:
+                            pass
+                        prefetcher.done()
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    row.format(
+                        order,
+                        prefetch_distance,
+                        len(ordered),
+                        f"{len(ordered) / elapsed:.1f}",
+                    )
+                )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from photos.duplicates import (
+    WORKERS,
+    get_duplicate_content_hashes,
+    get_duplicate_groups,
+    update_hashes,
+)
+from utils.formatting import bytes_to_human_readable
+
+
+class Command(BaseCommand):
+    help = "Find photos with identical file contents"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=WORKERS,
+            help="Number of threads used for hashing files",
+        )
+        parser.add_argument(
+            "--no-hash",
+            action="store_true",
+            help="Only report duplicates among already hashed files",
+        )
+
+    def handle(self, *args, **options):
+        if not options["no_hash"]:
+            update_hashes(workers=options["workers"])
+        content_hashes = [
+            x["content_hash"] for x in get_duplicate_content_hashes().iterator()
+        ]
+        wasted_bytes = 0
+        for group in get_duplicate_groups(content_hashes):
+            wasted_bytes += group[0].file_size * (len(group) - 1)
+            self.stdout.write(
+                f"{group[0].content_hash} ({len(group)} x {bytes_to_human_readable(group[0].file_size)})"
+            )
+            for photo in group:
+                self.stdout.write(f"    {photo.file_path}")
+        self.stdout.write(
+            f"{len(content_hashes)} duplicate groups, {bytes_to_human_readable(wasted_bytes)} wasted"
+        )
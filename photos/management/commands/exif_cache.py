@@ -0,0 +1,123 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photos.importer import walk
+from utils import exif, exifcache
+from utils.formatting import bytes_to_human_readable
+from utils.logging import ProgressReporter, get_logger
+
+
+logger = get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Prewarm, verify or inspect the extracted metadata cache, see: EXIF_CACHE_PATH"
+    )
+
+    def add_arguments(self, parser):
+        subparsers = parser.add_subparsers(dest="action", required=True)
+
+        parser_prewarm = subparsers.add_parser(
+            "prewarm",
+            help="Extract and cache the metadata of every file under path",
+        )
+        parser_prewarm.add_argument("path", type=str)
+        parser_prewarm.add_argument(
+            "--profile",
+            choices=exif.PROFILES,
+            default=exif.DEFAULT_PROFILE,
+        )
+        parser_prewarm.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of concurrent exiftool processes",
+        )
+
+        parser_verify = subparsers.add_parser(
+            "verify",
+            help="Compare cached metadata with exiftool and delete stale entries",
+        )
+        parser_verify.add_argument("path", type=str)
+        parser_verify.add_argument(
+            "--profile",
+            choices=exif.PROFILES,
+            default=exif.DEFAULT_PROFILE,
+        )
+
+        subparsers.add_parser("stats", help="Show the number and size of entries")
+
+        subparsers.add_parser(
+            "evict",
+            help="Evict the least recently used entries down to EXIF_CACHE_MAX_SIZE",
+        )
+
+    def handle(self, *args, **options):
+        cache = exifcache.get_cache()
+        if cache is None:
+            raise CommandError("EXIF_CACHE_PATH is not set")
+        getattr(self, options["action"])(cache, **options)
+
+    def prewarm(self, cache, path, profile, workers, **options):
+        file_paths = walk(path)
+        progress = ProgressReporter(logger)
+        entries = cache.stats()["entries"]
+        errors = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    exif.get_metadata, file_path=x, profile=profile, cache=cache
+                )
+                for x in file_paths
+            ]
+            for index, (file_path, future) in enumerate(zip(file_paths, futures)):
+                try:
+                    future.result()
+                except exif.ExifException:
+                    logger.exception("Could not retrieve file metadata: %s", file_path)
+                    errors += 1
+                progress.update(index + 1, len(file_paths))
+        logger.info(
+            "Files: %d, newly cached: %d, errors: %d",
+            len(file_paths),
+            cache.stats()["entries"] - entries,
+            errors,
+        )
+
+    def verify(self, cache, path, profile, **options):
+        exiftool_version = exif.get_exiftool_version()
+        checked = 0
+        stale = 0
+        for file_path in walk(path):
+            key = cache.get_key(
+                file_path, exiftool_version, exif.get_profile_id(profile)
+            )
+            cached = cache.get(key)
+            if cached is None:
+                continue
+            checked += 1
+            try:
+                metadata = exif.get_metadata(file_path=file_path, profile=profile)
+            except exif.ExifException:
+                logger.exception("Could not retrieve file metadata: %s", file_path)
+                continue
+            if exifcache.remove_volatile_tags(metadata) != cached:
+                logger.warning("Stale cache entry: %s", file_path)
+                cache.delete(key)
+                stale += 1
+        logger.info("Checked: %d, stale: %d", checked, stale)
+
+    def stats(self, cache, **options):
+        stats = cache.stats()
+        self.stdout.write(f"Path: {cache.path}")
+        self.stdout.write(f"Entries: {stats['entries']}")
+        self.stdout.write(
+            f"Size: {bytes_to_human_readable(stats['size'])}"
+            f" / {bytes_to_human_readable(stats['max_size'])}"
+        )
+
+    def evict(self, cache, **options):
+        logger.info("Evicted: %d", cache.evict())
@@ -0,0 +1,207 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from photos.models import Photo
+from utils.tags import TagPredicateException, tag_predicate_to_q
+
+
+CHUNK_SIZE = 5000
+
+# Column name => queryset.values() expression
+FIELDS = {
+    "id": "id",
+    "created_on": "created_on",
+    "updated_on": "updated_on",
+    "file_name": "file_name",
+    "file_path": "file_path",
+    "is_image": "is_image",
+    "is_video": "is_video",
+    "file_size": "file_size",
+    "file_atime": "file_atime",
+    "file_mtime": "file_mtime",
+    "file_ctime": "file_ctime",
+    "file_type": "file_type__name",
+    "mime_type": "mime_type__name",
+    "image_width": "image_width",
+    "image_height": "image_height",
+    "megapixels": "megapixels",
+    "taken_on": "taken_on",
+    "duration": "duration",
+    "gps_latitude": "gps_latitude",
+    "gps_longitude": "gps_longitude",
+    "gps_altitude": "gps_altitude",
+    "camera_make": "camera__make",
+    "camera_model": "camera__model",
+    "lens_make": "lens__make",
+    "lens_model": "lens__model",
+    "metadata": "metadata",
+}
+
+
+def to_string(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return json.dumps(value, sort_keys=True)
+    return value
+
+
+def json_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_csv(rows, columns, file):
+    writer = csv.writer(file)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([to_string(x) for x in row])
+
+
+def write_jsonl(rows, columns, file):
+    for row in rows:
+        file.write(json.dumps(dict(zip(columns, row)), default=json_default) + "\n")
+
+
+def get_parquet_type(pyarrow, column):
+    field = Photo._meta.get_field(FIELDS[column].split("__")[0])
+    if FIELDS[column] != field.name:
+        # Related field e.g. camera__make
+        field = field.related_model._meta.get_field(FIELDS[column].split("__")[1])
+    return {
+        "BigAutoField": pyarrow.int64(),
+        "BooleanField": pyarrow.bool_(),
+        "CharField": pyarrow.string(),
+        "DateTimeField": pyarrow.timestamp("us", tz="UTC"),
+        "FloatField": pyarrow.float64(),
+        "IntegerField": pyarrow.int64(),
+        "JSONField": pyarrow.string(),
+        "PositiveBigIntegerField": pyarrow.uint64(),
+        "PositiveIntegerField": pyarrow.uint32(),
+    }[field.get_internal_type()]
+
+
+def write_parquet(rows, columns, file, chunk_size=CHUNK_SIZE):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise CommandError("pyarrow is required for --format parquet") from e
+    schema = pyarrow.schema(
+        [(column, get_parquet_type(pyarrow, column)) for column in columns]
+    )
+    # One row group per chunk keeps memory usage constant
+    with pyarrow.parquet.ParquetWriter(file, schema) as writer:
+        while chunk := list(itertools.islice(rows, chunk_size)):
+            chunk = [
+                [json.dumps(x) if isinstance(x, dict) else x for x in row]
+                for row in chunk
+            ]
+            writer.write_batch(
+                pyarrow.RecordBatch.from_arrays(
+                    [pyarrow.array(x) for x in zip(*chunk)], schema=schema
+                )
+            )
+
+
+class Command(BaseCommand):
+    help = "Export photos as CSV, JSON Lines or Parquet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            type=str,
+            help="Output file path, - for stdout",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "jsonl", "parquet"],
+            default="csv",
+        )
+        parser.add_argument(
+            "--fields",
+            type=lambda x: x.split(","),
+            default=[x for x in FIELDS if x != "metadata"],
+            help=f"Comma separated list of: {', '.join(FIELDS)}",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of rows fetched per round trip from the server-side cursor",
+        )
+        # Same filters as PhotoAdmin.list_filter
+        parser.add_argument("--is-video", action=argparse.BooleanOptionalAction)
+        parser.add_argument("--file-type", type=int, action="append", help="id")
+        parser.add_argument("--mime-type", type=int, action="append", help="id")
+        parser.add_argument("--camera", type=int, action="append", help="id")
+        parser.add_argument("--lens", type=int, action="append", help="id")
+        parser.add_argument(
+            "--group",
+            choices=["primary", "member"],
+            help="One per group or group members, see: photos.grouping",
+        )
+        parser.add_argument(
+            "--metadata",
+            action="append",
+            help="Tag predicate e.g. EXIF.ISO>3200",
+        )
+
+    def handle(self, *args, **options):
+        unknown_fields = [x for x in options["fields"] if x not in FIELDS]
+        if len(unknown_fields) > 0:
+            raise CommandError(f"Unknown fields: {', '.join(unknown_fields)}")
+        columns = options["fields"]
+
+        photos = Photo.objects.all()
+        # is_video is NULL rather than False for images, see: photo_pre_save()
+        if options["is_video"] is True:
+            photos = photos.filter(is_video=True)
+        elif options["is_video"] is False:
+            photos = photos.exclude(is_video=True)
+        for option, field_name in [
+            ("file_type", "file_type_id"),
+            ("mime_type", "mime_type_id"),
+            ("camera", "camera_id"),
+            ("lens", "lens_id"),
+        ]:
+            if options[option] is not None:
+                photos = photos.filter(**{f"{field_name}__in": options[option]})
+        if options["group"] is not None:
+            photos = photos.filter(primary__isnull=options["group"] == "primary")
+        for predicate in options["metadata"] or []:
+            try:
+                photos = photos.filter(tag_predicate_to_q(predicate))
+            except TagPredicateException as e:
+                raise CommandError(e)
+
+        # .iterator() uses a server-side cursor, only chunk_size rows are held in
+        # memory at any time
+        rows = (
+            photos.order_by("id")
+            .values_list(*[FIELDS[x] for x in columns])
+            .iterator(chunk_size=options["chunk_size"])
+        )
+
+        if options["format"] == "parquet":
+            file = options["path"]
+            if file == "-":
+                # Binary, e.g. sys.stdout.buffer, see: call_command(stdout=...)
+                try:
+                    file = self.stdout.buffer
+                except AttributeError as e:
+                    raise CommandError("stdout has no binary buffer for Parquet") from e
+            write_parquet(rows, columns, file, chunk_size=options["chunk_size"])
+            return
+        write = write_csv if options["format"] == "csv" else write_jsonl
+        if options["path"] == "-":
+            write(rows, columns, self.stdout)
+        else:
+            with open(options["path"], "w", newline="") as file:
+                write(rows, columns, file)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from photos.grouping import update_groups
+from photos.models import Photo
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+CHUNK_SIZE = 1000
+
+
+def get_values(field):
+    return list(
+        Photo.objects.filter(**{f"{field}__isnull": False})
+        .order_by(field)
+        .values_list(field, flat=True)
+        .distinct()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Regroup every Live Photo and burst, e.g. after ./manage.py reprocess "
+        "--fields content_identifier,burst_uuid or concurrent sharded imports"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of identifiers regrouped per query",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        content_identifiers = get_values("content_identifier")
+        burst_uuids = get_values("burst_uuid")
+        logger.info(
+            "Regrouping %d Live Photos and %d bursts",
+            len(content_identifiers),
+            len(burst_uuids),
+        )
+        grouped = 0
+        for index in range(0, len(content_identifiers), chunk_size):
+            grouped += update_groups(
+                content_identifiers[index : index + chunk_size], []
+            )
+        for index in range(0, len(burst_uuids), chunk_size):
+            grouped += update_groups([], burst_uuids[index : index + chunk_size])
+        logger.info("Updated %d photos", grouped)
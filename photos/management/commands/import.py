@@ -1,19 +1,31 @@
+import argparse
+import datetime
 import pathlib
-import os
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
 
-from photos.models import Photo, FileType, MimeType, Camera, Lens
-from utils import exif
+from photos.importer import BATCH_SIZE, Importer
+from photos.models import ImportRun
+from photos.plan import get_plan
+from utils import exif, exifcache, prefetch, profiling, watch
+from utils.formatting import bytes_to_human_readable
 from utils.logging import get_logger
-from utils.datetime import extract_datetime, timestamp_to_datetime
 
 
 logger = get_logger(__name__)
 
 
-class ImporterException(Exception):
-    pass
+def parse_shard(value):
+    # "i/N" => (i - 1, N)
+    index, _, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected i/N e.g. 1/4, got: {value}")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"Expected 1 <= i <= N, got: {value}")
+    return index - 1, count
 
 
 class Command(BaseCommand):
@@ -25,82 +37,209 @@ class Command(BaseCommand):
             type=str,
             help="Path to directory containing photos",
         )
+        parser.add_argument(
+            "--profile",
+            choices=exif.PROFILES,
+            default=exif.DEFAULT_PROFILE,
+            help="exiftool extraction profile, catalog only extracts the tags PhotoTrip uses",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Number of files imported per transaction",
+        )
+        parser.add_argument(
+            "--synchronous-commit-off",
+            action="store_true",
+            help="Don't wait for the WAL flush on commit, a crash may lose the last few batches",
+        )
+        parser.add_argument(
+            "--copy",
+            action="store_true",
+            help="Load photos with COPY, only for the initial import into an empty library",
+        )
+        parser.add_argument(
+            "--shard",
+            type=parse_shard,
+            help="Only import the i-th of N disjoint parts of path e.g. 1/4, to import from several hosts at once. path must be the same absolute path on every host",
+        )
+        parser.add_argument(
+            "--shard-by",
+            choices=["path", "directory"],
+            default="path",
+            help="Assign files to shards by their path or by their top-level directory, directory only walks the directories of the shard",
+        )
+        parser.add_argument(
+            "--order",
+            choices=prefetch.ORDERS,
+            default="path",
+            help="Order files are read in, directory or inode reduce seeks on spinning disks and network mounts",
+        )
+        parser.add_argument(
+            "--prefetch",
+            type=int,
+            default=0,
+            help=f"Read the start and end of up to this many files ahead of exiftool on a background thread, e.g. {prefetch.PREFETCH_DISTANCE}",
+        )
+        parser.add_argument(
+            "--prefetch-mode",
+            choices=prefetch.PREFETCH_MODES,
+            help="fadvise hints the kernel to read asynchronously, read reads the bytes, defaults to fadvise where available",
+        )
+        parser.add_argument(
+            "--plan",
+            action="store_true",
+            help="Only report what an import would do and how long it would take, without running exiftool or writing to the database",
+        )
+        parser.add_argument(
+            "--watch",
+            action="store_true",
+            help="Keep running and import files as they are created, modified, moved or deleted, run a regular import first",
+        )
+        parser.add_argument(
+            "--poll",
+            action="store_true",
+            help="Watch by polling directory mtimes instead of using inotify",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=watch.POLL_INTERVAL_SECONDS,
+        )
+        parser.add_argument(
+            "--debounce",
+            type=float,
+            default=watch.DEBOUNCE_SECONDS,
+            help="Seconds without new events before a batch of changes is imported",
+        )
+        parser.add_argument(
+            "--phash",
+            action="store_true",
+            help="Compute perceptual hashes of images while importing instead of in ./manage.py near_duplicates",
+        )
+        parser.add_argument(
+            "--no-exif-cache",
+            action="store_true",
+            help="Always run exiftool, ignoring EXIF_CACHE_PATH",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            type=str,
+            help="Write per-stage timings to this file, .prom for Prometheus text format, JSON otherwise",
+        )
+        parser.add_argument(
+            "--cprofile",
+            type=str,
+            metavar="DIRECTORY",
+            help="Write a cProfile .pstats and .txt summary per stage to a new directory in this one",
+        )
 
     def handle(self, *args, **options):
-        path = pathlib.Path(options["path"])
-        if not path.exists():
-            raise ImporterException(f"Path does not exist: {path}")
-        if path.is_dir():
-            file_paths = path.glob("**/*")
-        elif path.is_file():
-            file_paths = [path]
-        else:
-            raise ImporterException(f"Path is neither a directory nor a file: {path}")
-        file_paths = sorted([x for x in file_paths if x.is_file()])
-        if len(file_paths) == 0:
-            raise ImporterException(f"No files found at: {path}")
+        if options["shard"] is not None:
+            for option in ["plan", "watch", "copy"]:
+                if options[option]:
+                    raise CommandError(f"--{option} can't be used with --shard")
+            if not pathlib.Path(options["path"]).is_absolute():
+                raise CommandError("--shard requires an absolute path")
+        if options["plan"]:
+            self.plan(**options)
+            return
+        importer = Importer(
+            profile=options["profile"],
+            batch_size=options["batch_size"],
+            synchronous_commit=not options["synchronous_commit_off"],
+            copy=options["copy"],
+            cache=None if options["no_exif_cache"] else exifcache.get_cache(),
+            phash=options["phash"],
+            shard=options["shard"],
+            shard_by=options["shard_by"],
+            order=options["order"],
+            prefetch=options["prefetch"],
+            prefetch_mode=options["prefetch_mode"],
+        )
+        if options["cprofile"]:
+            importer.metrics.profiler = profiling.StageProfiler()
+        import_run = None
+        watcher = None
+        try:
+            if options["watch"]:
+                # Started before the regular import, files changed while it runs
+                # are imported once it is done
+                watcher = watch.get_watcher(
+                    options["path"],
+                    polling=options["poll"],
+                    poll_interval=options["poll_interval"],
+                )
+            import_run = ImportRun.objects.create(
+                path=options["path"],
+                profile=options["profile"],
+                shard=(
+                    f"{options['shard'][0] + 1}/{options['shard'][1]}"
+                    if options["shard"]
+                    else ""
+                ),
+            )
+            importer.import_run = import_run
+            file_paths = importer.walk(options["path"])
+            import_run.total_files = len(file_paths)
+            import_run.save()
+            importer.run(file_paths)
+            import_run.finished_on = timezone.now()
+            if watcher is not None:
+                # Watching isn't part of the run, see: ./manage.py import --plan
+                import_run.update_from_metrics(importer.metrics)
+                import_run.save()
+                import_run = importer.import_run = None
+                self.watch(importer, watcher, **options)
+        finally:
+            if watcher is not None:
+                watcher.close()
+            logger.info("Import summary:\n%s", importer.metrics.summary_table())
+            if options["metrics_file"]:
+                importer.metrics.dump(options["metrics_file"])
+            if options["cprofile"]:
+                directory = importer.metrics.profiler.dump(options["cprofile"])
+                logger.info("Stage profiles written to %s", directory)
+            if import_run is not None:
+                import_run.update_from_metrics(importer.metrics)
+                import_run.save()
 
-        for file_path in file_paths:
-            logger.info(f"Processing: {file_path}")
-            try:
-                metadata = exif.get_metadata(file_path=file_path)
-            except exif.ExifException:
-                logger.exception(f"Could not retrieve file metadata: {file_path}")
-                continue
-            file_type = exif.get_file_type(metadata)
-            mime_type = exif.get_mime_type(metadata)
-            if not (mime_type.startswith("image/") or mime_type.startswith("video/")):
-                logger.info(
-                    f"File is neither an image nor a video, skipping: {file_path}"
+    def plan(self, path, profile, **options):
+        plan = get_plan(path, profile)
+        counts = plan["counts"]
+        self.stdout.write(
+            f"Files: {plan['files']} ({bytes_to_human_readable(plan['bytes'])})"
+        )
+        self.stdout.write(
+            f"New: {counts['new']}, changed: {counts['changed']}, "
+            f"unchanged: {counts['unchanged']}, deleted: {counts['deleted']}"
+        )
+        self.stdout.write("")
+        row = "{:<32} {:>10} {:>12}"
+        self.stdout.write(row.format("MIME type (guessed)", "files", "size"))
+        for mime_type, totals in plan["mime_types"].items():
+            self.stdout.write(
+                row.format(
+                    mime_type,
+                    totals["files"],
+                    bytes_to_human_readable(totals["bytes"]),
                 )
-                continue
-            file_type, created = FileType.objects.update_or_create(
-                name=file_type,
             )
-            mime_type, created = MimeType.objects.update_or_create(
-                name=mime_type,
+        self.stdout.write("")
+        if plan["eta"] is None:
+            self.stdout.write("ETA: unknown, no previous import runs")
+        else:
+            self.stdout.write(
+                f"ETA: {datetime.timedelta(seconds=round(plan['eta']))}"
+                f" at {plan['files_per_second']:.1f} files/sec"
+                f" (profile {profile}, unchanged files are extracted again)"
             )
-            image_width, image_height = exif.get_image_width_image_height(metadata)
-            megapixels = exif.get_megapixels(metadata)
-            taken_on = exif.get_taken_on(metadata) or extract_datetime(file_path)
-            gps_latitude, gps_longitude = exif.get_gps_latitude_gps_longitude(metadata)
-            gps_altitude = exif.get_gps_altitude(metadata)
-            camera_make, camera_model = exif.get_camera_make_camera_model(metadata)
-            if camera_make is not None or camera_model is not None:
-                camera, created = Camera.objects.update_or_create(
-                    make=camera_make or "",
-                    model=camera_model or "",
-                )
-            else:
-                camera = None
-            lens_make, lens_model = exif.get_lens_make_lens_model(metadata)
-            if lens_make is not None or lens_model is not None:
-                lens, created = Lens.objects.update_or_create(
-                    make=lens_make or "",
-                    model=lens_model or "",
-                )
-            else:
-                lens = None
-            stat = os.stat(file_path)
-            photo = Photo.objects.filter(file_path=file_path).first()
-            if photo is None:
-                photo = Photo()
-            photo.file_name = file_path.name
-            photo.file_path = file_path
-            photo.file_size = stat.st_size
-            photo.file_atime = timestamp_to_datetime(stat.st_atime)
-            photo.file_mtime = timestamp_to_datetime(stat.st_mtime)
-            photo.file_ctime = timestamp_to_datetime(stat.st_ctime)
-            photo.file_type = file_type
-            photo.mime_type = mime_type
-            photo.image_width = image_width
-            photo.image_height = image_height
-            photo.megapixels = megapixels
-            photo.taken_on = taken_on
-            photo.gps_latitude = gps_latitude
-            photo.gps_longitude = gps_longitude
-            photo.gps_altitude = gps_altitude
-            photo.camera = camera
-            photo.lens = lens
-            photo.metadata = metadata
-            photo.save()
+
+    def watch(self, importer, watcher, path, debounce, **options):
+        logger.info("Watching: %s", path)
+        try:
+            for changed, deleted in watch.watch(watcher, debounce=debounce):
+                importer.sync(changed, deleted)
+        except KeyboardInterrupt:
+            pass
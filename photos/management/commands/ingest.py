@@ -0,0 +1,101 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from photos import ingest
+from photos.importer import BATCH_SIZE, Importer
+from utils import exif, exifcache
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the ingestion service: POST /batches with {"paths": [...]} to queue '
+        "files, GET /status for progress"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            help="Files or directories to queue on startup",
+        )
+        parser.add_argument(
+            "--host",
+            default="127.0.0.1",
+            help="Anyone who can reach the server can queue files, keep it local",
+        )
+        parser.add_argument("--port", type=int, default=8001)
+        parser.add_argument(
+            "--exit-when-done",
+            action="store_true",
+            help="Exit once the paths given on the command line are imported",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=ingest.CONCURRENCY,
+            help="Number of concurrent exiftool processes",
+        )
+        parser.add_argument("--queue-size", type=int, default=ingest.QUEUE_SIZE)
+        parser.add_argument(
+            "--write-queue-size", type=int, default=ingest.WRITE_QUEUE_SIZE
+        )
+        parser.add_argument(
+            "--profile",
+            choices=exif.PROFILES,
+            default=exif.DEFAULT_PROFILE,
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help="Maximum number of files imported per transaction",
+        )
+        parser.add_argument("--synchronous-commit-off", action="store_true")
+        parser.add_argument(
+            "--phash",
+            action="store_true",
+            help="Compute perceptual hashes of images while importing instead of in ./manage.py near_duplicates",
+        )
+        parser.add_argument(
+            "--no-exif-cache",
+            action="store_true",
+            help="Always run exiftool, ignoring EXIF_CACHE_PATH",
+        )
+
+    def handle(self, *args, **options):
+        importer = Importer(
+            profile=options["profile"],
+            batch_size=options["batch_size"],
+            synchronous_commit=not options["synchronous_commit_off"],
+            cache=None if options["no_exif_cache"] else exifcache.get_cache(),
+            phash=options["phash"],
+        )
+        try:
+            asyncio.run(self.run(importer, **options))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            logger.info("Ingest summary:\n%s", importer.metrics.summary_table())
+
+    async def run(self, importer, paths, host, port, exit_when_done, **options):
+        service = ingest.IngestService(
+            importer,
+            concurrency=options["concurrency"],
+            queue_size=options["queue_size"],
+            write_queue_size=options["write_queue_size"],
+        )
+        service.start()
+        server = await service.serve(host, port)
+        for path in paths:
+            await service.submit(importer.walk(path))
+        if exit_when_done:
+            await service.join()
+        else:
+            await server.serve_forever()
+        server.close()
+        await service.stop()
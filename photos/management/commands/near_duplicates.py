@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+
+from photos.duplicates import WORKERS, hash_photos
+from photos.models import Photo
+from utils.bktree import BKTree
+from utils.phash import (
+    PerceptualHashException,
+    get_perceptual_hash,
+    hamming_distance,
+)
+
+
+class Command(BaseCommand):
+    help = "Find resized or recompressed copies of the same image"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--distance",
+            type=int,
+            default=4,
+            help="Maximum number of differing bits between perceptual hashes",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=WORKERS,
+            help="Number of threads used for hashing images without a perceptual hash",
+        )
+
+    def handle(self, *args, **options):
+        photos = Photo.objects.filter(is_image=True, perceptual_hash__isnull=True).only(
+            "id", "file_path"
+        )
+        hash_photos(
+            list(photos),
+            "perceptual_hash",
+            get_perceptual_hash,
+            workers=options["workers"],
+            exceptions=(PerceptualHashException,),
+        )
+
+        # Building the tree is O(n log n) and each query only visits the branches
+        # within --distance, instead of comparing all O(n^2) pairs
+        tree = BKTree(hamming_distance)
+        hashes = Photo.objects.filter(
+            is_image=True, perceptual_hash__isnull=False
+        ).values_list("id", "perceptual_hash")
+        for id, perceptual_hash in hashes.iterator(chunk_size=10000):
+            tree.add(perceptual_hash, id)
+
+        groups = []
+        seen = set()
+        for id, perceptual_hash in hashes.iterator(chunk_size=10000):
+            if id in seen:
+                continue
+            group = tree.search(perceptual_hash, options["distance"])
+            if len(group) > 1:
+                group.sort()
+                groups.append(group)
+                seen.update(x for _, x in group)
+
+        file_paths = dict(
+            Photo.objects.filter(id__in=seen).values_list("id", "file_path")
+        )
+        for group in groups:
+            self.stdout.write(f"{len(group)} photos")
+            for distance, id in group:
+                self.stdout.write(f"    {distance:>2} {file_paths[id]}")
+        self.stdout.write(
+            f"{len(groups)} near-duplicate groups among {len(tree)} images"
+        )
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from photos import partitions
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Create taken_on year partitions of photos_photo for the coming years and "
+        "for photos in the default partition, run e.g. yearly or after imports"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--convert",
+            action="store_true",
+            help="Convert an unpartitioned photos_photo first, rewrites the table and locks it throughout",
+        )
+        parser.add_argument(
+            "--years-ahead",
+            type=int,
+            default=1,
+            help="Number of years after the current one to create partitions for",
+        )
+        parser.add_argument(
+            "--list",
+            action="store_true",
+            help="Only list partitions",
+        )
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            if not partitions.is_partitioned(cursor):
+                if not options["convert"]:
+                    raise CommandError(
+                        f"{partitions.TABLE} is not partitioned, see: --convert"
+                    )
+                logger.info("Converting %s", partitions.TABLE)
+                with transaction.atomic():
+                    partitions.partition(cursor)
+            if not options["list"]:
+                for year in partitions.get_missing_years(
+                    cursor, options["years_ahead"]
+                ):
+                    # One short transaction per year
+                    with transaction.atomic():
+                        moved = partitions.create_partition(cursor, year)
+                    logger.info(
+                        "Created partition for %d, moved %d photos", year, moved
+                    )
+            row = "{:<32} {:<72} {:>12}"
+            self.stdout.write(row.format("partition", "bounds", "rows (est.)"))
+            for name, bounds, rows in partitions.get_partitions(cursor):
+                self.stdout.write(row.format(name, bounds, max(rows, 0)))
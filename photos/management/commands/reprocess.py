@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+
+from photos.derive import DERIVED_FIELDS, derive_fields, get_camera, get_lens
+from photos.models import Photo
+from utils.db import bulk_update_from_values, close_connections
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+CHUNK_SIZE = 2000
+
+RANGE_SIZE = 20000
+
+
+def reprocess_range(first_id, last_id, field_names, chunk_size):
+    # Runs in a worker process with its own database connection.
+    # Returns (number of photos processed, number of photos updated).
+    cameras = {}
+    lenses = {}
+    photos = (
+        Photo.objects.filter(id__gte=first_id, id__lt=last_id)
+        .only("id", "file_path", "metadata", *field_names)
+        .order_by("id")
+    )
+    processed = 0
+    updated = 0
+    batch = []
+    for photo in photos.iterator(chunk_size=chunk_size):
+        processed += 1
+        try:
+            fields = derive_fields(photo.file_path, photo.metadata)
+        except Exception:
+            logger.exception("Could not derive fields: %s", photo.file_path)
+            continue
+        if "camera" in field_names:
+            if fields["camera"] not in cameras:
+                cameras[fields["camera"]] = get_camera(*fields["camera"])
+            fields["camera"] = cameras[fields["camera"]]
+        if "lens" in field_names:
+            if fields["lens"] not in lenses:
+                lenses[fields["lens"]] = get_lens(*fields["lens"])
+            fields["lens"] = lenses[fields["lens"]]
+        changed = False
+        for field_name in field_names:
+            if field_name in ["camera", "lens"]:
+                value = fields[field_name].id if fields[field_name] else None
+                if getattr(photo, f"{field_name}_id") != value:
+                    setattr(photo, f"{field_name}_id", value)
+                    changed = True
+            elif getattr(photo, field_name) != fields[field_name]:
+                setattr(photo, field_name, fields[field_name])
+                changed = True
+        if changed:
+            batch.append(photo)
+        if len(batch) >= chunk_size:
+            bulk_update_from_values(Photo, batch, field_names)
+            updated += len(batch)
+            batch = []
+    bulk_update_from_values(Photo, batch, field_names)
+    updated += len(batch)
+    return processed, updated
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute derived Photo fields from stored metadata, without running exiftool"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fields",
+            type=lambda x: x.split(","),
+            default=DERIVED_FIELDS,
+            help=f"Comma separated list of: {', '.join(DERIVED_FIELDS)}",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of worker processes",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=CHUNK_SIZE,
+            help="Number of rows fetched and updated per query",
+        )
+        parser.add_argument(
+            "--range-size",
+            type=int,
+            default=RANGE_SIZE,
+            help="Number of ids handed to a worker at a time",
+        )
+
+    def handle(self, *args, **options):
+        unknown_fields = [x for x in options["fields"] if x not in DERIVED_FIELDS]
+        if len(unknown_fields) > 0:
+            raise CommandError(f"Unknown fields: {', '.join(unknown_fields)}")
+
+        ids = Photo.objects.aggregate(first_id=Min("id"), last_id=Max("id"))
+        if ids["first_id"] is None:
+            return
+        ranges = [
+            (x, x + options["range_size"])
+            for x in range(ids["first_id"], ids["last_id"] + 1, options["range_size"])
+        ]
+
+        # Forked workers must not share the parent's database connection
+        close_connections()
+        processed = 0
+        updated = 0
+        with ProcessPoolExecutor(
+            max_workers=options["workers"],
+            mp_context=multiprocessing.get_context("fork"),
+        ) as executor:
+            futures = [
+                executor.submit(
+                    reprocess_range,
+                    first_id,
+                    last_id,
+                    options["fields"],
+                    options["chunk_size"],
+                )
+                for first_id, last_id in ranges
+            ]
+            for future in as_completed(futures):
+                range_processed, range_updated = future.result()
+                processed += range_processed
+                updated += range_updated
+                logger.info("Processed: %d, updated: %d", processed, updated)
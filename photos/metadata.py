@@ -0,0 +1,41 @@
+from django.db import connection
+from django.db.models.fields.json import KeyTransform
+
+from photos.models import Photo
+
+
+# Seconds the rendered group headings of a photo are cached, keys include
+# updated_on so re-imported photos are rendered again
+HEADINGS_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def get_headings_cache_key(photo):
+    return f"photos:metadata:{photo.id}:{photo.updated_on.timestamp()}"
+
+
+def get_metadata_groups(photo_id):
+    # [(group, number of tags or None for e.g. SourceFile), ...] sorted by group,
+    # computed by PostgreSQL so the metadata isn't sent to Python
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT key, CASE WHEN jsonb_typeof(value) = 'object' "
+            "THEN (SELECT count(*) FROM jsonb_object_keys(value)) END "
+            f"FROM {connection.ops.quote_name(Photo._meta.db_table)}, "
+            "jsonb_each(metadata) WHERE id = %s ORDER BY key",
+            [photo_id],
+        )
+        return cursor.fetchall()
+
+
+def get_metadata_group(photo_id, group):
+    # Tags of one group sorted by name, None if the photo or the group doesn't
+    # exist
+    tags = (
+        Photo.objects.filter(id=photo_id)
+        .annotate(tags=KeyTransform(group, "metadata"))
+        .values_list("tags", flat=True)
+        .first()
+    )
+    if isinstance(tags, dict):
+        return dict(sorted(tags.items()))
+    return tags
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:56
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="photo",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["metadata"],
+                name="photo_metadata_gin",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ),
+    ]
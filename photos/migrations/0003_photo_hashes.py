@@ -0,0 +1,30 @@
+# Generated by Django 5.1.1 on 2026-10-19 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0002_photo_metadata_gin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="content_hash",
+            field=models.CharField(max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="partial_hash",
+            field=models.CharField(max_length=32, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(fields=["file_size"], name="photo_file_size_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(fields=["content_hash"], name="photo_content_hash_idx"),
+        ),
+    ]
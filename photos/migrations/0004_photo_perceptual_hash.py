@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0003_photo_hashes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="perceptual_hash",
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0004_photo_perceptual_hash"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(fields=["taken_on", "id"], name="photo_taken_on_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("taken_on__isnull", True)),
+                fields=["id"],
+                name="photo_null_taken_on_id_idx",
+            ),
+        ),
+    ]
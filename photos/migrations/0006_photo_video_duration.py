@@ -0,0 +1,20 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0005_photo_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("is_video", True)),
+                fields=["duration"],
+                name="photo_video_duration_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0007_import_run"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importrun",
+            name="shard",
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="importrun",
+            name="total_files",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db import migrations
+
+from photos import partitions
+
+
+def partition_photos(apps, schema_editor):
+    if not settings.PHOTO_PARTITIONING:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        if not partitions.is_partitioned(cursor):
+            partitions.partition(cursor)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0008_import_run_shard"),
+    ]
+
+    operations = [
+        # Only when PHOTO_PARTITIONING is set, the model is unchanged.
+        # Reversing leaves the table partitioned.
+        migrations.RunPython(partition_photos, migrations.RunPython.noop),
+    ]
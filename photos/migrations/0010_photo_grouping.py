@@ -0,0 +1,77 @@
+# Generated by Django 5.1.1 on 2026-10-19 18:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("photos", "0009_photo_partitioning"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="photo",
+            name="burst_uuid",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="content_identifier",
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name="photo",
+            name="primary",
+            field=models.ForeignKey(
+                db_constraint=False,
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="members",
+                to="photos.photo",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("content_identifier__isnull", False)),
+                fields=["content_identifier"],
+                name="photo_content_identifier_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("burst_uuid__isnull", False)),
+                fields=["burst_uuid"],
+                name="photo_burst_uuid_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("primary__isnull", False)),
+                fields=["primary"],
+                name="photo_primary_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(("primary__isnull", True)),
+                fields=["taken_on", "id"],
+                name="photo_group_taken_on_id_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="photo",
+            index=models.Index(
+                condition=models.Q(
+                    ("primary__isnull", True), ("taken_on__isnull", True)
+                ),
+                fields=["id"],
+                name="photo_group_null_taken_on_idx",
+            ),
+        ),
+    ]
@@ -1,4 +1,6 @@
 from utils.models import BaseModel
+from utils.tags import JSONPathExists
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.dispatch import receiver
@@ -33,17 +35,91 @@ class Photo(BaseModel):
     lens = models.ForeignKey("Lens", null=True, on_delete=models.PROTECT)
     metadata = models.JSONField()
 
+    # Fields derived from utils.hashing, only computed for files sharing a file_size:
+    partial_hash = models.CharField(max_length=32, null=True)
+    content_hash = models.CharField(max_length=128, null=True)
+
+    # Fields derived from utils.phash, only computed for images:
+    perceptual_hash = models.BigIntegerField(null=True)
+
+    # Live Photo and burst grouping, see: photos.grouping
+    content_identifier = models.CharField(max_length=64, null=True)
+    burst_uuid = models.CharField(max_length=64, null=True)
+    # Null for the item representing its group and for ungrouped photos. No
+    # foreign key constraint, PHOTO_PARTITIONING allows no foreign keys to
+    # photos_photo.
+    primary = models.ForeignKey(
+        "self",
+        null=True,
+        on_delete=models.SET_NULL,
+        related_name="members",
+        db_constraint=False,
+        db_index=False,
+    )
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
                 fields=["file_path"], name="unique_photo_file_path"
             ),
         ]
+        indexes = [
+            # jsonb_path_ops only supports @>, @? and @@ but is a fraction of the
+            # size of the default jsonb_ops, which also indexes every key
+            GinIndex(
+                fields=["metadata"],
+                name="photo_metadata_gin",
+                opclasses=["jsonb_path_ops"],
+            ),
+            # Keyset pagination, see: photos.views.get_photo_querysets()
+            models.Index(fields=["taken_on", "id"], name="photo_taken_on_id_idx"),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(taken_on__isnull=True),
+                name="photo_null_taken_on_id_idx",
+            ),
+            models.Index(
+                fields=["duration"],
+                condition=models.Q(is_video=True),
+                name="photo_video_duration_idx",
+            ),
+            models.Index(fields=["file_size"], name="photo_file_size_idx"),
+            models.Index(fields=["content_hash"], name="photo_content_hash_idx"),
+            models.Index(
+                fields=["content_identifier"],
+                condition=models.Q(content_identifier__isnull=False),
+                name="photo_content_identifier_idx",
+            ),
+            models.Index(
+                fields=["burst_uuid"],
+                condition=models.Q(burst_uuid__isnull=False),
+                name="photo_burst_uuid_idx",
+            ),
+            models.Index(
+                fields=["primary"],
+                condition=models.Q(primary__isnull=False),
+                name="photo_primary_idx",
+            ),
+            # Keyset pagination of one item per group
+            models.Index(
+                fields=["taken_on", "id"],
+                condition=models.Q(primary__isnull=True),
+                name="photo_group_taken_on_id_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(taken_on__isnull=True, primary__isnull=True),
+                name="photo_group_null_taken_on_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.file_name
 
 
+Photo._meta.get_field("metadata").register_lookup(JSONPathExists)
+
+
 @receiver(pre_save, sender=Photo)
 def photo_pre_save(sender, instance, *args, **kwargs):
     if instance.mime_type.name.startswith("image/"):
@@ -122,3 +198,34 @@ def lens_pre_save(sender, instance, *args, **kwargs):
         instance.position = Lens.Position.BACK
     elif " front " in instance.model:
         instance.position = Lens.Position.FRONT
+
+
+class ImportRun(BaseModel):
+    # One row per ./manage.py import, created_on is when it started.
+    # Updated after every batch, throughput history for ./manage.py import --plan
+    path = models.CharField(max_length=4096)
+    profile = models.CharField(max_length=32)
+    # e.g. "2/4" when imported by several hosts, see: ./manage.py import --shard
+    shard = models.CharField(max_length=32, blank=True)
+    total_files = models.PositiveIntegerField(default=0)
+    files = models.PositiveIntegerField(default=0)
+    bytes = models.PositiveBigIntegerField(default=0)
+    imported = models.PositiveIntegerField(default=0)
+    skipped = models.PositiveIntegerField(default=0)
+    errors = models.PositiveIntegerField(default=0)
+    elapsed = models.FloatField(default=0)
+    metrics = models.JSONField(null=True)
+    # Null while running or if interrupted
+    finished_on = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.created_on})"
+
+    def update_from_metrics(self, metrics):
+        self.files = metrics.counters["files"]
+        self.bytes = metrics.counters["bytes"]
+        self.imported = metrics.counters["imported"]
+        self.skipped = metrics.counters["skipped"]
+        self.errors = metrics.counters["errors"]
+        self.elapsed = metrics.elapsed()
+        self.metrics = metrics.to_dict()
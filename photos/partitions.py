@@ -0,0 +1,172 @@
+import datetime
+
+
+# Optional range partitioning of Photo by taken_on year, see: PHOTO_PARTITIONING
+# in settings.py and ./manage.py partition_photos.
+# Plain table names so migrations can use this module.
+TABLE = "photos_photo"
+
+PARTITION_KEY = "taken_on"
+
+# NULL taken_on values and years without a partition
+DEFAULT_PARTITION = f"{TABLE}_default"
+
+
+class PartitionException(Exception):
+    pass
+
+
+def get_partition_name(year):
+    return f"{TABLE}_y{year}"
+
+
+def get_bounds(year):
+    # Years are UTC, like every taken_on comparison in the database
+    return (
+        datetime.datetime(year, 1, 1, tzinfo=datetime.UTC).isoformat(),
+        datetime.datetime(year + 1, 1, 1, tzinfo=datetime.UTC).isoformat(),
+    )
+
+
+def is_partitioned(cursor):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)",
+        [TABLE],
+    )
+    return cursor.fetchone()[0]
+
+
+def get_years(cursor, table):
+    cursor.execute(
+        f"SELECT DISTINCT extract(year FROM {PARTITION_KEY} AT TIME ZONE 'UTC')::int "
+        f"FROM {table} WHERE {PARTITION_KEY} IS NOT NULL ORDER BY 1"
+    )
+    return [x for (x,) in cursor.fetchall()]
+
+
+def partition(cursor):
+    # Rebuilds TABLE as a partitioned table and copies every row, holding an
+    # ACCESS EXCLUSIVE lock throughout. Run inside a transaction.
+    # Unique indexes must include the partition key, the ones on id and
+    # file_path become unique indexes on (id, taken_on) and (file_path,
+    # taken_on) of the same name. NULL taken_on values are not distinct.
+    # A file_path is no longer unique across years, see:
+    # Importer.skip_concurrent_inserts().
+    old_table = f"{TABLE}_unpartitioned"
+    # Deferred foreign key checks of rows written earlier in the transaction
+    # would otherwise block DROP TABLE
+    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    cursor.execute("SELECT current_setting('server_version_num')::int")
+    if cursor.fetchone()[0] < 150000:
+        raise PartitionException("NULLS NOT DISTINCT requires PostgreSQL 15")
+    cursor.execute(
+        "SELECT count(*) FROM pg_constraint WHERE confrelid = %s::regclass",
+        [TABLE],
+    )
+    if cursor.fetchone()[0] > 0:
+        raise PartitionException(f"Foreign keys reference {TABLE}")
+    cursor.execute(
+        "SELECT pg_get_indexdef(i.indexrelid), i.indisunique, c.relname, "
+        "i.indexprs IS NULL AND i.indpred IS NULL, array("
+        "SELECT pg_get_indexdef(i.indexrelid, k, true) "
+        "FROM generate_series(1, i.indnkeyatts) AS k ORDER BY k"
+        ") FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE i.indrelid = %s::regclass",
+        [TABLE],
+    )
+    indexes = []
+    for definition, unique, name, plain, columns in cursor.fetchall():
+        if unique:
+            if not plain:
+                raise PartitionException(f"Unsupported unique index: {definition}")
+            if PARTITION_KEY not in columns:
+                columns.append(PARTITION_KEY)
+            definition = (
+                f"CREATE UNIQUE INDEX {name} ON {TABLE} ({', '.join(columns)}) "
+                f"NULLS NOT DISTINCT"
+            )
+        indexes.append(definition)
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype = 'f'",
+        [TABLE],
+    )
+    foreign_keys = cursor.fetchall()
+
+    cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {old_table}")
+    cursor.execute(
+        f"CREATE TABLE {TABLE} (LIKE {old_table} INCLUDING DEFAULTS "
+        f"INCLUDING CONSTRAINTS INCLUDING STORAGE) "
+        f"PARTITION BY RANGE ({PARTITION_KEY})"
+    )
+    cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+    for year in get_years(cursor, old_table):
+        start, end = get_bounds(year)
+        cursor.execute(
+            f"CREATE TABLE {get_partition_name(year)} PARTITION OF {TABLE} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {old_table}")
+    # Also drops the identity sequence and every index
+    cursor.execute(f"DROP TABLE {old_table}")
+
+    cursor.execute(f"ALTER TABLE {TABLE} ALTER id ADD GENERATED BY DEFAULT AS IDENTITY")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), coalesce(max(id), 0) + 1, false) "
+        f"FROM {TABLE}",
+        [TABLE],
+    )
+    # Indexes created on the parent are created on every partition
+    for index in indexes:
+        cursor.execute(index)
+    for name, definition in foreign_keys:
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}")
+    # Autovacuum never analyzes partitioned tables themselves
+    cursor.execute(f"ANALYZE {TABLE}")
+
+
+def create_partition(cursor, year):
+    # Moves the year's rows out of the default partition, the new partition
+    # can't be attached while the default partition holds rows it would accept.
+    # Returns the number of rows moved.
+    name = get_partition_name(year)
+    start, end = get_bounds(year)
+    cursor.execute(
+        f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS "
+        f"INCLUDING CONSTRAINTS INCLUDING STORAGE)"
+    )
+    cursor.execute(
+        f"WITH moved AS ("
+        f"DELETE FROM {DEFAULT_PARTITION} "
+        f"WHERE {PARTITION_KEY} >= %s AND {PARTITION_KEY} < %s RETURNING *"
+        f") INSERT INTO {name} SELECT * FROM moved",
+        [start, end],
+    )
+    moved = cursor.rowcount
+    # Matching partitions of the parent's indexes are created on attach
+    cursor.execute(
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    )
+    cursor.execute(f"ANALYZE {name}")
+    return moved
+
+
+def get_partitions(cursor):
+    # [(name, bounds, estimated rows), ...]
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = %s::regclass ORDER BY c.relname",
+        [TABLE],
+    )
+    return cursor.fetchall()
+
+
+def get_missing_years(cursor, years_ahead=1):
+    # Years with rows in the default partition, plus the coming years
+    existing = {x[0] for x in get_partitions(cursor)}
+    this_year = datetime.datetime.now(datetime.UTC).year
+    years = set(get_years(cursor, DEFAULT_PARTITION))
+    years.update(range(this_year, this_year + years_ahead + 1))
+    return sorted(x for x in years if get_partition_name(x) not in existing)
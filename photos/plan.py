@@ -0,0 +1,99 @@
+import collections
+import mimetypes
+import os
+import pathlib
+
+from django.db.models import Q
+
+from photos.importer import ImporterException
+from photos.models import ImportRun, Photo
+from utils.datetime import timestamp_to_datetime
+
+
+# Number of previous runs the throughput estimate is averaged over
+RUN_HISTORY = 5
+
+
+def scan(path):
+    # Returns {file path: (size, mtime)} without the per-file pathlib and
+    # is_file() calls of importer.walk(), os.scandir() already knows which
+    # entries are files.
+    path = pathlib.Path(path)
+    if path.is_file():
+        stat = path.stat()
+        return {str(path): (stat.st_size, stat.st_mtime)}
+    if not path.is_dir():
+        raise ImporterException(f"Path does not exist: {path}")
+    files = {}
+    directories = [str(path)]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    files[entry.path] = (stat.st_size, stat.st_mtime)
+    return files
+
+
+def get_mime_type(file_path):
+    return mimetypes.guess_type(file_path)[0] or "unknown"
+
+
+def get_files_per_second(profile):
+    # Files per second over the last finished runs, preferring the same profile
+    runs = ImportRun.objects.filter(finished_on__isnull=False, files__gt=0)
+    for queryset in [runs.filter(profile=profile), runs]:
+        history = list(
+            queryset.order_by("-id").values_list("files", "elapsed")[:RUN_HISTORY]
+        )
+        if history:
+            elapsed = sum(x[1] for x in history)
+            return sum(x[0] for x in history) / elapsed if elapsed else None
+    return None
+
+
+def get_plan(path, profile):
+    # Diffs the files under path against Photo, no exiftool and no writes
+    files = scan(path)
+    path = str(pathlib.Path(path))
+    photos = (
+        Photo.objects.filter(
+            Q(file_path=path) | Q(file_path__startswith=f"{path}{os.sep}")
+        )
+        .values_list("file_path", "file_size", "file_mtime")
+        .iterator(chunk_size=10000)
+    )
+    counts = collections.Counter(new=0, changed=0, unchanged=0, deleted=0)
+    seen = set()
+    for file_path, file_size, file_mtime in photos:
+        if file_path not in files:
+            counts["deleted"] += 1
+            continue
+        seen.add(file_path)
+        size, mtime = files[file_path]
+        if size == file_size and timestamp_to_datetime(mtime) == file_mtime:
+            counts["unchanged"] += 1
+        else:
+            counts["changed"] += 1
+    counts["new"] = len(files) - len(seen)
+
+    mime_types = collections.defaultdict(lambda: {"files": 0, "bytes": 0})
+    for file_path, (size, mtime) in files.items():
+        mime_type = mime_types[get_mime_type(file_path)]
+        mime_type["files"] += 1
+        mime_type["bytes"] += size
+
+    files_per_second = get_files_per_second(profile)
+    return {
+        "files": len(files),
+        "bytes": sum(x[0] for x in files.values()),
+        "counts": dict(counts),
+        "mime_types": dict(
+            sorted(mime_types.items(), key=lambda x: x[1]["bytes"], reverse=True)
+        ),
+        "files_per_second": files_per_second,
+        # Every file is extracted again, unchanged ones included
+        "eta": len(files) / files_per_second if files_per_second else None,
+    }
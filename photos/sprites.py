@@ -0,0 +1,60 @@
+import hashlib
+
+from django.core.cache import cache
+
+from photos.models import Photo
+from utils.sprites import make_sprite
+
+
+# Keys are derived from every member's thumbnail and updated_on, a changed
+# thumbnail gives a new key and the stale sprite expires
+SPRITE_CACHE_TIMEOUT = 7 * 24 * 60 * 60
+
+MAX_SPRITE_PHOTOS = 256
+
+
+def get_members(ids):
+    # {id: (thumbnail, updated_on)} of the photos with a thumbnail
+    photos = Photo.objects.filter(id__in=ids).exclude(thumbnail="")
+    return {
+        id: (thumbnail, updated_on)
+        for id, thumbnail, updated_on in photos.values_list(
+            "id", "thumbnail", "updated_on"
+        )
+    }
+
+
+def get_sprite_key(ids, members):
+    hash = hashlib.blake2b(digest_size=16)
+    for id in ids:
+        thumbnail, updated_on = members.get(id, ("", None))
+        updated_on = "" if updated_on is None else updated_on.isoformat()
+        hash.update(f"{id}:{thumbnail}:{updated_on};".encode())
+    return hash.hexdigest()
+
+
+def open_thumbnail(thumbnail):
+    storage = Photo._meta.get_field("thumbnail").storage
+    try:
+        return storage.open(thumbnail, "rb")
+    except OSError:
+        return None
+
+
+def get_sprite(ids, members):
+    # Returns (JPEG bytes, {id: [x, y, width, height] or None}) of the
+    # thumbnails of ids in grid order, see: get_members(), utils.sprites
+    key = get_sprite_key(ids, members)
+    cache_key = f"photos:sprite:{key}"
+    sprite = cache.get(cache_key)
+    if sprite is None:
+        files = [open_thumbnail(members[x][0]) if x in members else None for x in ids]
+        try:
+            contents, offsets = make_sprite(files)
+        finally:
+            for file in files:
+                if file is not None:
+                    file.close()
+        sprite = (contents, dict(zip(ids, offsets)))
+        cache.set(cache_key, sprite, SPRITE_CACHE_TIMEOUT)
+    return sprite
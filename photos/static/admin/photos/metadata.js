@@ -0,0 +1,51 @@
+"use strict";
+
+// Fetches the tags of a metadata group the first time its heading is
+// expanded, see: PhotoAdmin.metadata_display()
+
+function renderTags(tags) {
+    if (tags === null || typeof tags !== "object") {
+        const pre = document.createElement("pre");
+        pre.textContent = JSON.stringify(tags);
+        return pre;
+    }
+    const table = document.createElement("table");
+    for (const [name, tag] of Object.entries(tags)) {
+        const row = table.insertRow();
+        row.insertCell().textContent = name;
+        const pre = document.createElement("pre");
+        const value = tag !== null && typeof tag === "object" && "val" in tag ? tag.val : tag;
+        pre.textContent = typeof value === "string" ? value : JSON.stringify(value, null, 4);
+        row.insertCell().append(pre);
+        if (tag !== null && typeof tag === "object" && tag.desc) {
+            row.title = tag.desc;
+        }
+    }
+    return table;
+}
+
+// toggle doesn't bubble, listen during the capture phase
+document.addEventListener(
+    "toggle",
+    async (event) => {
+        const details = event.target;
+        if (!details.open || !details.dataset.url || details.dataset.loaded) {
+            return;
+        }
+        details.dataset.loaded = "true";
+        const container = details.querySelector(".photo-metadata-tags");
+        try {
+            const response = await fetch(details.dataset.url, {credentials: "same-origin"});
+            if (!response.ok) {
+                throw new Error(`${response.status} ${response.statusText}`);
+            }
+            const {tags} = await response.json();
+            container.replaceChildren(renderTags(tags));
+        } catch (error) {
+            // Retried the next time the heading is expanded
+            delete details.dataset.loaded;
+            container.textContent = error.message;
+        }
+    },
+    true,
+);
@@ -1,6 +1,65 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import logging
+import multiprocessing
+import os
+import struct
+import pathlib
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from random import Random
+from unittest import mock
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, connection, transaction
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+import pyarrow.parquet
+from PIL import Image
+
+from photos.admin import YearFilter
+from photos.derive import derive_fields
+from photos.duplicates import (
+    get_duplicate_content_hashes,
+    get_duplicate_groups,
+    update_hashes,
+)
+from photos.importer import Importer, walk, walk_shard
+from photos.ingest import IngestService
+from photos.models import Camera, FileType, ImportRun, Lens, MimeType, Photo
+from photos import partitions
+from photos.grouping import update_groups
+from photos.metadata import get_headings_cache_key
+from photos.plan import get_plan
+from utils import exif, exifcache, fastexif, profiling
+from utils.bktree import BKTree
 from utils.datetime import parse_datetime, extract_datetime, timestamp_to_datetime
+from utils.db import (
+    bulk_update_from_values,
+    copy_from_objects,
+    get_or_create_conflict_safe,
+)
+from utils.hashing import get_content_hash, get_partial_hash
+from utils.logging import ProgressReporter, QueueStreamHandler, get_logger
+from utils.metrics import Histogram, Metrics
+from utils.prefetch import Prefetcher, get_ranges, order_file_paths
+from utils.profiling import StageProfiler
+from utils.sidecars import pair_sidecars
+from utils.phash import get_perceptual_hash, hamming_distance, to_signed, to_unsigned
+from utils.tags import (
+    TagPredicate,
+    TagPredicateException,
+    parse_tag_predicate,
+    tag_predicate_to_jsonpath,
+    tag_predicate_to_q,
+)
+from utils.watch import InotifyWatcher, PollingWatcher, watch
 
 
 class DatetimeTestCase(TestCase):
@@ -101,3 +160,1792 @@ class DatetimeTestCase(TestCase):
         self.assertEqual(timestamp_to_datetime(97831086100000000), None)
         # OverflowError
         self.assertEqual(timestamp_to_datetime(9783108610000000000), None)
+
+
+class TagsTestCase(TestCase):
+    def test_parse_tag_predicate(self):
+        # (input, expected)
+        test_data = [
+            ("EXIF.ISO>3200", TagPredicate("EXIF", "ISO", ">", 3200)),
+            ("EXIF.ISO >= 3200", TagPredicate("EXIF", "ISO", ">=", 3200)),
+            ("QuickTime.Rotation=90", TagPredicate("QuickTime", "Rotation", "=", 90)),
+            ("EXIF.FNumber<2.8", TagPredicate("EXIF", "FNumber", "<", 2.8)),
+            ("EXIF.Make!=Apple", TagPredicate("EXIF", "Make", "!=", "Apple")),
+            ('EXIF.Model="iPhone 12"', TagPredicate("EXIF", "Model", "=", "iPhone 12")),
+            ('EXIF.Model="90"', TagPredicate("EXIF", "Model", "=", "90")),
+            (
+                "Composite.GPSLatitude",
+                TagPredicate("Composite", "GPSLatitude", None, None),
+            ),
+        ]
+        for input, expected in test_data:
+            self.assertEqual(parse_tag_predicate(input), expected)
+        for input in [
+            "EXIF",
+            "EXIF.ISO>",
+            "EXIF.Make>Apple",
+            ".ISO=1",
+            "EXIF.ISO>inf",
+            "EXIF.ISO=nan",
+            "EXIF.ISO<1e999",
+        ]:
+            with self.assertRaises(TagPredicateException):
+                parse_tag_predicate(input)
+
+    def test_tag_predicate_to_jsonpath(self):
+        self.assertEqual(
+            tag_predicate_to_jsonpath(parse_tag_predicate("EXIF.ISO>3200")),
+            '$."EXIF"."ISO" ? (@.num > 3200 || @.val > 3200)',
+        )
+        self.assertEqual(
+            tag_predicate_to_jsonpath(parse_tag_predicate("EXIF.Make!=Apple")),
+            '$."EXIF"."Make" ? (@.num != "Apple" || @.val != "Apple")',
+        )
+
+    def test_tag_predicate_to_q(self):
+        photos = Photo.objects.filter(tag_predicate_to_q("QuickTime.Rotation=90"))
+        sql = str(photos.query)
+        self.assertIn("@>", sql)
+        photos = Photo.objects.filter(tag_predicate_to_q("EXIF.ISO>3200"))
+        sql = str(photos.query)
+        self.assertIn("@?", sql)
+
+    def test_filter(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        for file_name, metadata in [
+            (
+                "a.jpg",
+                {
+                    "EXIF": {
+                        "ISO": {"val": 6400},
+                        "Make": {"val": "Apple"},
+                        "ExposureTime": {"val": "1/60", "num": 0.0166666666666667},
+                    },
+                    "Composite": {"GPSLatitude": {"val": 41.3881}},
+                },
+            ),
+            ("b.jpg", {"EXIF": {"ISO": {"val": 100}, "Make": {"val": "Canon"}}}),
+        ]:
+            Photo.objects.create(
+                file_name=file_name,
+                file_path=f"/path/to/photos/{file_name}",
+                file_size=1,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=file_type,
+                mime_type=mime_type,
+                metadata=metadata,
+            )
+        # (predicate, expected file names)
+        test_data = [
+            ("EXIF.ISO>3200", ["a.jpg"]),
+            ("EXIF.ISO<=100", ["b.jpg"]),
+            ("EXIF.ISO=6400", ["a.jpg"]),
+            ("EXIF.Make=Apple", ["a.jpg"]),
+            ("EXIF.Make!=Apple", ["b.jpg"]),
+            ("EXIF.ExposureTime<0.02", ["a.jpg"]),
+            ('EXIF.ExposureTime="1/60"', ["a.jpg"]),
+            ("Composite.GPSLatitude", ["a.jpg"]),
+            ("EXIF.Model", []),
+        ]
+        for predicate, expected in test_data:
+            photos = Photo.objects.filter(tag_predicate_to_q(predicate))
+            self.assertEqual(
+                sorted(photos.values_list("file_name", flat=True)), expected, predicate
+            )
+        with self.assertRaises(TagPredicateException):
+            Photo.objects.filter(tag_predicate_to_q("EXIF.ISO>1e999"))
+
+
+class HashingTestCase(TestCase):
+    def test_partial_hash_content_hash(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            contents = bytes(range(256)) * 1024
+            (directory / "a").write_bytes(contents)
+            (directory / "b").write_bytes(contents)
+            # Same size, same head and tail, different middle
+            (directory / "c").write_bytes(
+                contents[: len(contents) // 2]
+                + b"\xff"
+                + contents[len(contents) // 2 + 1 :]
+            )
+            self.assertEqual(
+                get_partial_hash(directory / "a"), get_partial_hash(directory / "b")
+            )
+            self.assertEqual(
+                get_partial_hash(directory / "a"), get_partial_hash(directory / "c")
+            )
+            self.assertEqual(
+                get_content_hash(directory / "a"), get_content_hash(directory / "b")
+            )
+            self.assertNotEqual(
+                get_content_hash(directory / "a"), get_content_hash(directory / "c")
+            )
+            # Different size
+            (directory / "d").write_bytes(contents + b"\x00")
+            self.assertNotEqual(
+                get_partial_hash(directory / "a"), get_partial_hash(directory / "d")
+            )
+
+
+class DuplicatesTestCase(TestCase):
+    def test_duplicates(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        contents = bytes(range(256)) * 1024
+        middle = len(contents) // 2
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            photos = {}
+            for name, data in [
+                ("a.jpg", contents),
+                ("b.jpg", contents),
+                # Same size, head and tail, different middle
+                ("c.jpg", contents[:middle] + b"\xff" + contents[middle + 1 :]),
+                # Same size, different head
+                ("d.jpg", b"\xff" + contents[1:]),
+                # Unique size
+                ("e.jpg", contents + b"\x00"),
+            ]:
+                (directory / name).write_bytes(data)
+                photos[name] = Photo.objects.create(
+                    file_name=name,
+                    file_path=directory / name,
+                    file_size=len(data),
+                    file_atime=now,
+                    file_mtime=now,
+                    file_ctime=now,
+                    file_type=file_type,
+                    mime_type=mime_type,
+                    metadata={},
+                )
+            with self.assertLogs("photos.duplicates", logging.INFO) as logs:
+                update_hashes(workers=2)
+        self.assertEqual(
+            logs.output,
+            [
+                "INFO:photos.duplicates:Computing partial hashes for 4 files",
+                "INFO:photos.duplicates:Computing content hashes for 3 files",
+            ],
+        )
+        for photo in photos.values():
+            photo.refresh_from_db()
+        a, b, c, d, e = photos.values()
+        self.assertEqual(a.partial_hash, c.partial_hash)
+        self.assertNotEqual(a.partial_hash, d.partial_hash)
+        self.assertEqual(a.content_hash, b.content_hash)
+        self.assertNotEqual(a.content_hash, c.content_hash)
+        # Only same-size files are read, only matching partial hashes in full
+        self.assertIsNone(d.content_hash)
+        self.assertEqual((e.partial_hash, e.content_hash), (None, None))
+
+        content_hashes = [x["content_hash"] for x in get_duplicate_content_hashes()]
+        self.assertEqual(content_hashes, [a.content_hash])
+        self.assertEqual(get_duplicate_groups(content_hashes), [[a, b]])
+
+        user = User.objects.create_superuser("admin", password="password")
+        self.client.force_login(user)
+        response = self.client.get(reverse("admin:photos_photo_duplicates"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([x["photos"] for x in response.context["groups"]], [[a, b]])
+        self.assertContains(response, f"<pre>{a.file_path}</pre>")
+        self.assertContains(response, f"<pre>{b.file_path}</pre>")
+        self.assertNotContains(response, "c.jpg")
+
+
+class PerceptualHashTestCase(TestCase):
+    def test_get_perceptual_hash(self):
+        image = (
+            Image.linear_gradient("L")
+            .transpose(Image.Transpose.ROTATE_90)
+            .resize((640, 480))
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            image.save(directory / "a.jpg", quality=95)
+            image.resize((160, 120)).save(directory / "b.jpg", quality=30)
+            image.transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(directory / "c.jpg")
+            a = get_perceptual_hash(directory / "a.jpg")
+            b = get_perceptual_hash(directory / "b.jpg")
+            c = get_perceptual_hash(directory / "c.jpg")
+        self.assertLessEqual(hamming_distance(a, b), 4)
+        self.assertGreater(hamming_distance(a, c), 4)
+
+    def test_signed_unsigned(self):
+        for hash in [0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1]:
+            self.assertTrue(-(1 << 63) <= to_signed(hash) < (1 << 63))
+            self.assertEqual(to_unsigned(to_signed(hash)), hash)
+        self.assertEqual(hamming_distance(to_signed((1 << 64) - 1), 0), 64)
+
+    def test_bktree(self):
+        random = Random(0)
+        hashes = [random.getrandbits(64) for _ in range(1000)]
+        # Near duplicates of the first 10 hashes
+        hashes += [x ^ (1 << random.randrange(64)) for x in hashes[:10]]
+        tree = BKTree(hamming_distance)
+        for id, hash in enumerate(hashes):
+            tree.add(hash, id)
+        self.assertEqual(len(tree), len(hashes))
+        for max_distance in [0, 1, 8, 24]:
+            for hash in hashes[:20]:
+                expected = sorted(
+                    (hamming_distance(hash, x), id)
+                    for id, x in enumerate(hashes)
+                    if hamming_distance(hash, x) <= max_distance
+                )
+                self.assertEqual(sorted(tree.search(hash, max_distance)), expected)
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        # Two photos share a taken_on, two have none
+        for index, taken_on in enumerate(
+            [
+                now + datetime.timedelta(microseconds=2),
+                None,
+                now,
+                now + datetime.timedelta(microseconds=1),
+                now + datetime.timedelta(microseconds=1),
+                None,
+            ]
+        ):
+            Photo.objects.create(
+                file_name=f"{index}.jpg",
+                file_path=f"/path/to/photos/{index}.jpg",
+                file_size=index,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=file_type,
+                mime_type=mime_type,
+                taken_on=taken_on,
+                metadata={"EXIF": {}},
+            )
+        user = User.objects.create_user("staff", is_staff=True)
+        self.client.force_login(user)
+
+    def get(self, path, **kwargs):
+        response = self.client.get(path, **kwargs)
+        return response, json.loads(b"".join(response.streaming_content))
+
+    def test_photo_list(self):
+        file_names = []
+        data = {"limit": 4, "fields": "file_name"}
+        while True:
+            response, page = self.get("/api/photos/", data=data)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(page["results"]), 4)
+            for photo in page["results"]:
+                self.assertEqual(list(photo), ["id", "file_name"])
+                file_names.append(photo["file_name"])
+            if page["next"] is None:
+                break
+            data["cursor"] = page["next"]
+        self.assertEqual(
+            file_names, ["2.jpg", "3.jpg", "4.jpg", "0.jpg", "1.jpg", "5.jpg"]
+        )
+
+        response, page = self.get("/api/photos/", data={"limit": 1})
+        self.assertNotIn("metadata", page["results"][0])
+        etag = response.headers["ETag"]
+        response = self.client.get(
+            "/api/photos/",
+            data={"limit": 1},
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(response.status_code, 304)
+        photo = Photo.objects.get(file_name="2.jpg")
+        photo.file_size = 1
+        photo.save()
+        response = self.client.get(
+            "/api/photos/",
+            data={"limit": 1},
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers["ETag"]
+        # The file type name is part of the page
+        photo.file_type.name = "JPEG"
+        photo.file_type.save()
+        response, page = self.get(
+            "/api/photos/",
+            data={"limit": 1},
+            headers={"If-None-Match": etag},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(page["results"][0]["file_type"], "JPEG")
+
+    def test_taken_on_filter(self):
+        response, page = self.get(
+            "/api/photos/",
+            data={
+                "fields": "file_name",
+                "taken_after": "2000-01-01T00:00:00.000001",
+                "taken_before": "2000-01-01T00:00:00.000002+00:00",
+            },
+        )
+        self.assertEqual([x["file_name"] for x in page["results"]], ["3.jpg", "4.jpg"])
+
+    def test_invalid_parameters(self):
+        for data in [
+            {"limit": 0},
+            {"fields": "foo"},
+            {"cursor": "foo"},
+            {"taken_after": "foo"},
+        ]:
+            response = self.client.get("/api/photos/", data=data)
+            self.assertEqual(response.status_code, 400)
+        self.client.logout()
+        response = self.client.get("/api/photos/")
+        self.assertEqual(response.status_code, 403)
+
+
+class DbTestCase(TestCase):
+    def test_bulk_update_from_values(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        camera = Camera.objects.create(make="Apple", model="iPhone")
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        photos = [
+            Photo.objects.create(
+                file_name=f"{index}.jpg",
+                file_path=f"/path/to/photos/{index}.jpg",
+                file_size=index,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=file_type,
+                mime_type=mime_type,
+                camera=camera,
+                metadata={},
+            )
+            for index in range(3)
+        ]
+        photos[0].duration = 1.5
+        photos[0].camera = None
+        photos[1].taken_on = now
+        photos[1].metadata = {"EXIF": {"ISO": {"val": 100}}}
+        updated_on = photos[2].updated_on
+        updated = bulk_update_from_values(
+            Photo, photos[:2], ["duration", "camera", "taken_on", "metadata"]
+        )
+        self.assertEqual(updated, 2)
+        photos = list(Photo.objects.order_by("id"))
+        self.assertEqual(photos[0].duration, 1.5)
+        self.assertEqual(photos[0].camera, None)
+        self.assertEqual(photos[1].taken_on, now)
+        self.assertEqual(photos[1].camera, camera)
+        self.assertEqual(photos[1].metadata, {"EXIF": {"ISO": {"val": 100}}})
+        self.assertEqual(photos[2].metadata, {})
+        self.assertGreater(photos[0].updated_on, updated_on)
+        self.assertEqual(photos[2].updated_on, updated_on)
+        self.assertEqual(bulk_update_from_values(Photo, [], ["duration"]), 0)
+
+    def test_get_or_create_conflict_safe(self):
+        camera = get_or_create_conflict_safe(Camera, {"make": "Apple", "model": "X"})
+        self.assertEqual(
+            get_or_create_conflict_safe(Camera, {"make": "Apple", "model": "X"}),
+            camera,
+        )
+        self.assertEqual(Camera.objects.count(), 1)
+
+    def test_copy_from_objects(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        photos = [
+            Photo(
+                file_name=f"{index}.jpg",
+                file_path=pathlib.Path(f"/path/to/photos/{index}.jpg"),
+                file_size=index,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=file_type,
+                mime_type=mime_type,
+                taken_on=now if index == 0 else None,
+                metadata={"EXIF": {"ISO": {"val": index}}},
+            )
+            for index in range(3)
+        ]
+        self.assertEqual(copy_from_objects(Photo, photos), 3)
+        photos = list(Photo.objects.order_by("file_path"))
+        self.assertEqual(len(photos), 3)
+        self.assertEqual(photos[0].file_path, "/path/to/photos/0.jpg")
+        self.assertEqual(photos[0].taken_on, now)
+        self.assertEqual(photos[1].taken_on, None)
+        self.assertEqual(photos[2].metadata, {"EXIF": {"ISO": {"val": 2}}})
+        # pre_save signal and auto_now fields
+        self.assertTrue(photos[0].is_image)
+        self.assertIsNotNone(photos[0].created_on)
+        self.assertEqual(copy_from_objects(Photo, []), 0)
+
+
+class MetricsTestCase(TestCase):
+    def test_histogram(self):
+        histogram = Histogram(buckets=[1, 2, 5])
+        for value in [0.5, 0.5, 1.5, 4, 10]:
+            histogram.observe(value)
+        self.assertEqual(histogram.counts, [2, 1, 1, 1])
+        self.assertEqual(histogram.percentile(50), 2)
+        self.assertEqual(histogram.percentile(100), 10)
+        self.assertEqual(histogram.to_dict()["buckets"]["+Inf"], 1)
+        self.assertEqual(Histogram().percentile(50), None)
+
+    def test_metrics(self):
+        metrics = Metrics()
+        with metrics.stage("extract"):
+            pass
+        metrics.increment("files")
+        metrics.set_gauge("pending_files", 3)
+        metrics.set_gauge("pending_files", 1)
+        self.assertEqual(metrics.to_dict()["max_gauges"], {"pending_files": 3})
+        self.assertGreater(metrics.rate(), 0)
+        # Rates count files, not calls
+        metrics.increment("files", 0)
+        self.assertEqual(len(metrics.events), 1)
+        metrics.increment("files", 2)
+        self.assertEqual(metrics.events_sum, 3)
+        prometheus = metrics.to_prometheus()
+        self.assertIn("phototrip_import_files_total 3\n", prometheus)
+        self.assertIn(
+            'phototrip_import_stage_duration_seconds_count{stage="extract"} 1\n',
+            prometheus,
+        )
+        self.assertIn("extract", metrics.summary_table())
+
+
+def log_from_worker(index):
+    logging.getLogger("photos.tests.fork").warning("From worker %d", index)
+
+
+class SlowStream(io.StringIO):
+    # Records are still queued when a worker finishes its last task
+    def __init__(self, file):
+        super().__init__()
+        self.file = file
+
+    def write(self, value):
+        time.sleep(0.01)
+        self.file.write(value)
+        self.file.flush()
+        return len(value)
+
+
+class LoggingTestCase(TestCase):
+    def test_get_logger(self):
+        logger = get_logger("photos.tests")
+        handlers = list(logger.handlers)
+        get_logger("photos.tests")
+        self.assertEqual(logger.handlers, handlers)
+
+    def test_queue_stream_handler(self):
+        stream = io.StringIO()
+        handler = QueueStreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        logger = logging.getLogger("photos.tests.queue")
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.warning("Imported %d files", 3)
+        # Formatted when logged
+        files = ["a.jpg"]
+        logger.warning("Files: %s", files)
+        files.append("b.jpg")
+        logger.removeHandler(handler)
+        handler.close()
+        self.assertEqual(
+            stream.getvalue(),
+            "WARNING Imported 3 files\nWARNING Files: ['a.jpg']\n",
+        )
+
+    def test_queue_stream_handler_fork(self):
+        # Records logged by forked pool workers are written before they exit
+        logger = logging.getLogger("photos.tests.fork")
+        logger.propagate = False
+        with tempfile.TemporaryFile("w+") as stream:
+            handler = QueueStreamHandler(SlowStream(stream))
+            logger.addHandler(handler)
+            try:
+                logger.warning("From parent")
+                with ProcessPoolExecutor(
+                    max_workers=2, mp_context=multiprocessing.get_context("fork")
+                ) as executor:
+                    list(executor.map(log_from_worker, range(20)))
+            finally:
+                logger.removeHandler(handler)
+                handler.close()
+            stream.seek(0)
+            lines = stream.read().splitlines()
+        self.assertEqual(lines[0], "From parent")
+        self.assertEqual(
+            sorted(lines[1:]), sorted(f"From worker {x}" for x in range(20))
+        )
+
+    def test_progress_reporter(self):
+        with self.assertLogs("photos.tests.progress") as logs:
+            progress = ProgressReporter(logging.getLogger("photos.tests.progress"))
+            for done in range(1, 101):
+                progress.update(done, 100, 12.5)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("Progress: 100/100, 12.5/sec", logs.output[0])
+
+
+class WatchTestCase(TestCase):
+    def assertWatcher(self, watcher, directory):
+        (directory / "a.jpg").write_bytes(b"a")
+        (directory / "sub").mkdir()
+        (directory / "sub" / "b.jpg").write_bytes(b"b")
+        self.assertEqual(
+            sorted(watcher.read(timeout=1) + watcher.read(timeout=1)),
+            [(directory / "a.jpg", False), (directory / "sub" / "b.jpg", False)],
+        )
+        (directory / "a.jpg").rename(directory / "c.jpg")
+        self.assertEqual(
+            sorted(watcher.read(timeout=1)),
+            [(directory / "a.jpg", True), (directory / "c.jpg", False)],
+        )
+
+    def test_inotify_watcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            watcher = InotifyWatcher(directory)
+            self.assertWatcher(watcher, directory)
+            watcher.close()
+
+    def test_polling_watcher(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            (directory / "old.jpg").write_bytes(b"old")
+            watcher = PollingWatcher(directory, interval=0)
+            self.assertWatcher(watcher, directory)
+
+    def test_watch(self):
+        class Watcher:
+            def __init__(self):
+                self.changes = [
+                    [("a.jpg", False), ("b.jpg", False)],
+                    [("a.jpg", True), ("c.jpg", False)],
+                    [],
+                ]
+
+            def read(self, timeout=None):
+                return self.changes.pop(0)
+
+        changed, deleted = next(watch(Watcher()))
+        self.assertEqual(changed, ["b.jpg", "c.jpg"])
+        self.assertEqual(deleted, ["a.jpg"])
+
+
+class ImporterTestCase(TestCase):
+    def test_import(self):
+        exif_tags = Image.Exif()
+        exif_tags[0x010F] = "Apple"
+        exif_tags[0x0110] = "iPhone 12"
+        exif_tags[0x8769] = {
+            0x9003: "2021:05:01 09:59:58",
+            0xA433: "Apple",
+            0xA434: "iPhone 12 back camera 4.2mm f/1.6",
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            Image.new("RGB", (64, 48)).save(
+                pathlib.Path(directory) / "a.jpg", exif=exif_tags
+            )
+            Importer(profile="fast").run(walk(directory))
+        photo = Photo.objects.get()
+        self.assertEqual(str(photo.camera), "Apple iPhone 12")
+        self.assertEqual(photo.lens.model, "iPhone 12 back camera 4.2mm f/1.6")
+        # Set by lens_pre_save()
+        self.assertEqual(photo.lens.position, Lens.Position.BACK)
+
+    def test_watch(self):
+        # Files already there are imported before watching starts
+        def watch(watcher, debounce):
+            self.assertIsInstance(watcher, PollingWatcher)
+            return iter([])
+
+        with tempfile.TemporaryDirectory() as directory:
+            Image.new("RGB", (8, 8)).save(pathlib.Path(directory) / "a.jpg")
+            with mock.patch("utils.watch.watch", watch):
+                with self.assertLogs("photos", logging.INFO):
+                    call_command(
+                        "import", directory, "--watch", "--poll", "--profile", "fast"
+                    )
+        self.assertEqual(Photo.objects.get().file_name, "a.jpg")
+        import_run = ImportRun.objects.get()
+        self.assertEqual((import_run.total_files, import_run.imported), (1, 1))
+        self.assertIsNotNone(import_run.finished_on)
+
+    def test_concurrent_insert(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.jpg"
+            Image.new("RGB", (8, 8)).save(file_path)
+            importer = Importer(profile="fast")
+            photo = importer.import_file(file_path)
+            # Partitioned, a different taken_on would not conflict
+            photo.taken_on = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+            Importer(profile="fast").run([file_path])
+            with mock.patch.object(importer, "import_file", return_value=photo):
+                self.assertEqual(importer.import_batch([(file_path, None)]), [])
+        self.assertIsNone(Photo.objects.get().taken_on)
+
+    def test_save_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            for name in ["a.jpg", "b.jpg"]:
+                Image.new("RGB", (8, 8)).save(directory / name)
+            importer = Importer(profile="fast")
+            import_file = importer.import_file
+
+            def import_too_long(file_path, metadata=None):
+                photo = import_file(file_path, metadata=metadata)
+                if file_path.name == "a.jpg":
+                    photo.file_name = "a" * 1000
+                return photo
+
+            with mock.patch.object(importer, "import_file", import_too_long):
+                with self.assertLogs("photos.importer", logging.ERROR):
+                    photos = importer.import_batch(
+                        [(directory / "a.jpg", None), (directory / "b.jpg", None)]
+                    )
+        # The rest of the batch is saved
+        self.assertEqual([x.file_name for x in photos], ["b.jpg"])
+        self.assertEqual(Photo.objects.get().file_name, "b.jpg")
+        self.assertEqual(importer.metrics.counters["errors"], 1)
+        self.assertEqual(importer.metrics.counters["imported"], 1)
+
+    def test_shard_path(self):
+        # Stored file paths must be the same on every host
+        with self.assertRaisesMessage(CommandError, "absolute path"):
+            call_command("import", "photos", "--shard", "1/2")
+
+    def test_phash(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.jpg"
+            Image.new("RGB", (8, 8)).save(file_path)
+            # Left to ./manage.py near_duplicates unless --phash is given
+            with mock.patch(
+                "utils.phash.get_perceptual_hash", side_effect=AssertionError
+            ):
+                Importer(profile="fast").run([file_path])
+            self.assertIsNone(Photo.objects.get().perceptual_hash)
+            Importer(profile="fast", phash=True).run([file_path])
+            self.assertEqual(
+                Photo.objects.get().perceptual_hash, get_perceptual_hash(file_path)
+            )
+            # Kept while the file is unchanged
+            Importer(profile="fast").run([file_path])
+            self.assertIsNotNone(Photo.objects.get().perceptual_hash)
+
+    def test_duration(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            (directory / "a.mov").write_bytes(
+                make_mov("2021-05-01T10:00:00+0200", "+41.3881+002.1667/")
+            )
+            Image.new("RGB", (8, 8)).save(directory / "b.jpg")
+            Importer(profile="fast").run(walk(directory))
+        video, image = Photo.objects.order_by("file_name")
+        # From QuickTime:Duration, see: make_mov()
+        self.assertTrue(video.is_video)
+        self.assertEqual(video.duration, 3.5)
+        self.assertIsNone(image.is_video)
+        self.assertIsNone(image.duration)
+
+
+class ReprocessTestCase(TransactionTestCase):
+    # Forked workers use their own connections, rows must be committed
+    def test_reprocess(self):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        metadata = {
+            "File": {"MIMEType": {"val": "video/quicktime"}},
+            "QuickTime": {
+                "Duration": {"num": 3.5, "val": "3.50 s"},
+            },
+            "EXIF": {"Make": {"val": "Apple"}, "Model": {"val": "iPhone 12"}},
+            "Composite": {
+                "SubSecDateTimeOriginal": {"val": "2021:05:01 09:59:58+02:00"},
+                "GPSLatitude": {"num": 41.5, "val": "41 deg 30' 0.00\" N"},
+                "GPSLongitude": {"num": 2.25, "val": "2 deg 15' 0.00\" E"},
+            },
+        }
+        photos = [
+            Photo.objects.create(
+                file_name=f"{index}.mov",
+                file_path=f"/path/to/photos/{index}.mov",
+                file_size=1,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=FileType.objects.get_or_create(name="MOV")[0],
+                mime_type=MimeType.objects.get_or_create(name="video/quicktime")[0],
+                metadata=metadata if index == 0 else {},
+            )
+            for index in range(2)
+        ]
+        call_command("reprocess", workers=1)
+        changed, unchanged = Photo.objects.order_by("id")
+        self.assertEqual(
+            changed.taken_on,
+            datetime.datetime(2021, 5, 1, 7, 59, 58, tzinfo=datetime.UTC),
+        )
+        self.assertEqual(changed.duration, 3.5)
+        self.assertEqual((changed.gps_latitude, changed.gps_longitude), (41.5, 2.25))
+        self.assertEqual(str(changed.camera), "Apple iPhone 12")
+        self.assertGreater(changed.updated_on, photos[0].updated_on)
+        self.assertEqual(unchanged.updated_on, photos[1].updated_on)
+
+    def test_backfill_duration(self):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        Photo.objects.create(
+            file_name="a.mov",
+            file_path="/path/to/photos/a.mov",
+            file_size=1,
+            file_atime=now,
+            file_mtime=now,
+            file_ctime=now,
+            file_type=FileType.objects.create(name="MOV"),
+            mime_type=MimeType.objects.create(name="video/quicktime"),
+            metadata={
+                "QuickTime": {"Duration": {"num": 3.5, "val": "3.50 s"}},
+                "Composite": {
+                    "SubSecDateTimeOriginal": {"val": "2021:05:01 09:59:58+02:00"}
+                },
+            },
+        )
+        call_command("backfill_duration")
+        photo = Photo.objects.get()
+        self.assertEqual(photo.duration, 3.5)
+        # Only duration is recomputed
+        self.assertIsNone(photo.taken_on)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        self.photos = [
+            Photo.objects.create(
+                file_name=name,
+                file_path=f"/path/to/photos/{name}",
+                file_size=1,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=FileType.objects.get_or_create(name=name[-3:].upper())[0],
+                mime_type=MimeType.objects.get_or_create(name=mime_type)[0],
+                taken_on=now,
+                metadata={"EXIF": {"ISO": {"num": iso, "val": iso}}},
+            )
+            for name, mime_type, iso in [
+                ("a.jpg", "image/jpeg", 100),
+                ("b.jpg", "image/jpeg", 6400),
+                ("c.mov", "video/quicktime", 100),
+            ]
+        ]
+        self.photos[2].primary = self.photos[0]
+        self.photos[2].save()
+
+    def export(self, format, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / f"photos.{format}"
+            call_command(
+                "export",
+                file_path,
+                "--format",
+                format,
+                "--fields",
+                "id,file_name,taken_on,metadata",
+                *args,
+            )
+            if format == "parquet":
+                return pyarrow.parquet.read_table(file_path).to_pylist()
+            return file_path.read_text()
+
+    def test_csv(self):
+        self.assertEqual(
+            self.export("csv", "--no-is-video").splitlines(),
+            [
+                "id,file_name,taken_on,metadata",
+                f'{self.photos[0].id},a.jpg,2000-01-01T00:00:00+00:00,"{{""EXIF"": '
+                '{""ISO"": {""num"": 100, ""val"": 100}}}"',
+                f'{self.photos[1].id},b.jpg,2000-01-01T00:00:00+00:00,"{{""EXIF"": '
+                '{""ISO"": {""num"": 6400, ""val"": 6400}}}"',
+            ],
+        )
+
+    def test_jsonl(self):
+        rows = [json.loads(x) for x in self.export("jsonl").splitlines()]
+        self.assertEqual([x["file_name"] for x in rows], ["a.jpg", "b.jpg", "c.mov"])
+        self.assertEqual(rows[0]["taken_on"], "2000-01-01T00:00:00+00:00")
+        self.assertEqual(
+            rows[0]["metadata"], {"EXIF": {"ISO": {"num": 100, "val": 100}}}
+        )
+        for args, file_names in [
+            (["--is-video"], ["c.mov"]),
+            (["--group", "primary"], ["a.jpg", "b.jpg"]),
+            (["--group", "member"], ["c.mov"]),
+            (["--metadata", "EXIF.ISO>3200"], ["b.jpg"]),
+        ]:
+            rows = [json.loads(x) for x in self.export("jsonl", *args).splitlines()]
+            self.assertEqual([x["file_name"] for x in rows], file_names)
+
+    def test_stdout(self):
+        stdout = io.StringIO()
+        call_command("export", "-", "--fields", "file_name", stdout=stdout)
+        self.assertEqual(stdout.getvalue(), "file_name\r\na.jpg\r\nb.jpg\r\nc.mov\r\n")
+        stdout = io.StringIO()
+        call_command(
+            "export", "-", "--format", "jsonl", "--fields", "file_name", stdout=stdout
+        )
+        self.assertEqual(
+            [json.loads(x) for x in stdout.getvalue().splitlines()],
+            [{"file_name": "a.jpg"}, {"file_name": "b.jpg"}, {"file_name": "c.mov"}],
+        )
+        buffer = io.BytesIO()
+        stdout = io.TextIOWrapper(buffer)
+        call_command(
+            "export", "-", "--format", "parquet", "--fields", "file_name", stdout=stdout
+        )
+        buffer.seek(0)
+        self.assertEqual(
+            pyarrow.parquet.read_table(buffer).to_pylist(),
+            [{"file_name": "a.jpg"}, {"file_name": "b.jpg"}, {"file_name": "c.mov"}],
+        )
+        with self.assertRaises(CommandError):
+            call_command("export", "-", "--format", "parquet", stdout=io.StringIO())
+
+    def test_parquet(self):
+        rows = self.export("parquet", "--metadata", "EXIF.ISO<3200")
+        self.assertEqual([x["file_name"] for x in rows], ["a.jpg", "c.mov"])
+        self.assertEqual(
+            rows[0]["taken_on"], datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        )
+        self.assertEqual(
+            json.loads(rows[0]["metadata"]), {"EXIF": {"ISO": {"num": 100, "val": 100}}}
+        )
+
+
+class IngestTestCase(TestCase):
+    def test_submit_backpressure(self):
+        async def submit():
+            service = IngestService(Importer(), queue_size=2)
+            accepted = await service.submit(["a.jpg", "b.jpg", "c.jpg"], timeout=0.1)
+            return accepted, service.status()
+
+        accepted, status = asyncio.run(submit())
+        self.assertEqual(accepted, 2)
+        self.assertEqual(status["queued"], 2)
+        self.assertEqual(status["max_gauges"], {"pending_files": 2})
+
+    def test_extract_error(self):
+        async def get_metadata_async(*args, **kwargs):
+            raise ValueError("Unexpected")
+
+        async def run():
+            service = IngestService(Importer(), concurrency=1)
+            service.start()
+            await service.submit(["a.jpg", "b.jpg"])
+            # Returns once both paths are done, the task keeps running
+            await asyncio.wait_for(service.join(), timeout=5)
+            status = service.status()
+            await service.stop()
+            return status
+
+        with mock.patch.object(exif, "get_metadata_async", get_metadata_async):
+            with self.assertLogs("photos.ingest", logging.ERROR):
+                status = asyncio.run(run())
+        self.assertEqual(status["counters"]["errors"], 2)
+        self.assertEqual(status["extracting"], 0)
+
+    def test_submit_invalid_paths(self):
+        service = IngestService(Importer())
+        for body in [b'{"paths": "a.jpg"}', b'{"paths": [1]}']:
+            with self.assertRaises(ValueError):
+                asyncio.run(service.route("POST", "/batches", body))
+
+
+def box(box_type, payload, version=None):
+    if version is not None:
+        payload = bytes([version, 0, 0, 0]) + payload
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def make_heic(tiff, width, height):
+    # ftyp, meta with a primary hvc1 item and an Exif item stored in mdat
+    exif_item = struct.pack(">I", 6) + b"Exif\0\0" + tiff
+
+    def meta(exif_offset):
+        return box(
+            b"meta",
+            box(b"hdlr", b"\0\0\0\0pict" + b"\0" * 13, version=0)
+            + box(b"pitm", struct.pack(">H", 1), version=0)
+            + box(
+                b"iinf",
+                struct.pack(">H", 2)
+                + box(b"infe", struct.pack(">HH4s", 1, 0, b"hvc1") + b"\0", 2)
+                + box(b"infe", struct.pack(">HH4s", 2, 0, b"Exif") + b"\0", 2),
+                version=0,
+            )
+            + box(
+                b"iloc",
+                bytes([0x44, 0x00])
+                + struct.pack(">HHHHII", 1, 2, 0, 1, exif_offset, len(exif_item)),
+                version=0,
+            )
+            + box(
+                b"iprp",
+                box(b"ipco", box(b"ispe", struct.pack(">II", width, height), 0))
+                + box(b"ipma", struct.pack(">IHBB", 1, 1, 1, 0x81), version=0),
+            ),
+            version=0,
+        )
+
+    ftyp = box(b"ftyp", b"heic\0\0\0\0mif1heic")
+    exif_offset = len(ftyp) + len(meta(0)) + 8
+    return ftyp + meta(exif_offset) + box(b"mdat", exif_item)
+
+
+def make_apple_maker_note(values):
+    # Header and a big-endian IFD of ASCII values, offsets relative to the start
+    header = b"Apple iOS\0\0\x01MM"
+    data_offset = len(header) + 2 + 12 * len(values) + 4
+    entries = b""
+    data = b""
+    for tag_id, value in values.items():
+        value = value.encode() + b"\0"
+        entries += struct.pack(">HHII", tag_id, 2, len(value), data_offset + len(data))
+        data += value
+    return header + struct.pack(">H", len(values)) + entries + bytes(4) + data
+
+
+def make_mov(creation_date, location, content_identifier=None):
+    # ftyp, moov with mvhd, a rotated video track and Apple keys metadata
+    mvhd = box(b"mvhd", struct.pack(">IIII", 0, 0, 600, 2100), version=0)
+    matrix = struct.pack(">9i", 0, 0x10000, 0, -0x10000, 0, 0, 0, 0, 0x40000000)
+    tkhd = box(
+        b"tkhd",
+        bytes(36) + matrix + struct.pack(">II", 1920 << 16, 1080 << 16),
+        version=0,
+    )
+    names = [
+        b"com.apple.quicktime.creationdate",
+        b"com.apple.quicktime.location.ISO6709",
+    ]
+    values = [creation_date, location]
+    if content_identifier is not None:
+        names.append(b"com.apple.quicktime.content.identifier")
+        values.append(content_identifier)
+    keys = box(
+        b"keys",
+        struct.pack(">I", len(names))
+        + b"".join(struct.pack(">I4s", 8 + len(x), b"mdta") + x for x in names),
+        version=0,
+    )
+    ilst = box(
+        b"ilst",
+        b"".join(
+            box(struct.pack(">I", index), box(b"data", bytes(8) + value.encode()))
+            for index, value in enumerate(values, 1)
+        ),
+    )
+    meta = box(b"meta", box(b"hdlr", bytes(24)) + keys + ilst)
+    moov = box(b"moov", mvhd + box(b"trak", tkhd) + meta)
+    return box(b"ftyp", b"qt  " + bytes(4)) + box(b"mdat", bytes(64)) + moov
+
+
+class FastExifTestCase(TestCase):
+    def test_jpeg(self):
+        exif_tags = Image.Exif()
+        exif_tags[0x010F] = "Apple"
+        exif_tags[0x0110] = "iPhone 12"
+        exif_tags[0x0112] = 6
+        exif_tags[0x8769] = {
+            0x9003: "2021:05:01 09:59:58",
+            0x9291: "123",
+            0x9011: "+02:00",
+            0xA434: "iPhone 12 back camera",
+            0x927C: make_apple_maker_note(
+                {0x000B: "burst-uuid", 0x0011: "content-identifier"}
+            ),
+        }
+        exif_tags[0x8825] = {
+            1: "N",
+            2: (41.0, 23.0, 17.5),
+            3: "W",
+            4: (2.0, 10.0, 0.0),
+            5: b"\x01",
+            6: 12.5,
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.jpg"
+            Image.new("RGB", (640, 480)).save(file_path, exif=exif_tags)
+            metadata = fastexif.get_metadata(file_path)
+        self.assertEqual(exif.get_mime_type(metadata), "image/jpeg")
+        self.assertEqual(exif.get_image_width_image_height(metadata), (640, 480))
+        self.assertEqual(
+            exif.get_taken_on(metadata),
+            datetime.datetime(
+                2021, 5, 1, 9, 59, 58, 123000,
+                tzinfo=datetime.timezone(datetime.timedelta(hours=2)),
+            ),
+        )  # fmt: skip
+        latitude, longitude = exif.get_gps_latitude_gps_longitude(metadata)
+        self.assertAlmostEqual(latitude, 41.388194, places=6)
+        self.assertAlmostEqual(longitude, -2.166667, places=6)
+        self.assertEqual(exif.get_gps_altitude(metadata), -12.5)
+        self.assertEqual(
+            exif.get_camera_make_camera_model(metadata), ("Apple", "iPhone 12")
+        )
+        self.assertEqual(
+            metadata["EXIF"]["Orientation"], {"num": 6, "val": "Rotate 90 CW"}
+        )
+        self.assertEqual(exif.get_content_identifier(metadata), "content-identifier")
+        self.assertEqual(exif.get_burst_uuid(metadata), "burst-uuid")
+
+    def test_heic(self):
+        exif_tags = Image.Exif()
+        exif_tags[0x010F] = "Apple"
+        exif_tags[0x8769] = {0x9003: "2024:01:02 03:04:05"}
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.heic"
+            file_path.write_bytes(make_heic(exif_tags.tobytes()[6:], 4032, 3024))
+            metadata = fastexif.get_metadata(file_path)
+        self.assertEqual(exif.get_mime_type(metadata), "image/heic")
+        self.assertEqual(exif.get_image_width_image_height(metadata), (4032, 3024))
+        self.assertEqual(
+            exif.get_taken_on(metadata),
+            datetime.datetime(2024, 1, 2, 3, 4, 5, tzinfo=datetime.UTC),
+        )
+        self.assertEqual(exif.get_camera_make_camera_model(metadata), ("Apple", None))
+
+    def test_video(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.mov"
+            file_path.write_bytes(
+                make_mov(
+                    "2021-05-01T10:00:00+0200",
+                    "+41.3881+002.1667+012.000/",
+                    "content-identifier",
+                )
+            )
+            metadata = fastexif.get_metadata(file_path)
+        self.assertEqual(exif.get_mime_type(metadata), "video/quicktime")
+        self.assertEqual(exif.get_duration(metadata), 3.5)
+        self.assertEqual(metadata["Composite"]["Rotation"], {"val": 90})
+        self.assertEqual(
+            exif.get_taken_on(metadata),
+            datetime.datetime(
+                2021, 5, 1, 10, tzinfo=datetime.timezone(datetime.timedelta(hours=2))
+            ),
+        )
+        self.assertEqual(
+            exif.get_gps_latitude_gps_longitude(metadata), (41.3881, 2.1667)
+        )
+        self.assertEqual(exif.get_gps_altitude(metadata), 12.0)
+        self.assertEqual(exif.get_content_identifier(metadata), "content-identifier")
+        self.assertIsNone(exif.get_burst_uuid(metadata))
+
+    def test_malformed_tags(self):
+        # Left out rather than failing the whole file
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.jpg"
+            for date_time, time_stamp in [
+                (b"2021:05:01 09:59:58", (1.0, 2.0)),
+                ((50, 48, 50, 49), 1.5),
+            ]:
+                exif_tags = Image.Exif()
+                exif_tags[0x8769] = {0x9003: date_time, 0x9291: "123"}
+                exif_tags[0x8825] = {7: time_stamp, 0x001D: "2021:05:01"}
+                Image.new("RGB", (8, 8)).save(file_path, exif=exif_tags)
+                metadata = fastexif.get_metadata(file_path)
+                self.assertNotIn("GPSDateTime", metadata.get("Composite", {}))
+                self.assertIsNone(exif.get_taken_on(metadata))
+
+    def test_unsupported(self):
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = pathlib.Path(directory) / "a.png"
+            Image.new("RGB", (8, 8)).save(file_path)
+            with self.assertRaises(fastexif.FastExifException):
+                fastexif.get_metadata(file_path)
+            file_path = pathlib.Path(directory) / "b.jpg"
+            file_path.write_bytes(b"\xff\xd8\xff\xe1\x00")
+            with self.assertRaises(fastexif.FastExifException):
+                fastexif.get_metadata(file_path)
+
+
+class ExifProfilesTestCase(TestCase):
+    def test_get_metadata_arguments(self):
+        arguments = ["exiftool", "-groupHeadings", "-json", "-long", "-sort"]
+        self.assertEqual(
+            exif.get_metadata_arguments("a.jpg", "full"), [*arguments, "a.jpg"]
+        )
+        catalog = exif.get_metadata_arguments("a.jpg", "catalog", "a.jpg.xmp")
+        self.assertEqual(catalog[: len(arguments)], arguments)
+        self.assertEqual(catalog[-2:], ["a.jpg", "a.jpg.xmp"])
+        self.assertIn("-fast", catalog)
+        self.assertIn("-Composite:SubSecDateTimeOriginal", catalog)
+        self.assertIn("-QuickTime:Duration", catalog)
+        self.assertIn("-XMP:DateTimeOriginal", catalog)
+        self.assertEqual(
+            exif.get_metadata_arguments("a.jpg", "fast"),
+            exif.get_metadata_arguments("a.jpg", "catalog"),
+        )
+        with self.assertRaises(exif.ExifException):
+            exif.get_metadata_arguments("a.jpg", "unknown")
+
+    def test_catalog_metadata(self):
+        # Full metadata reduced to the tags the catalog profile extracts derives
+        # the same fields
+        def select(metadata, profile):
+            arguments = exif.PROFILES[profile]
+            return {
+                group: {
+                    name: value
+                    for name, value in tags.items()
+                    if f"-{group}:{name}" in arguments
+                }
+                for group, tags in metadata.items()
+                if isinstance(tags, dict)
+            }
+
+        image = {
+            "SourceFile": "IMG_0001.HEIC",
+            "File": {
+                "FileTypeExtension": {"val": "heic"},
+                "MIMEType": {"val": "image/heic"},
+                "FileSize": {"num": 1000, "val": "1000 bytes"},
+            },
+            "EXIF": {
+                "Make": {"val": "Apple"},
+                "Model": {"val": "iPhone 12"},
+                "LensMake": {"val": "Apple"},
+                "LensModel": {"val": "iPhone 12 back camera 4.2mm f/1.6"},
+                "ISO": {"num": 100, "val": 100},
+                "DateTimeOriginal": {"val": "2021:05:01 09:59:58"},
+            },
+            "MakerNotes": {
+                "ContentIdentifier": {"val": "content-identifier"},
+                "BurstUUID": {"val": "burst-uuid"},
+                "RunTimeValue": {"num": 1, "val": 1},
+            },
+            "Composite": {
+                "ImageSize": {"val": "4032x3024"},
+                "Megapixels": {"num": 12.192768, "val": "12.2"},
+                "SubSecDateTimeOriginal": {"val": "2021:05:01 09:59:58.123+02:00"},
+                "GPSLatitude": {"num": 41.5, "val": "41 deg 30' 0.00\" N"},
+                "GPSLongitude": {"num": -2.25, "val": "2 deg 15' 0.00\" W"},
+                "GPSAltitude": {"num": 12.5, "val": "12.5 m Above Sea Level"},
+                "LensID": {"val": "iPhone 12 back camera 4.2mm f/1.6"},
+            },
+        }
+        video = {
+            "SourceFile": "IMG_0001.MOV",
+            "File": {
+                "FileTypeExtension": {"val": "mov"},
+                "MIMEType": {"val": "video/quicktime"},
+            },
+            "QuickTime": {
+                "Duration": {"num": 3.5, "val": "3.50 s"},
+                "CreationDate": {"val": "2021:05:01 09:59:58+02:00"},
+                "ContentIdentifier": {"val": "content-identifier"},
+                "HandlerType": {"val": "Metadata Tags"},
+            },
+        }
+        for metadata in [image, video]:
+            catalog = select(metadata, "catalog")
+            self.assertNotEqual(catalog, metadata)
+            self.assertEqual(exif.get_file_type(catalog), exif.get_file_type(metadata))
+            self.assertEqual(exif.get_mime_type(catalog), exif.get_mime_type(metadata))
+            self.assertEqual(
+                derive_fields(metadata["SourceFile"], catalog),
+                derive_fields(metadata["SourceFile"], metadata),
+            )
+        fields = derive_fields("IMG_0001.HEIC", select(image, "catalog"))
+        self.assertEqual(fields["camera"], ("Apple", "iPhone 12"))
+        self.assertEqual(fields["burst_uuid"], "burst-uuid")
+        self.assertEqual(fields["gps_altitude"], 12.5)
+        fields = derive_fields("IMG_0001.MOV", select(video, "catalog"))
+        self.assertEqual(fields["duration"], 3.5)
+        self.assertEqual(fields["content_identifier"], "content-identifier")
+        self.assertIsNotNone(fields["taken_on"])
+
+
+class ExifCacheTestCase(TestCase):
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            cache = exifcache.ExifCache(directory / "cache.sqlite3")
+            file_path = directory / "a.jpg"
+            file_path.write_bytes(b"a")
+            key = cache.get_key(file_path, "12.76", "catalog")
+            self.assertEqual(
+                key, f"{exifcache.get_fingerprint(file_path)}:12.76:catalog"
+            )
+            # Just written, the mtime may not change on the next write
+            self.assertIn(get_content_hash(file_path), key)
+            self.assertIsNone(cache.get(key))
+            metadata = {
+                "SourceFile": str(file_path),
+                "File": {
+                    "FileName": {"val": "a.jpg"},
+                    "MIMEType": {"val": "image/jpeg"},
+                },
+                "EXIF": {"Make": {"val": "Apple"}},
+            }
+            expected = {
+                "File": {"MIMEType": {"val": "image/jpeg"}},
+                "EXIF": {"Make": {"val": "Apple"}},
+            }
+            self.assertEqual(cache.set(key, metadata), expected)
+            # Shared by other processes and databases
+            self.assertEqual(
+                exifcache.ExifCache(directory / "cache.sqlite3").get(key), expected
+            )
+            # Lookups of files not modified recently only read their start and end
+            file_path.write_bytes(b"\0" * 1000000)
+            os.utime(file_path, (1000000000, 1000000000))
+            with mock.patch.object(exifcache, "get_content_hash") as content_hash:
+                key = cache.get_key(file_path, "12.76", "catalog")
+            content_hash.assert_not_called()
+            # Same size edits in the middle of the file give a new key
+            with open(file_path, "r+b") as f:
+                f.seek(500000)
+                f.write(b"\1")
+            os.utime(file_path, (1000000001, 1000000001))
+            self.assertNotEqual(cache.get_key(file_path, "12.76", "catalog"), key)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = exifcache.ExifCache(pathlib.Path(directory) / "cache.sqlite3")
+            for index in range(10):
+                cache.set(str(index), {"EXIF": {"Make": {"val": str(index)}}})
+                cache.connection.execute(
+                    "UPDATE metadata SET accessed = ? WHERE key = ?",
+                    [index, str(index)],
+                )
+            size = cache.stats()["size"]
+            cache.max_size = size // 2
+            self.assertGreater(cache.evict(), 0)
+            self.assertLessEqual(cache.stats()["size"], cache.max_size)
+            # Least recently used first
+            self.assertIsNone(cache.get("0"))
+            self.assertIsNotNone(cache.get("9"))
+            self.assertEqual(cache.evict(), 0)
+
+
+class PlanTestCase(TestCase):
+    def test_get_plan(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            (directory / "sub").mkdir()
+            for name in ["unchanged.jpg", "changed.jpg", "sub/new.mov"]:
+                (directory / name).write_bytes(b"data")
+            for name, size in [("unchanged", 4), ("changed", 5), ("deleted", 4)]:
+                file_path = directory / f"{name}.jpg"
+                mtime = timestamp_to_datetime(
+                    file_path.stat().st_mtime if file_path.exists() else 0
+                )
+                Photo.objects.create(
+                    file_name=file_path.name,
+                    file_path=file_path,
+                    file_size=size,
+                    file_atime=mtime,
+                    file_mtime=mtime,
+                    file_ctime=mtime,
+                    file_type=file_type,
+                    mime_type=mime_type,
+                    metadata={},
+                )
+            ImportRun.objects.create(
+                path=directory,
+                profile="full",
+                files=100,
+                elapsed=10,
+                finished_on=timestamp_to_datetime(0),
+            )
+            # Interrupted runs are ignored
+            ImportRun.objects.create(
+                path=directory, profile="full", files=1, elapsed=10
+            )
+            plan = get_plan(directory, "catalog")
+        self.assertEqual(
+            plan["counts"], {"new": 1, "changed": 1, "unchanged": 1, "deleted": 1}
+        )
+        self.assertEqual(plan["files"], 3)
+        self.assertEqual(plan["bytes"], 12)
+        self.assertEqual(plan["mime_types"]["image/jpeg"], {"files": 2, "bytes": 8})
+        self.assertEqual(
+            plan["mime_types"]["video/quicktime"], {"files": 1, "bytes": 4}
+        )
+        self.assertEqual(plan["files_per_second"], 10)
+        self.assertAlmostEqual(plan["eta"], 0.3)
+
+
+class ShardTestCase(TestCase):
+    def test_walk_shard(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            for index in range(20):
+                (directory / str(index % 5)).mkdir(exist_ok=True)
+                (directory / str(index % 5) / f"{index}.jpg").write_bytes(b"")
+            file_paths = walk(directory)
+            for by in ["path", "directory"]:
+                shards = [walk_shard(directory, x, 3, by=by) for x in range(3)]
+                self.assertEqual(sorted(sum(shards, [])), file_paths)
+                if by == "directory":
+                    for shard in shards:
+                        self.assertEqual(len(shard) % 4, 0)
+
+
+class PartitionsTestCase(TestCase):
+    def test_partition(self):
+        file_type = FileType.objects.create(name="JPG")
+        mime_type = MimeType.objects.create(name="image/jpeg")
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+
+        def create_photo(taken_on):
+            return Photo.objects.create(
+                file_name="a.jpg",
+                file_path=f"/path/to/photos/{taken_on}.jpg",
+                file_size=1,
+                file_atime=now,
+                file_mtime=now,
+                file_ctime=now,
+                file_type=file_type,
+                mime_type=mime_type,
+                taken_on=taken_on,
+                metadata={},
+            )
+
+        def get_partition(photo):
+            cursor.execute(
+                f"SELECT tableoid::regclass::text FROM {partitions.TABLE} WHERE id = %s",
+                [photo.id],
+            )
+            return cursor.fetchone()[0]
+
+        photos = [create_photo(now), create_photo(None)]
+        # DDL is transactional, rolled back with the test
+        with connection.cursor() as cursor:
+            if partitions.is_partitioned(cursor):
+                # Already partitioned by migration 0009, see: PHOTO_PARTITIONING
+                partitions.create_partition(cursor, 2000)
+            else:
+                partitions.partition(cursor)
+            self.assertTrue(partitions.is_partitioned(cursor))
+            self.assertEqual(get_partition(photos[0]), "photos_photo_y2000")
+            self.assertEqual(get_partition(photos[1]), "photos_photo_default")
+            for photo in photos:
+                with self.assertRaises(IntegrityError), transaction.atomic():
+                    create_photo(photo.taken_on)
+
+            photos.append(create_photo(now.replace(year=1999)))
+            self.assertGreater(photos[2].id, photos[1].id)
+            self.assertEqual(get_partition(photos[2]), "photos_photo_default")
+            self.assertIn(1999, partitions.get_missing_years(cursor))
+            self.assertEqual(partitions.create_partition(cursor, 1999), 1)
+            self.assertEqual(get_partition(photos[2]), "photos_photo_y1999")
+
+            queryset = Photo.objects.filter(taken_on__year=2000)
+            self.assertEqual(list(queryset), [photos[0]])
+            plan = queryset.explain()
+            self.assertIn("photos_photo_y2000", plan)
+            self.assertNotIn("photos_photo_y1999", plan)
+            self.assertNotIn("photos_photo_default", plan)
+
+            user = User.objects.create_superuser("admin", password="password")
+            self.client.force_login(user)
+            url = reverse("admin:photos_photo_changelist")
+            response = self.client.get(url, {"year": "2000"})
+            changelist = response.context["cl"]
+            self.assertEqual(list(changelist.result_list), [photos[0]])
+            (year_filter,) = [
+                x for x in changelist.filter_specs if isinstance(x, YearFilter)
+            ]
+            self.assertIn(("1999", "1999"), year_filter.lookup_choices)
+            self.assertIn(("2000", "2000"), year_filter.lookup_choices)
+            self.assertEqual(self.client.get(url, {"year": "x"}).status_code, 302)
+
+
+class PrefetchTestCase(TestCase):
+    def test_order_file_paths(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            for name in ["b/2.jpg", "a/1.jpg", "b/1.jpg", "a/2.jpg"]:
+                (directory / name).parent.mkdir(exist_ok=True)
+                (directory / name).write_bytes(b"data")
+            file_paths = walk(directory)
+            inodes = {x: x.stat().st_ino for x in file_paths}
+            self.assertEqual(order_file_paths(file_paths), file_paths)
+            self.assertEqual(
+                order_file_paths(file_paths, "inode"),
+                sorted(file_paths, key=lambda x: inodes[x]),
+            )
+            ordered = order_file_paths(file_paths, "directory")
+            self.assertEqual([x.parent.name for x in ordered], ["a", "a", "b", "b"])
+            self.assertEqual(
+                ordered, sorted(file_paths, key=lambda x: (x.parent, inodes[x]))
+            )
+
+            with Prefetcher([*file_paths, directory / "missing.jpg"], 2) as prefetcher:
+                for _ in range(5):
+                    prefetcher.done()
+            self.assertFalse(prefetcher.thread.is_alive())
+
+    def test_get_ranges(self):
+        self.assertEqual(get_ranges(100, 64), [(0, 100)])
+        self.assertEqual(get_ranges(1000, 64), [(0, 64), (936, 64)])
+
+
+class ProfilingTestCase(TestCase):
+    def test_stage_profiler(self):
+        metrics = Metrics()
+        metrics.profiler = StageProfiler()
+        with metrics.stage("extract"):
+            with metrics.stage("derive"):
+                sorted(range(1000))
+        self.assertEqual(list(metrics.profiler.profiles), ["extract"])
+        self.assertEqual(metrics.histograms["derive"].count, 1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = metrics.profiler.dump(directory)
+            self.assertTrue((path / "extract.pstats").exists())
+            self.assertIn("function calls", (path / "extract.txt").read_text())
+
+    def test_middleware(self):
+        user = User.objects.create_superuser("admin", password="password")
+        self.client.force_login(user)
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROFILE_DIR=directory, PROFILE_REQUEST_THRESHOLD=0):
+                self.assertEqual(self.client.get("/admin/").status_code, 200)
+                self.client.get("/api/photos/")
+                # Served unprofiled while another request is profiled
+                with profiling.request_profile_lock:
+                    self.assertEqual(self.client.get("/admin/").status_code, 200)
+            file_paths = list(pathlib.Path(directory, "requests").glob("*.json"))
+            self.assertEqual(len(file_paths), 1)
+            profile = json.loads(file_paths[0].read_text())
+            self.assertEqual(profile["path"], "/admin/")
+            self.assertGreater(profile["sql_queries"], 0)
+            self.assertTrue(file_paths[0].with_suffix(".pstats").exists())
+
+
+class GroupingTestCase(TestCase):
+    def create_photo(self, name, taken_on, content_identifier=None, burst_uuid=None):
+        mime_type = "video/quicktime" if name.endswith(".mov") else "image/heic"
+        return Photo.objects.create(
+            file_name=name,
+            file_path=f"/path/to/photos/{name}",
+            file_size=1,
+            file_atime=taken_on,
+            file_mtime=taken_on,
+            file_ctime=taken_on,
+            file_type=FileType.objects.get_or_create(name=name[-3:].upper())[0],
+            mime_type=MimeType.objects.get_or_create(name=mime_type)[0],
+            taken_on=taken_on,
+            content_identifier=content_identifier,
+            burst_uuid=burst_uuid,
+            metadata={},
+        )
+
+    def test_update_groups(self):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        # Imported before its still
+        live_video = self.create_photo("live.mov", now, "a")
+        self.assertEqual(update_groups(["a"], []), 0)
+        live_still = self.create_photo("live.heic", now, "a")
+        first_frame = self.create_photo("burst1.heic", now, "b", "burst")
+        burst_video = self.create_photo("burst1.mov", now, "b")
+        second_frame = self.create_photo(
+            "burst2.heic", now + datetime.timedelta(seconds=1), None, "burst"
+        )
+        single = self.create_photo("single.heic", now)
+        # Groups sharing a photo with the batch are regrouped too
+        self.assertEqual(update_groups(["a", "b"], []), 3)
+        primaries = {
+            x.file_name: x.primary_id
+            for x in Photo.objects.filter(primary__isnull=False)
+        }
+        self.assertEqual(
+            primaries,
+            {
+                "live.mov": live_still.id,
+                "burst1.mov": first_frame.id,
+                "burst2.heic": first_frame.id,
+            },
+        )
+        self.assertEqual(update_groups(["a"], ["burst"]), 0)
+
+        user = User.objects.create_user("staff", is_staff=True)
+        self.client.force_login(user)
+        response = self.client.get(
+            "/api/photos/", data={"grouped": "true", "fields": "primary"}
+        )
+        page = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(
+            sorted(x["id"] for x in page["results"]),
+            [live_still.id, first_frame.id, single.id],
+        )
+        self.assertEqual(
+            self.client.get("/api/photos/", data={"grouped": "1"}).status_code, 400
+        )
+
+        # Members of a deleted primary become ungrouped until regrouped
+        first_frame.delete()
+        second_frame.refresh_from_db()
+        self.assertIsNone(second_frame.primary_id)
+        self.assertEqual(update_groups([], ["burst"]), 0)
+        burst_video.refresh_from_db()
+        live_video.refresh_from_db()
+        self.assertEqual(burst_video.primary_id, None)
+        self.assertEqual(live_video.primary_id, live_still.id)
+
+    def test_sync_deleted_primary(self):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        frames = [
+            self.create_photo(
+                f"burst{index}.heic", now + datetime.timedelta(seconds=index), None, "x"
+            )
+            for index in range(3)
+        ]
+        update_groups([], ["x"])
+        importer = Importer()
+        with self.assertLogs("photos.importer", logging.INFO):
+            importer.sync([], [frames[0].file_path])
+        self.assertEqual(importer.metrics.counters["deleted"], 1)
+        self.assertEqual(
+            list(Photo.objects.order_by("file_name").values_list("primary_id")),
+            [(None,), (frames[1].id,)],
+        )
+
+    def test_reimport_identifiers(self):
+        def metadata(burst_uuid):
+            return {
+                "File": {
+                    "FileTypeExtension": {"val": "jpg"},
+                    "MIMEType": {"val": "image/jpeg"},
+                },
+                "MakerNotes": {"BurstUUID": {"val": burst_uuid}} if burst_uuid else {},
+            }
+
+        with tempfile.TemporaryDirectory() as directory:
+            file_paths = [pathlib.Path(directory) / f"{x}.jpg" for x in "abc"]
+            for file_path in file_paths:
+                Image.new("RGB", (8, 8)).save(file_path)
+            importer = Importer()
+            importer.import_batch([(x, metadata("x")) for x in file_paths])
+            a, b, c = Photo.objects.order_by("file_name")
+            self.assertEqual((b.primary_id, c.primary_id), (a.id, a.id))
+            # A member leaving its group
+            importer.import_batch([(file_paths[2], metadata(None))])
+            # The primary leaving its group, b is alone in it
+            importer.import_batch([(file_paths[0], metadata("y"))])
+        self.assertEqual(
+            list(Photo.objects.order_by("file_name").values_list("primary_id")),
+            [(None,), (None,), (None,)],
+        )
+
+
+class SidecarsTestCase(TestCase):
+    def test_pair_sidecars(self):
+        with tempfile.TemporaryDirectory() as directory:
+            directory = pathlib.Path(directory)
+            for name in [
+                "IMG_1.CR2",
+                "IMG_1.CR2.xmp",
+                # Lightroom style, the stem is matched
+                "IMG_2.NEF",
+                "IMG_2.XMP",
+                "IMG_3.JPG",
+                "orphan.xmp",
+            ]:
+                (directory / name).write_bytes(b"data")
+            file_paths, sidecars, unpaired = pair_sidecars(walk(directory))
+            self.assertEqual(
+                [x.name for x in file_paths], ["IMG_1.CR2", "IMG_2.NEF", "IMG_3.JPG"]
+            )
+            self.assertEqual(
+                {x.name: y.name for x, y in sidecars.items()},
+                {"IMG_1.CR2": "IMG_1.CR2.xmp", "IMG_2.NEF": "IMG_2.XMP"},
+            )
+            self.assertEqual([x.name for x in unpaired], ["orphan.xmp"])
+            # A changed sidecar reported by utils.watch brings in its file
+            file_paths, sidecars, unpaired = pair_sidecars([directory / "IMG_2.XMP"])
+            self.assertEqual(file_paths, [directory / "IMG_2.NEF"])
+            # Sidecars are imported by the shard of their file
+            for index in range(3):
+                shard = walk_shard(directory, index, 3)
+                for file_path, sidecar_path in sidecars.items():
+                    self.assertEqual(file_path in shard, sidecar_path in shard)
+
+    def test_merge_sidecar(self):
+        metadata = {
+            "SourceFile": "IMG_1.CR2",
+            "File": {"MIMEType": {"val": "image/x-canon-cr2"}},
+            "Composite": {
+                "SubSecDateTimeOriginal": {"val": "2021:05:01 09:59:58"},
+                "GPSLatitude": {"num": 1.0, "val": "1 deg 0' 0.00\" N"},
+                "GPSLongitude": {"num": 1.0, "val": "1 deg 0' 0.00\" E"},
+                "ImageSize": {"val": "6000x4000"},
+            },
+        }
+        sidecar = {
+            "SourceFile": "IMG_1.CR2.xmp",
+            "File": {"MIMEType": {"val": "application/rdf+xml"}},
+            "Composite": {"ImageSize": {"val": "1x1"}},
+            "XMP": {
+                "DateTimeOriginal": {"val": "2021:05:01 10:59:58+02:00"},
+                "GPSLatitude": {"num": -41.5, "val": "41 deg 30' 0.00\" S"},
+                "GPSLongitude": {"num": 2.25, "val": "2 deg 15' 0.00\" E"},
+                "GPSAltitude": {"num": 12.5, "val": "12.5 m"},
+                "GPSAltitudeRef": {"num": 1, "val": "Below Sea Level"},
+            },
+        }
+        merged = exif.parse_metadata(0, json.dumps([metadata, sidecar]).encode(), b"")
+        self.assertEqual(exif.get_mime_type(merged), "image/x-canon-cr2")
+        self.assertEqual(exif.get_image_width_image_height(merged), (6000, 4000))
+        self.assertEqual(
+            exif.get_taken_on(merged),
+            datetime.datetime(
+                2021, 5, 1, 10, 59, 58,
+                tzinfo=datetime.timezone(datetime.timedelta(hours=2)),
+            ),
+        )  # fmt: skip
+        self.assertEqual(exif.get_gps_latitude_gps_longitude(merged), (-41.5, 2.25))
+        self.assertEqual(exif.get_gps_altitude(merged), -12.5)
+
+        # Unreadable sidecars are ignored
+        sidecar = {"SourceFile": "IMG_1.CR2.xmp", "ExifTool": {"Error": {"val": "x"}}}
+        self.assertEqual(
+            exif.parse_metadata(1, json.dumps([metadata, sidecar]).encode(), b""),
+            metadata,
+        )
+
+
+class MetadataTestCase(TestCase):
+    def test_metadata_view(self):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        photo = Photo.objects.create(
+            file_name="a.jpg",
+            file_path="/path/to/photos/a.jpg",
+            file_size=1,
+            file_atime=now,
+            file_mtime=now,
+            file_ctime=now,
+            file_type=FileType.objects.get_or_create(name="JPEG")[0],
+            mime_type=MimeType.objects.get_or_create(name="image/jpeg")[0],
+            metadata={
+                "SourceFile": "a.jpg",
+                "EXIF": {
+                    "Make": {"val": "Canon", "desc": "Make"},
+                    "ISO": {"num": 3200, "val": "3200", "desc": "ISO"},
+                },
+            },
+        )
+        user = User.objects.create_superuser("admin", password="password")
+        self.client.force_login(user)
+
+        # Only the collapsed group headings are rendered
+        url = reverse("admin:photos_photo_change", args=[photo.id])
+        response = self.client.get(url)
+        self.assertContains(response, "<details", count=2)
+        self.assertContains(response, "EXIF (2)")
+        self.assertNotContains(response, "Canon")
+        key = get_headings_cache_key(photo)
+        self.assertIn("EXIF (2)", cache.get(key))
+
+        url = reverse("admin:photos_photo_metadata", args=[photo.id, "EXIF"])
+        self.assertEqual(
+            self.client.get(url).json(),
+            {
+                "group": "EXIF",
+                "tags": {
+                    "ISO": {"num": 3200, "val": "3200", "desc": "ISO"},
+                    "Make": {"val": "Canon", "desc": "Make"},
+                },
+            },
+        )
+        url = reverse("admin:photos_photo_metadata", args=[photo.id, "XMP"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse("admin:photos_photo_metadata", args=[0, "EXIF"])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class SpriteTestCase(TestCase):
+    def create_photo(self, name, size):
+        now = datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC)
+        photo = Photo(
+            file_name=name,
+            file_path=f"/path/to/photos/{name}",
+            file_size=1,
+            file_atime=now,
+            file_mtime=now,
+            file_ctime=now,
+            file_type=FileType.objects.get_or_create(name="JPEG")[0],
+            mime_type=MimeType.objects.get_or_create(name="image/jpeg")[0],
+            metadata={},
+        )
+        if size is not None:
+            output = io.BytesIO()
+            Image.new("RGB", size, "red").save(output, "JPEG")
+            photo.thumbnail.save(name, ContentFile(output.getvalue()), save=False)
+        photo.save()
+        return photo
+
+    def test_photo_sprite(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(MEDIA_ROOT=directory):
+                self._test_photo_sprite()
+
+    def _test_photo_sprite(self):
+        landscape = self.create_photo("landscape.jpg", (512, 256))
+        portrait = self.create_photo("portrait.jpg", (64, 128))
+        missing = self.create_photo("missing.jpg", None)
+        user = User.objects.create_user("staff", is_staff=True)
+        self.client.force_login(user)
+
+        ids = f"{portrait.id},{missing.id},{landscape.id},0"
+        response = self.client.get("/api/photos/sprite/", data={"ids": ids})
+        sprite = response.json()
+        self.assertEqual(
+            sprite["offsets"],
+            {
+                str(portrait.id): [96, 64, 64, 128],
+                str(missing.id): None,
+                str(landscape.id): [512, 64, 256, 128],
+                "0": None,
+            },
+        )
+        response = self.client.get(sprite["url"])
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertIn("immutable", response["Cache-Control"])
+        with Image.open(io.BytesIO(response.content)) as image:
+            self.assertEqual(image.size, (4 * 256, 256))
+            # Red thumbnail on a white background
+            self.assertLess(image.getpixel((640, 128))[1], 16)
+            self.assertGreater(image.getpixel((640, 16))[1], 240)
+        response = self.client.get(
+            "/api/photos/sprite/",
+            data={"ids": ids},
+            headers={"If-None-Match": response["ETag"]},
+        )
+        self.assertEqual(response.status_code, 304)
+
+        # A changed thumbnail gives a new sprite
+        portrait.thumbnail.delete(save=False)
+        portrait.save()
+        response = self.client.get("/api/photos/sprite/", data={"ids": ids})
+        self.assertNotEqual(response.json()["url"], sprite["url"])
+        self.assertIsNone(response.json()["offsets"][str(portrait.id)])
+
+        for ids in ["", "a", ",".join(map(str, range(1000)))]:
+            response = self.client.get("/api/photos/sprite/", data={"ids": ids})
+            self.assertEqual(response.status_code, 400)
@@ -0,0 +1,14 @@
+from django.urls import path
+
+from . import views
+
+
+app_name = "photos"
+
+urlpatterns = [
+    path("photos/", views.photo_list, name="photo_list"),
+    path("photos/sprite/", views.photo_sprite, name="photo_sprite"),
+    path("photos/sprite.jpg", views.photo_sprite_image, name="photo_sprite_image"),
+    path("cameras/", views.camera_list, name="camera_list"),
+    path("lenses/", views.lens_list, name="lens_list"),
+]
@@ -1 +1,384 @@
-# Create your views here.
+import base64
+import binascii
+import datetime
+import hashlib
+import itertools
+import json
+from urllib.parse import urlencode
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    quote_etag,
+)
+from django.views.decorators.http import require_safe
+
+from .models import Photo, Camera, Lens
+from .sprites import (
+    MAX_SPRITE_PHOTOS,
+    SPRITE_CACHE_TIMEOUT,
+    get_members,
+    get_sprite,
+    get_sprite_key,
+)
+from utils.sprites import COLUMNS, TILE_SIZE
+
+
+DEFAULT_LIMIT = 100
+
+MAX_LIMIT = 1000
+
+CHUNK_SIZE = 100
+
+# API field name => queryset.values() expression
+PHOTO_FIELDS = {
+    "id": "id",
+    "created_on": "created_on",
+    "updated_on": "updated_on",
+    "file_name": "file_name",
+    "file_path": "file_path",
+    "is_image": "is_image",
+    "is_video": "is_video",
+    "file_size": "file_size",
+    "file_atime": "file_atime",
+    "file_mtime": "file_mtime",
+    "file_ctime": "file_ctime",
+    "file_type": "file_type__name",
+    "mime_type": "mime_type__name",
+    "image_width": "image_width",
+    "image_height": "image_height",
+    "megapixels": "megapixels",
+    "taken_on": "taken_on",
+    "duration": "duration",
+    "gps_latitude": "gps_latitude",
+    "gps_longitude": "gps_longitude",
+    "gps_altitude": "gps_altitude",
+    "camera": "camera_id",
+    "lens": "lens_id",
+    "content_identifier": "content_identifier",
+    "burst_uuid": "burst_uuid",
+    "primary": "primary_id",
+    "metadata": "metadata",
+}
+
+# metadata can be hundreds of KB per video, only serialize it when asked for
+PHOTO_DEFAULT_FIELDS = [x for x in PHOTO_FIELDS if x != "metadata"]
+
+# Timestamps a page's ETag is computed from, see: get_etag(). Renaming a file
+# type or a camera changes the pages of its photos.
+PHOTO_ETAG_FIELDS = [
+    "updated_on",
+    "file_type__updated_on",
+    "mime_type__updated_on",
+    "camera__updated_on",
+    "lens__updated_on",
+]
+
+CAMERA_FIELDS = {
+    "id": "id",
+    "created_on": "created_on",
+    "updated_on": "updated_on",
+    "make": "make",
+    "model": "model",
+}
+
+LENS_FIELDS = {
+    **CAMERA_FIELDS,
+    "position": "position",
+}
+
+
+class ApiException(Exception):
+    pass
+
+
+def require_staff(view):
+    def inner(request, *args, **kwargs):
+        if not (request.user.is_active and request.user.is_staff):
+            return JsonResponse({"error": "Forbidden"}, status=403)
+        return view(request, *args, **kwargs)
+
+    return inner
+
+
+def encode_cursor(values):
+    # DjangoJSONEncoder truncates datetimes to milliseconds
+    values = [x.isoformat() if isinstance(x, datetime.datetime) else x for x in values]
+    cursor = json.dumps(values)
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ApiException(f"Invalid cursor: {cursor}") from e
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get("limit", DEFAULT_LIMIT))
+    except ValueError as e:
+        raise ApiException("Invalid limit") from e
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ApiException(f"limit must be between 1 and {MAX_LIMIT}")
+    return limit
+
+
+def get_fields(request, fields, default_fields):
+    if "fields" not in request.GET:
+        return default_fields
+    requested_fields = [x for x in request.GET["fields"].split(",") if x != ""]
+    unknown_fields = [x for x in requested_fields if x not in fields]
+    if len(unknown_fields) > 0:
+        raise ApiException(f"Unknown fields: {', '.join(unknown_fields)}")
+    # The cursor is built from these
+    return list(dict.fromkeys(["id", *requested_fields]))
+
+
+def get_taken_on_filter(request):
+    # ?taken_after=2021-01-01&taken_before=2022-01-01, ISO 8601, naive values are
+    # in TIME_ZONE. Bounds let PostgreSQL skip partitions, see: photos.partitions
+    q = Q()
+    for parameter, lookup in [
+        ("taken_after", "taken_on__gte"),
+        ("taken_before", "taken_on__lt"),
+    ]:
+        if parameter not in request.GET:
+            continue
+        try:
+            value = datetime.datetime.fromisoformat(request.GET[parameter])
+        except ValueError as e:
+            raise ApiException(f"Invalid {parameter}") from e
+        if timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        q &= Q(**{lookup: value})
+    return q
+
+
+def get_grouped(request):
+    # ?grouped=true lists one item per Live Photo or burst, see: photos.grouping
+    value = request.GET.get("grouped", "false")
+    if value not in ["true", "false"]:
+        raise ApiException("grouped must be true or false")
+    return value == "true"
+
+
+def get_sprite_ids(request):
+    # ?ids=3,1,2 in grid order, e.g. the ids of a page of /api/photos/
+    try:
+        ids = [int(x) for x in request.GET.get("ids", "").split(",") if x != ""]
+    except ValueError as e:
+        raise ApiException("Invalid ids") from e
+    ids = list(dict.fromkeys(ids))
+    if not 1 <= len(ids) <= MAX_SPRITE_PHOTOS:
+        raise ApiException(f"ids must contain between 1 and {MAX_SPRITE_PHOTOS} ids")
+    return ids
+
+
+def get_photo_querysets(request):
+    # Keyset pagination on (taken_on, id), NULL taken_on values sort last.
+    # Each page is a range scan of photo_taken_on_id_idx starting right after the
+    # cursor instead of an OFFSET that reads and discards every previous row.
+    # The trailing NULL taken_on photos are paginated on id alone.
+    # Grouped pages scan the partial photo_group_* indexes instead.
+    taken_on_filter = get_taken_on_filter(request)
+    photos = Photo.objects.filter(taken_on_filter)
+    if get_grouped(request):
+        photos = photos.filter(primary__isnull=True)
+    cursor = request.GET.get("cursor")
+    if cursor is None:
+        taken_on, id = None, None
+    else:
+        try:
+            taken_on, id = decode_cursor(cursor)
+            if taken_on is not None:
+                taken_on = datetime.datetime.fromisoformat(taken_on)
+            id = int(id)
+        except (TypeError, ValueError) as e:
+            raise ApiException(f"Invalid cursor: {cursor}") from e
+
+    null_taken_on = photos.filter(taken_on__isnull=True).order_by("id")
+    if taken_on_filter:
+        null_taken_on = null_taken_on.none()
+    if cursor is None:
+        return [
+            photos.filter(taken_on__isnull=False).order_by("taken_on", "id"),
+            null_taken_on,
+        ]
+    if taken_on is None:
+        return [null_taken_on.filter(id__gt=id)]
+    return [
+        # The redundant taken_on >= cursor condition is what lets PostgreSQL
+        # start the index scan at the cursor
+        photos.filter(taken_on__gte=taken_on)
+        .filter(Q(taken_on__gt=taken_on) | Q(id__gt=id))
+        .order_by("taken_on", "id"),
+        null_taken_on,
+    ]
+
+
+def get_id_querysets(request, queryset):
+    cursor = request.GET.get("cursor")
+    if cursor is None:
+        return [queryset.order_by("id")]
+    try:
+        (id,) = decode_cursor(cursor)
+        id = int(id)
+    except (TypeError, ValueError) as e:
+        raise ApiException(f"Invalid cursor: {cursor}") from e
+    return [queryset.filter(id__gt=id).order_by("id")]
+
+
+def iterate_page(querysets, limit, *fields):
+    # Fetch one extra row to know whether there is a next page.
+    # Subsequent querysets are only evaluated if the previous ones run out.
+    rows = itertools.chain.from_iterable(
+        queryset.values_list(*fields)[: limit + 1].iterator(chunk_size=CHUNK_SIZE)
+        for queryset in querysets
+    )
+    return itertools.islice(rows, limit + 1)
+
+
+def get_etag(request, querysets, limit, etag_fields):
+    # Fingerprint the page from ids and updated_on timestamps only, without
+    # reading any of the large columns, so revalidating an unchanged page is
+    # cheap. QuerySet.update() doesn't set updated_on, see:
+    # utils.db.bulk_update_from_values()
+    hash = hashlib.blake2b(request.get_full_path().encode(), digest_size=16)
+    for id, *timestamps in iterate_page(querysets, limit, "id", *etag_fields):
+        timestamps = ",".join("" if x is None else x.isoformat() for x in timestamps)
+        hash.update(f"{id}:{timestamps};".encode())
+    return quote_etag(hash.hexdigest())
+
+
+def stream_page(querysets, limit, fields, field_names, cursor_fields):
+    values = [fields[x] for x in field_names]
+    # Cursor fields are appended after the requested fields
+    values += cursor_fields
+    yield '{"results": ['
+    next_cursor = None
+    last_row = None
+    for index, row in enumerate(iterate_page(querysets, limit, *values)):
+        if index == limit:
+            next_cursor = encode_cursor(last_row[len(field_names) :])
+            break
+        if index > 0:
+            yield ","
+        yield json.dumps(
+            dict(zip(field_names, row[: len(field_names)])), cls=DjangoJSONEncoder
+        )
+        last_row = row
+    yield f'], "next": {json.dumps(next_cursor)}}}'
+
+
+def list_view(request, querysets, fields, default_fields, cursor_fields, etag_fields):
+    try:
+        limit = get_limit(request)
+        field_names = get_fields(request, fields, default_fields)
+        querysets = querysets(request)
+    except ApiException as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    etag = get_etag(request, querysets, limit, etag_fields)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = StreamingHttpResponse(
+            stream_page(querysets, limit, fields, field_names, cursor_fields),
+            content_type="application/json",
+        )
+    response.headers["ETag"] = etag
+    return response
+
+
+@require_safe
+@require_staff
+def photo_list(request):
+    return list_view(
+        request,
+        get_photo_querysets,
+        PHOTO_FIELDS,
+        PHOTO_DEFAULT_FIELDS,
+        ["taken_on", "id"],
+        PHOTO_ETAG_FIELDS,
+    )
+
+
+@require_safe
+@require_staff
+def camera_list(request):
+    return list_view(
+        request,
+        lambda request: get_id_querysets(request, Camera.objects.all()),
+        CAMERA_FIELDS,
+        list(CAMERA_FIELDS),
+        ["id"],
+        ["updated_on"],
+    )
+
+
+@require_safe
+@require_staff
+def lens_list(request):
+    return list_view(
+        request,
+        lambda request: get_id_querysets(request, Lens.objects.all()),
+        LENS_FIELDS,
+        list(LENS_FIELDS),
+        ["id"],
+        ["updated_on"],
+    )
+
+
+def sprite_view(request, render):
+    try:
+        ids = get_sprite_ids(request)
+    except ApiException as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    # Revalidating only reads (id, thumbnail, updated_on) of the members
+    members = get_members(ids)
+    key = get_sprite_key(ids, members)
+    etag = quote_etag(key)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render(ids, key, *get_sprite(ids, members))
+    response.headers["ETag"] = etag
+    return response
+
+
+@require_safe
+@require_staff
+def photo_sprite(request):
+    # Offsets of each thumbnail in the image served by photo_sprite_image(),
+    # which is rendered and cached by this request
+    def render(ids, key, contents, offsets):
+        query = urlencode({"ids": ",".join(map(str, ids)), "key": key})
+        return JsonResponse(
+            {
+                "url": f"{reverse('photos:photo_sprite_image')}?{query}",
+                "tile_size": TILE_SIZE,
+                "columns": COLUMNS,
+                "offsets": offsets,
+            }
+        )
+
+    return sprite_view(request, render)
+
+
+@require_safe
+@require_staff
+def photo_sprite_image(request):
+    def render(ids, key, contents, offsets):
+        response = HttpResponse(contents, content_type="image/jpeg")
+        # The URL given by photo_sprite() changes with any member's thumbnail
+        if request.GET.get("key") == key:
+            patch_cache_control(
+                response, private=True, max_age=SPRITE_CACHE_TIMEOUT, immutable=True
+            )
+        return response
+
+    return sprite_view(request, render)
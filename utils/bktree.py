@@ -0,0 +1,48 @@
+class BKTree:
+    # Burkhard-Keller tree for a discrete metric e.g. Hamming distance.
+    # Every child of a node lies at a distinct distance from it, so by the triangle
+    # inequality a search for items within max_distance of x only needs to descend
+    # into children at distance d(x, node) +/- max_distance.
+    # See: https://en.wikipedia.org/wiki/BK-tree
+
+    def __init__(self, distance):
+        self.distance = distance
+        # [key, items, children], children: {distance: node}
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = self.distance(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        # Returns a list of (distance, item)
+        results = []
+        if self.root is None:
+            return results
+        nodes = [self.root]
+        while nodes:
+            node = nodes.pop()
+            distance = self.distance(key, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+        return results
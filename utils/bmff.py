@@ -0,0 +1,194 @@
+import datetime
+import math
+import re
+import struct
+
+
+# ISO base media file format (MP4, MOV, HEIC), see: ISO/IEC 14496-12
+# Only box headers are read while walking, mdat is skipped with a single seek.
+
+# ftyp major brand => (FileTypeExtension, MIMEType)
+VIDEO_BRANDS = {
+    b"qt  ": ("mov", "video/quicktime"),
+    b"M4V ": ("m4v", "video/x-m4v"),
+    b"M4VH": ("m4v", "video/x-m4v"),
+    b"M4VP": ("m4v", "video/x-m4v"),
+    b"3gp4": ("3gp", "video/3gpp"),
+    b"3gp5": ("3gp", "video/3gpp"),
+    b"3gp6": ("3gp", "video/3gpp"),
+    b"isom": ("mp4", "video/mp4"),
+    b"iso2": ("mp4", "video/mp4"),
+    b"mp41": ("mp4", "video/mp4"),
+    b"mp42": ("mp4", "video/mp4"),
+    b"avc1": ("mp4", "video/mp4"),
+}
+
+# QuickTime and MP4 timestamps count seconds from 1904-01-01 00:00:00 UTC
+EPOCH = datetime.datetime(1904, 1, 1, tzinfo=datetime.UTC)
+
+# moov/meta/keys names, see: https://exiftool.org/TagNames/QuickTime.html#Keys
+KEYS = {
+    b"com.apple.quicktime.content.identifier": "content_identifier",
+    b"com.apple.quicktime.creationdate": "creation_date",
+    b"com.apple.quicktime.location.ISO6709": "location",
+    b"com.apple.quicktime.make": "make",
+    b"com.apple.quicktime.model": "model",
+}
+
+# e.g. +41.3881+002.1667+012.000/
+ISO6709 = re.compile(
+    r"(?P<latitude>[+-]\d+(?:\.\d+)?)"
+    r"(?P<longitude>[+-]\d+(?:\.\d+)?)"
+    r"(?P<altitude>[+-]\d+(?:\.\d+)?)?"
+)
+
+
+class BMFFException(Exception):
+    pass
+
+
+def iter_boxes(reader, offset, end):
+    # Yields (type, payload offset, payload end)
+    while offset + 8 <= end:
+        size, box_type = struct.unpack(">I4s", reader.read(offset, 8))
+        header_size = 8
+        if size == 1:
+            (size,) = struct.unpack(">Q", reader.read(offset + 8, 8))
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise BMFFException(f"Invalid box size at: {offset}")
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def get_box(reader, offset, end, box_type):
+    for child_type, child_offset, child_end in iter_boxes(reader, offset, end):
+        if child_type == box_type:
+            return child_offset, child_end
+    raise BMFFException(f"Box not found: {box_type}")
+
+
+def find_box(reader, offset, end, box_type):
+    try:
+        return get_box(reader, offset, end, box_type)
+    except BMFFException:
+        return None
+
+
+def get_brand(reader):
+    offset, _ = get_box(reader, 0, min(reader.size, 4096), b"ftyp")
+    return reader.read(offset, 4)
+
+
+def read_mvhd(reader, offset):
+    # Returns (creation time, duration in seconds)
+    version = reader.read(offset, 1)[0]
+    if version == 1:
+        creation_time, _, timescale, duration = struct.unpack(
+            ">QQIQ", reader.read(offset + 4, 28)
+        )
+    else:
+        creation_time, _, timescale, duration = struct.unpack(
+            ">IIII", reader.read(offset + 4, 16)
+        )
+    if timescale == 0 or duration == 0:
+        # e.g. fragmented MP4, the duration is the sum of the moof fragments
+        raise BMFFException("Missing movie duration")
+    return creation_time, duration / timescale
+
+
+def read_tkhd(reader, offset):
+    # Returns (width, height, rotation in degrees)
+    version = reader.read(offset, 1)[0]
+    offset += 4 + (32 if version == 1 else 20) + 16
+    matrix = struct.unpack(">9i", reader.read(offset, 36))
+    width, height = struct.unpack(">II", reader.read(offset + 36, 8))
+    rotation = round(math.degrees(math.atan2(matrix[1], matrix[0]))) % 360
+    return width >> 16, height >> 16, rotation
+
+
+def read_keys(reader, meta_offset, meta_end):
+    # QuickTime meta with keys and ilst, in moov as written by iPhones or in
+    # moov/udta as written by ffmpeg
+    values = {}
+    if reader.read(meta_offset + 4, 4) != b"hdlr":
+        # MP4 meta is a full box, QuickTime meta is not
+        meta_offset += 4
+    keys_box = find_box(reader, meta_offset, meta_end, b"keys")
+    ilst_box = find_box(reader, meta_offset, meta_end, b"ilst")
+    if keys_box is None or ilst_box is None:
+        return values
+    names = []
+    offset = keys_box[0] + 8
+    for _ in range(struct.unpack(">I", reader.read(keys_box[0] + 4, 4))[0]):
+        size = struct.unpack(">I", reader.read(offset, 4))[0]
+        names.append(bytes(reader.read(offset + 8, size - 8)))
+        offset += size
+    for box_type, offset, end in iter_boxes(reader, *ilst_box):
+        index = int.from_bytes(box_type, "big") - 1
+        if not 0 <= index < len(names) or names[index] not in KEYS:
+            continue
+        data_box = find_box(reader, offset, end, b"data")
+        if data_box is None:
+            continue
+        # Type indicator and locale precede the value
+        value = reader.read(data_box[0] + 8, data_box[1] - data_box[0] - 8)
+        values[KEYS[names[index]]] = bytes(value).decode(errors="replace")
+    return values
+
+
+def read_xyz(reader, udta_offset, udta_end):
+    # udta/©xyz: 16 bit length, 16 bit language code, ISO 6709 string
+    xyz_box = find_box(reader, udta_offset, udta_end, b"\xa9xyz")
+    if xyz_box is None:
+        return None
+    (length,) = struct.unpack(">H", reader.read(xyz_box[0], 2))
+    return bytes(reader.read(xyz_box[0] + 4, length)).decode(errors="replace")
+
+
+def parse_iso6709(value):
+    match = ISO6709.match(value or "")
+    if match is None:
+        return None
+    return tuple(
+        float(x) if x is not None else None
+        for x in match.group("latitude", "longitude", "altitude")
+    )
+
+
+def get_video_metadata(reader):
+    # Returns a dict of the values utils.fastexif maps to exiftool tags
+    moov_offset, moov_end = get_box(reader, 0, reader.size, b"moov")
+    mvhd_offset, _ = get_box(reader, moov_offset, moov_end, b"mvhd")
+    creation_time, duration = read_mvhd(reader, mvhd_offset)
+    metadata = {
+        "duration": duration,
+        "create_date": EPOCH + datetime.timedelta(seconds=creation_time)
+        if creation_time
+        else None,
+        "width": None,
+        "height": None,
+        "rotation": None,
+    }
+    for box_type, offset, end in iter_boxes(reader, moov_offset, moov_end):
+        if box_type == b"trak":
+            width, height, rotation = read_tkhd(
+                reader, get_box(reader, offset, end, b"tkhd")[0]
+            )
+            if width and height and metadata["width"] is None:
+                # First video track
+                metadata.update(width=width, height=height, rotation=rotation)
+        elif box_type == b"meta":
+            metadata.update(read_keys(reader, offset, end))
+        elif box_type == b"udta":
+            location = read_xyz(reader, offset, end)
+            if location is not None:
+                metadata.setdefault("location", location)
+            meta_box = find_box(reader, offset, end, b"meta")
+            if meta_box is not None:
+                for key, value in read_keys(reader, *meta_box).items():
+                    metadata.setdefault(key, value)
+    metadata["location"] = parse_iso6709(metadata.get("location"))
+    return metadata
@@ -123,7 +123,9 @@ def parse_datetime(string):
                     > MAX_TIME_ZONE_DISPLACEMENT_SECONDS
                 ):
                     logger.error(
-                        f"Time zone displacement out of range: {dt}, using time zone: {TIME_ZONE} instead"
+                        "Time zone displacement out of range: %s, using time zone: %s instead",
+                        dt,
+                        TIME_ZONE,
                     )
                     return dt.replace(tzinfo=TIME_ZONE)
                 else:
@@ -132,7 +134,7 @@ def parse_datetime(string):
                 return dt.replace(tzinfo=TIME_ZONE)
         except ValueError:
             pass
-    logger.error(f"Could not parse datetime string: {string}")
+    logger.error("Could not parse datetime string: %s", string)
     return None
 
 
@@ -163,7 +165,7 @@ def extract_datetime(file_path):
             tzinfo=datetime.UTC,
         )
     except ValueError:
-        logger.error(f"Could not construct datetime from group_dict: {group_dict}")
+        logger.error("Could not construct datetime from group_dict: %s", group_dict)
         return None
 
 
@@ -171,5 +173,5 @@ def timestamp_to_datetime(timestamp):
     try:
         return datetime.datetime.fromtimestamp(timestamp, tz=TIME_ZONE)
     except (ValueError, OSError, OverflowError):
-        logger.error(f"Could not convert timestamp to datetime: {timestamp}")
+        logger.error("Could not convert timestamp to datetime: %s", timestamp)
         return None
@@ -0,0 +1,113 @@
+from django.db import connections
+from django.db.models.signals import pre_save
+from django.utils import timezone
+
+
+def bulk_update_from_values(model, objs, field_names, using="default"):
+    # Django's QuerySet.bulk_update() builds one CASE WHEN id = ... THEN ... branch
+    # per object and field, which PostgreSQL evaluates for every row, making it
+    # O(n^2) in the batch size. Joining against a VALUES list is a single hash or
+    # merge join instead:
+    # UPDATE photos_photo SET duration = v.duration
+    # FROM (VALUES (%s::bigint, %s::double precision), ...) AS v (id, duration)
+    # WHERE photos_photo.id = v.id
+    # Like save(), auto_now fields such as updated_on are set, API ETags are
+    # built from them, see: photos.views.get_etag()
+    if len(objs) == 0:
+        return 0
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    pk = model._meta.pk
+    fields = [pk, *[model._meta.get_field(x) for x in field_names]]
+    auto_now_fields = [
+        x
+        for x in model._meta.concrete_fields
+        if getattr(x, "auto_now", False) and x not in fields
+    ]
+    row = ", ".join(f"%s::{field.db_type(connection)}" for field in fields)
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    assignments = ", ".join(
+        [
+            *[
+                f"{quote_name(field.column)} = v.{quote_name(field.column)}"
+                for field in fields[1:]
+            ],
+            *[f"{quote_name(field.column)} = %s" for field in auto_now_fields],
+        ]
+    )
+    values = ", ".join(f"({row})" for _ in objs)
+    now = timezone.now()
+    params = [
+        *[x.get_db_prep_save(now, connection) for x in auto_now_fields],
+        *[
+            field.get_db_prep_save(getattr(obj, field.attname), connection)
+            for obj in objs
+            for field in fields
+        ],
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET {assignments} "
+            f"FROM (VALUES {values}) AS v ({columns}) "
+            f"WHERE {table}.{quote_name(pk.column)} = v.{quote_name(pk.column)}",
+            params,
+        )
+        return cursor.rowcount
+
+
+def copy_from_objects(model, objs, using="default"):
+    # COPY ... FROM STDIN streams rows without per-row INSERT parsing or planning,
+    # the fastest way to load a fresh table. Like save() and unlike
+    # bulk_create(), pre_save signals are sent. Primary keys are not set on objs.
+    if len(objs) == 0:
+        return 0
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    table = quote_name(model._meta.db_table)
+    fields = [x for x in model._meta.concrete_fields if not x.primary_key]
+    columns = ", ".join(quote_name(field.column) for field in fields)
+    with connection.cursor() as cursor:
+        with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+            for obj in objs:
+                pre_save.send(
+                    sender=model,
+                    instance=obj,
+                    raw=False,
+                    using=using,
+                    update_fields=None,
+                )
+                copy.write_row(
+                    [
+                        field.get_db_prep_save(field.pre_save(obj, True), connection)
+                        for field in fields
+                    ]
+                )
+    return len(objs)
+
+
+def get_or_create_conflict_safe(model, fields, using="default"):
+    # Concurrent importers may insert the same row. INSERT ... ON CONFLICT DO
+    # NOTHING never raises and, outside a long transaction, only waits for the
+    # other insert to commit. fields must match a unique constraint. Like
+    # copy_from_objects(), pre_save signals are sent, e.g. Lens.position is set
+    # by photos.models.lens_pre_save().
+    queryset = model.objects.using(using)
+    obj = queryset.filter(**fields).first()
+    if obj is None:
+        obj = model(**fields)
+        pre_save.send(
+            sender=model, instance=obj, raw=False, using=using, update_fields=None
+        )
+        queryset.bulk_create([obj], ignore_conflicts=True)
+        obj = queryset.get(**fields)
+    return obj
+
+
+def close_connections():
+    # Pooled connections stay open after close_all(), forked processes must not
+    # inherit them
+    for connection in connections.all():
+        connection.close()
+        if getattr(connection, "pool", None) is not None:
+            connection.close_pool()
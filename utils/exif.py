@@ -1,7 +1,15 @@
+import asyncio
+import functools
+import hashlib
 import json
 import subprocess
 
+from utils import fastexif
 from utils.datetime import parse_datetime
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
 
 
 TIMEOUT = 5
@@ -92,30 +100,197 @@ DURATION_TAGS = [
 ]
 
 
+# XMP sidecar tags taking precedence over the file's own, in order. Editors
+# write corrected dates and locations to sidecars rather than to the file.
+SIDECAR_TAKEN_ON_TAGS = [
+    "DateTimeOriginal",
+    "DateCreated",
+    "CreateDate",
+]
+
+SIDECAR_GPS_TAGS = [
+    "GPSLatitude",
+    "GPSLongitude",
+    "GPSAltitude",
+    "GPSAltitudeRef",
+]
+
+# Sidecar groups describing the sidecar file itself or derived from its tags,
+# e.g. Composite:ImageSize, these never replace the file's
+SIDECAR_IGNORED_GROUPS = ["SourceFile", "ExifTool", "File", "Composite"]
+
+
+# exiftool arguments selecting which tags to extract
+PROFILES = {
+    # Every tag, for on-demand detail
+    "full": [],
+    # Only the tags used by the get_*() helpers below.
+    # -fast stops reading JPEGs at the start of the image data and skips scanning
+    # whole video files for trailers. -fast2 would also skip maker notes, which
+    # is where some of the Duration and GPSDateTime tags come from.
+    "catalog": [
+        "-fast",
+        "-File:FileTypeExtension",
+        "-File:MIMEType",
+        "-Composite:ImageSize",
+        "-Composite:Megapixels",
+        *[f"-Composite:{tag}" for tag in TAKEN_ON_TAGS],
+        *[f"-{group}:Duration" for group in DURATION_TAGS],
+        "-Composite:GPSLatitude",
+        "-Composite:GPSLongitude",
+        "-Composite:GPSAltitude",
+        "-EXIF:Make",
+        "-EXIF:Model",
+        "-EXIF:LensMake",
+        "-EXIF:LensModel",
+        "-QuickTime:CreationDate",
+        "-MakerNotes:ContentIdentifier",
+        "-MakerNotes:BurstUUID",
+        "-QuickTime:ContentIdentifier",
+        *[f"-XMP:{tag}" for tag in SIDECAR_TAKEN_ON_TAGS + SIDECAR_GPS_TAGS],
+    ],
+}
+
+# "fast" reads JPEG, HEIC, MP4 and MOV headers in-process, see: utils.fastexif,
+# and falls back to exiftool with these arguments for anything else
+PROFILES["fast"] = PROFILES["catalog"]
+
+DEFAULT_PROFILE = "full"
+
+
 class ExifException(Exception):
     pass
 
 
-def get_metadata(file_path=None, file_contents=None, timeout=TIMEOUT):
+def get_metadata_arguments(file_path, profile, sidecar_path=None):
+    if profile not in PROFILES:
+        raise ExifException(f"Unknown profile: {profile}")
+    return [
+        # https://exiftool.org/exiftool_pod.html
+        "exiftool",
+        # Organize output by tag group
+        "-groupHeadings",
+        # Export/import tags in JSON format
+        "-json",
+        # Use long 2-line output format
+        "-long",
+        # Sort output alphabetically
+        "-sort",
+        *PROFILES[profile],
+        str(file_path),
+        # Extracted in the same run, see: merge_sidecar()
+        *([str(sidecar_path)] if sidecar_path is not None else []),
+    ]
+
+
+def parse_metadata(returncode, stdout, stderr):
+    stderr = stderr.decode(errors="replace")
+    if stderr != "":
+        raise ExifException(stderr)
+    stdout = stdout.decode(errors="replace")
+    # One object per file, in argument order
+    metadata, *sidecars = json.loads(stdout)
+    if returncode != 0 and (
+        len(sidecars) == 0 or "Error" in metadata.get("ExifTool", {})
+    ):
+        raise ExifException(metadata["ExifTool"]["Error"]["val"])
+    for sidecar in sidecars:
+        if "Error" in sidecar.get("ExifTool", {}):
+            logger.warning(
+                "Could not read sidecar: %s, %s",
+                sidecar["SourceFile"],
+                sidecar["ExifTool"]["Error"]["val"],
+            )
+        else:
+            metadata = merge_sidecar(metadata, sidecar)
+    return metadata
+
+
+def merge_sidecar(metadata, sidecar):
+    # Sidecar tags replace the file's tags of the same group, e.g. embedded XMP.
+    # The Composite tags the get_*() helpers read first are replaced by the
+    # sidecar's date and location, so derived fields follow the sidecar and
+    # ./manage.py reprocess gives the same result.
+    metadata = dict(metadata)
+    for group, tags in sidecar.items():
+        if group not in SIDECAR_IGNORED_GROUPS:
+            metadata[group] = {**metadata.get(group, {}), **tags}
+    xmp = sidecar.get("XMP", {})
+    composite = dict(metadata.get("Composite", {}))
+    for tag in SIDECAR_TAKEN_ON_TAGS:
+        if tag in xmp and parse_datetime(str(xmp[tag]["val"])) is not None:
+            composite[TAKEN_ON_TAGS[0]] = xmp[tag]
+            break
+    # XMP coordinates are signed, unlike the GPS group's
+    if "num" in xmp.get("GPSLatitude", {}) and "num" in xmp.get("GPSLongitude", {}):
+        composite["GPSLatitude"] = xmp["GPSLatitude"]
+        composite["GPSLongitude"] = xmp["GPSLongitude"]
+    if "num" in xmp.get("GPSAltitude", {}):
+        altitude = xmp["GPSAltitude"]["num"]
+        if xmp.get("GPSAltitudeRef", {}).get("num") == 1:
+            # Below sea level
+            altitude = -altitude
+        composite["GPSAltitude"] = {**xmp["GPSAltitude"], "num": altitude}
+    metadata["Composite"] = composite
+    return metadata
+
+
+@functools.cache
+def get_exiftool_version(timeout=TIMEOUT):
+    try:
+        process = subprocess.run(
+            ["exiftool", "-ver"], capture_output=True, timeout=timeout, check=True
+        )
+    except (subprocess.SubprocessError, OSError) as e:
+        raise ExifException("Could not run exiftool -ver") from e
+    return process.stdout.decode().strip()
+
+
+def get_profile_id(profile):
+    # Changes along with the profile's arguments so cached metadata extracted
+    # with fewer tags isn't reused, see: utils.exifcache
+    arguments = "\0".join(PROFILES[profile]).encode()
+    return f"{profile}-{hashlib.blake2b(arguments, digest_size=4).hexdigest()}"
+
+
+def get_cached_metadata(cache, file_path, profile, sidecar_path=None):
+    # Returns (cache key, metadata or None), see: utils.exifcache
+    try:
+        key = cache.get_key(
+            file_path, get_exiftool_version(), get_profile_id(profile), sidecar_path
+        )
+    except OSError as e:
+        raise ExifException(f"Could not read file: {file_path}") from e
+    return key, cache.get(key)
+
+
+def get_metadata(
+    file_path=None,
+    file_contents=None,
+    timeout=TIMEOUT,
+    profile=DEFAULT_PROFILE,
+    cache=None,
+    sidecar_path=None,
+):
     if file_path is None and file_contents is None:
         raise ExifException("Either file_path or file_contents must be provided")
+    key = None
     if file_path is None:
         file_path = "-"
+    else:
+        # Sidecars need exiftool either way, the file is read in the same run
+        if profile == "fast" and sidecar_path is None:
+            try:
+                return fastexif.get_metadata(file_path)
+            except fastexif.FastExifException:
+                pass
+        if cache is not None:
+            key, metadata = get_cached_metadata(cache, file_path, profile, sidecar_path)
+            if metadata is not None:
+                return metadata
     try:
         process = subprocess.run(
-            [
-                # https://exiftool.org/exiftool_pod.html
-                "exiftool",
-                # Organize output by tag group
-                "-groupHeadings",
-                # Export/import tags in JSON format
-                "-json",
-                # Use long 2-line output format
-                "-long",
-                # Sort output alphabetically
-                "-sort",
-                file_path,
-            ],
+            get_metadata_arguments(file_path, profile, sidecar_path),
             # The input argument is passed to Popen.communicate() and thus to the
             # subprocess's stdin.
             input=file_contents,
@@ -127,17 +302,61 @@ def get_metadata(file_path=None, file_contents=None, timeout=TIMEOUT):
             # after the child process has terminated.
             timeout=timeout,
         )
-        stderr = process.stderr.decode(errors="replace")
-        if stderr != "":
-            raise ExifException(stderr)
-        stdout = process.stdout.decode(errors="replace")
-        metadata = json.loads(stdout)
-        metadata = metadata[0]
-        if process.returncode != 0:
-            raise ExifException(metadata["ExifTool"]["Error"]["val"])
-        return metadata
     except subprocess.TimeoutExpired as e:
         raise ExifException from e
+    metadata = parse_metadata(process.returncode, process.stdout, process.stderr)
+    if key is not None:
+        metadata = cache.set(key, metadata)
+    return metadata
+
+
+async def get_metadata_async(
+    file_path, timeout=TIMEOUT, profile=DEFAULT_PROFILE, cache=None, sidecar_path=None
+):
+    # Same as get_metadata() without blocking the event loop
+    if profile == "fast" and sidecar_path is None:
+        try:
+            return fastexif.get_metadata(file_path)
+        except fastexif.FastExifException:
+            pass
+    key = None
+    if cache is not None:
+        key, metadata = await asyncio.to_thread(
+            get_cached_metadata, cache, file_path, profile, sidecar_path
+        )
+        if metadata is not None:
+            return metadata
+    process = await asyncio.create_subprocess_exec(
+        *get_metadata_arguments(file_path, profile, sidecar_path),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except TimeoutError as e:
+        process.kill()
+        await process.wait()
+        raise ExifException from e
+    metadata = parse_metadata(process.returncode, stdout, stderr)
+    if key is not None:
+        metadata = await asyncio.to_thread(cache.set, key, metadata)
+    return metadata
+
+
+def get_embedded_image(file_path, tag, timeout=TIMEOUT):
+    # Extract an embedded image e.g. PreviewImage, ThumbnailImage or JpgFromRaw
+    try:
+        process = subprocess.run(
+            ["exiftool", "-binary", f"-{tag}", file_path],
+            capture_output=True,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired as e:
+        raise ExifException from e
+    if process.returncode != 0:
+        raise ExifException(process.stderr.decode(errors="replace"))
+    return process.stdout or None
 
 
 def get_file_type(metadata):
@@ -175,7 +394,11 @@ def get_taken_on(metadata):
                 return taken_on
         except KeyError:
             pass
-    return None
+    try:
+        # Videos, unlike QuickTime:CreateDate this includes the time zone
+        return parse_datetime(metadata["QuickTime"]["CreationDate"]["val"])
+    except KeyError:
+        return None
 
 
 def get_duration(metadata):
@@ -245,3 +468,20 @@ def get_lens_make_lens_model(metadata):
     except KeyError:
         lens_model = None
     return lens_make, lens_model
+
+
+def get_content_identifier(metadata):
+    # Shared by the still image and the video of a Live Photo
+    for group in ["MakerNotes", "QuickTime"]:
+        try:
+            return str(metadata[group]["ContentIdentifier"]["val"])
+        except KeyError:
+            pass
+    return None
+
+
+def get_burst_uuid(metadata):
+    try:
+        return str(metadata["MakerNotes"]["BurstUUID"]["val"])
+    except KeyError:
+        return None
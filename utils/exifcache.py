@@ -0,0 +1,175 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+from utils.hashing import get_content_hash, get_partial_hash
+
+
+# Bytes of compressed metadata kept before the least recently used entries are
+# evicted
+MAX_SIZE = 1024 * 1024 * 1024
+
+# Summing entry sizes scans the table, the size is checked once per interval
+# of inserts and entries are evicted down to a fraction of max_size
+EVICT_INTERVAL = 1000
+
+EVICT_TO = 0.9
+
+# Files modified this recently may be modified again within the file system's
+# timestamp granularity without their mtime changing, their fingerprint
+# includes a full content hash
+RACY_SECONDS = 2
+
+# Recording every hit would turn reads into writes, entries are touched at most
+# once per interval
+TOUCH_INTERVAL = 24 * 60 * 60
+
+# exiftool reports the path and file system attributes of the file it read,
+# these belong to the copy that was extracted first, not to the content.
+# Photo stores them from os.stat().
+VOLATILE_TAGS = {
+    "File": [
+        "FileName",
+        "Directory",
+        "FileSize",
+        "FileModifyDate",
+        "FileAccessDate",
+        "FileInodeChangeDate",
+        "FilePermissions",
+    ],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metadata_accessed ON metadata (accessed);
+"""
+
+
+def get_fingerprint(file_path):
+    # Cheap enough for every lookup: a stat() and the first and last 64 KiB.
+    # A same-size edit in the middle of a file that also restores its mtime,
+    # e.g. touch -r, is not noticed, see: ./manage.py exif_cache --verify
+    stat = os.stat(file_path)
+    fingerprint = (
+        f"{stat.st_size}-{stat.st_mtime_ns}-{stat.st_ino}-"
+        f"{get_partial_hash(file_path)}"
+    )
+    if time.time_ns() - stat.st_mtime_ns < RACY_SECONDS * 1_000_000_000:
+        fingerprint += f"-{get_content_hash(file_path)}"
+    return fingerprint
+
+
+def remove_volatile_tags(metadata):
+    return {
+        group: (
+            {k: v for k, v in tags.items() if k not in VOLATILE_TAGS[group]}
+            if group in VOLATILE_TAGS
+            else tags
+        )
+        for group, tags in metadata.items()
+        if group != "SourceFile"
+    }
+
+
+class ExifCache:
+    # Extracted metadata keyed by (fingerprint, exiftool version, profile), see:
+    # get_fingerprint(). A partial hash alone would miss same-size edits in the
+    # middle of a file, e.g. rewritten XMP in a TIFF or RAW file, the mtime
+    # catches them without reading the whole file.
+    # The SQLite file can be shared by every database importing the same files,
+    # keep it on a local disk: SQLite locking is unreliable over NFS and SMB.
+    def __init__(self, path, max_size=MAX_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.local = threading.local()
+        self.inserts = 0
+
+    @property
+    def connection(self):
+        # One connection per thread and per process, forked workers reconnect
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def get_key(self, file_path, exiftool_version, profile, sidecar_path=None):
+        key = f"{get_fingerprint(file_path)}:{exiftool_version}:{profile}"
+        if sidecar_path is not None:
+            # Merged metadata, see: utils.exif.merge_sidecar()
+            key += f":{get_fingerprint(sidecar_path)}"
+        return key
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT value, accessed FROM metadata WHERE key = ?", [key]
+        ).fetchone()
+        if row is None:
+            return None
+        value, accessed = row
+        now = int(time.time())
+        if accessed < now - TOUCH_INTERVAL:
+            self.connection.execute(
+                "UPDATE metadata SET accessed = ? WHERE key = ?", [now, key]
+            )
+        return json.loads(zlib.decompress(value))
+
+    def set(self, key, metadata):
+        metadata = remove_volatile_tags(metadata)
+        value = zlib.compress(json.dumps(metadata).encode())
+        self.connection.execute(
+            "INSERT OR REPLACE INTO metadata (key, value, size, accessed) "
+            "VALUES (?, ?, ?, ?)",
+            [key, value, len(value), int(time.time())],
+        )
+        self.inserts += 1
+        if self.inserts % EVICT_INTERVAL == 0:
+            self.evict()
+        return metadata
+
+    def delete(self, key):
+        self.connection.execute("DELETE FROM metadata WHERE key = ?", [key])
+
+    def stats(self):
+        count, size = self.connection.execute(
+            "SELECT count(*), coalesce(sum(size), 0) FROM metadata"
+        ).fetchone()
+        return {"entries": count, "size": size, "max_size": self.max_size}
+
+    def evict(self):
+        # Returns the number of evicted entries
+        if self.stats()["size"] <= self.max_size:
+            return 0
+        cursor = self.connection.execute(
+            """
+            DELETE FROM metadata WHERE key IN (
+                SELECT key FROM (
+                    SELECT key, sum(size) OVER (ORDER BY accessed DESC, key) AS total
+                    FROM metadata
+                ) WHERE total > ?
+            )
+            """,
+            [int(self.max_size * EVICT_TO)],
+        )
+        return cursor.rowcount
+
+
+def get_cache():
+    # None unless EXIF_CACHE_PATH is set, see: settings.py
+    path = getattr(settings, "EXIF_CACHE_PATH", None)
+    if path is None:
+        return None
+    return ExifCache(path, getattr(settings, "EXIF_CACHE_MAX_SIZE", MAX_SIZE))
@@ -0,0 +1,519 @@
+import datetime
+import mmap
+import os
+import struct
+
+from utils.bmff import (
+    BMFFException,
+    get_box,
+    get_brand,
+    get_video_metadata,
+    iter_boxes,
+    VIDEO_BRANDS,
+)
+
+
+# Bytes mapped from the start of the file, EXIF is stored within the first 64 KiB
+# of a JPEG. HEIC items and MP4/MOV boxes outside of the header, e.g. a moov box
+# after mdat, are read with os.pread().
+HEADER_SIZE = 256 * 1024
+
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+}  # fmt: skip
+
+HEIC_BRANDS = {b"heic", b"heix", b"heim", b"heis"}
+
+# TIFF type => (struct format, size)
+TIFF_TYPES = {
+    1: ("B", 1),  # BYTE
+    2: ("s", 1),  # ASCII
+    3: ("H", 2),  # SHORT
+    4: ("I", 4),  # LONG
+    5: ("II", 8),  # RATIONAL
+    7: ("s", 1),  # UNDEFINED
+    9: ("i", 4),  # SLONG
+    10: ("ii", 8),  # SRATIONAL
+}
+
+# See: https://exiftool.org/TagNames/EXIF.html
+IFD0_TAGS = {
+    0x010F: "Make",
+    0x0110: "Model",
+    0x0112: "Orientation",
+    0x0132: "ModifyDate",
+}
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+EXIF_IFD_TAGS = {
+    0x8827: "ISO",
+    0x9003: "DateTimeOriginal",
+    0x9004: "CreateDate",
+    0x9010: "OffsetTime",
+    0x9011: "OffsetTimeOriginal",
+    0x9012: "OffsetTimeDigitized",
+    0x9290: "SubSecTime",
+    0x9291: "SubSecTimeOriginal",
+    0x9292: "SubSecTimeDigitized",
+    0x927C: "MakerNote",
+    0xA433: "LensMake",
+    0xA434: "LensModel",
+}
+GPS_IFD_TAGS = {
+    0x0001: "GPSLatitudeRef",
+    0x0002: "GPSLatitude",
+    0x0003: "GPSLongitudeRef",
+    0x0004: "GPSLongitude",
+    0x0005: "GPSAltitudeRef",
+    0x0006: "GPSAltitude",
+    0x0007: "GPSTimeStamp",
+    0x001D: "GPSDateStamp",
+}
+
+# Apple maker notes start with this header, a version and a byte order mark,
+# followed by an IFD with offsets relative to the start of the maker note
+APPLE_MAKER_NOTE_HEADER = b"Apple iOS\0"
+APPLE_MAKER_NOTE_IFD_OFFSET = 14
+# See: https://exiftool.org/TagNames/Apple.html
+APPLE_TAGS = {
+    0x000B: "BurstUUID",
+    0x0011: "ContentIdentifier",
+}
+
+ORIENTATIONS = {
+    1: "Horizontal (normal)",
+    2: "Mirror horizontal",
+    3: "Rotate 180",
+    4: "Mirror vertical",
+    5: "Mirror horizontal and rotate 270 CW",
+    6: "Rotate 90 CW",
+    7: "Mirror horizontal and rotate 90 CW",
+    8: "Rotate 270 CW",
+}
+
+# Composite tag => EXIF (date/time, sub-seconds, time zone offset) tags
+SUB_SEC_DATE_TIMES = {
+    "SubSecDateTimeOriginal": (
+        "DateTimeOriginal",
+        "SubSecTimeOriginal",
+        "OffsetTimeOriginal",
+    ),
+    "SubSecCreateDate": ("CreateDate", "SubSecTimeDigitized", "OffsetTimeDigitized"),
+    "SubSecModifyDate": ("ModifyDate", "SubSecTime", "OffsetTime"),
+}
+
+
+class FastExifException(Exception):
+    pass
+
+
+class Reader:
+    def __init__(self, file):
+        self.fd = file.fileno()
+        self.size = os.fstat(self.fd).st_size
+        if self.size == 0:
+            raise FastExifException("Empty file")
+        self.header = mmap.mmap(
+            self.fd, min(self.size, HEADER_SIZE), access=mmap.ACCESS_READ
+        )
+
+    def read(self, offset, length):
+        if offset < 0 or length < 0 or offset + length > self.size:
+            raise FastExifException(f"Read out of bounds: {offset}+{length}")
+        if offset + length <= len(self.header):
+            return self.header[offset : offset + length]
+        return os.pread(self.fd, length, offset)
+
+    def close(self):
+        self.header.close()
+
+
+def tag(value, num=None):
+    # Same shape as exiftool -json -long
+    if num is None:
+        return {"val": value}
+    return {"num": num, "val": value}
+
+
+def parse_ifd(data, offset, byte_order, tags):
+    values = {}
+    pointers = {}
+    try:
+        (count,) = struct.unpack_from(f"{byte_order}H", data, offset)
+        for index in range(count):
+            entry = offset + 2 + index * 12
+            tag_id, type_id, length = struct.unpack_from(
+                f"{byte_order}HHI", data, entry
+            )
+            if tag_id in [EXIF_IFD_POINTER, GPS_IFD_POINTER]:
+                pointers[tag_id] = struct.unpack_from(
+                    f"{byte_order}I", data, entry + 8
+                )[0]
+                continue
+            if tag_id not in tags or type_id not in TIFF_TYPES:
+                continue
+            format, size = TIFF_TYPES[type_id]
+            value_offset = entry + 8
+            if size * length > 4:
+                (value_offset,) = struct.unpack_from(f"{byte_order}I", data, entry + 8)
+            if type_id == 7:
+                value = bytes(data[value_offset : value_offset + length])
+            elif format == "s":
+                value = data[value_offset : value_offset + length]
+                value = value.split(b"\0")[0].decode(errors="replace").strip()
+            else:
+                value = struct.unpack_from(
+                    f"{byte_order}{format * length}", data, value_offset
+                )
+                if len(format) == 2:
+                    # Rationals
+                    value = tuple(
+                        x / y if y != 0 else 0 for x, y in zip(value[::2], value[1::2])
+                    )
+                value = value[0] if len(value) == 1 else value
+            values[tags[tag_id]] = value
+    except struct.error as e:
+        raise FastExifException(f"Truncated IFD at: {offset}") from e
+    return values, pointers
+
+
+def parse_tiff(data):
+    # Returns EXIF and GPS tag values
+    byte_order = {b"II": "<", b"MM": ">"}.get(bytes(data[:2]))
+    if byte_order is None:
+        raise FastExifException("Invalid TIFF byte order")
+    magic, ifd0_offset = struct.unpack_from(f"{byte_order}HI", data, 2)
+    if magic != 42:
+        raise FastExifException("Invalid TIFF header")
+    values, pointers = parse_ifd(data, ifd0_offset, byte_order, IFD0_TAGS)
+    if EXIF_IFD_POINTER in pointers:
+        values.update(
+            parse_ifd(data, pointers[EXIF_IFD_POINTER], byte_order, EXIF_IFD_TAGS)[0]
+        )
+    gps = {}
+    if GPS_IFD_POINTER in pointers:
+        gps = parse_ifd(data, pointers[GPS_IFD_POINTER], byte_order, GPS_IFD_TAGS)[0]
+    return values, gps
+
+
+def get_gps_coordinate(num, positive_ref, negative_ref):
+    ref = negative_ref if num < 0 else positive_ref
+    seconds = round(abs(num) * 3600, 2)
+    return tag(
+        f"{int(seconds // 3600)} deg {int(seconds % 3600 // 60)}' "
+        f'{seconds % 60:.2f}" {ref}',
+        num,
+    )
+
+
+def get_gps_altitude(num):
+    return tag(
+        f"{abs(num):g} m {'Below' if num < 0 else 'Above'} Sea Level",
+        num,
+    )
+
+
+def get_composite(values, gps, width, height):
+    composite = {}
+    if width and height:
+        composite["ImageSize"] = tag(f"{width}x{height}")
+        megapixels = width * height / 1000000
+        composite["Megapixels"] = tag(f"{megapixels:.1f}", megapixels)
+    # Malformed tags, e.g. a date stored as BYTE or a GPSTimeStamp with fewer
+    # than 3 rationals, are left out like exiftool does
+    for name, (date_time, sub_sec, offset) in SUB_SEC_DATE_TIMES.items():
+        if isinstance(values.get(date_time), str):
+            value = values[date_time]
+            if values.get(sub_sec) and isinstance(values[sub_sec], str):
+                value += f".{values[sub_sec]}"
+            if isinstance(values.get(offset), str):
+                value += values[offset]
+            composite[name] = tag(value)
+    time_stamp = gps.get("GPSTimeStamp")
+    if (
+        isinstance(gps.get("GPSDateStamp"), str)
+        and isinstance(time_stamp, tuple)
+        and len(time_stamp) == 3
+    ):
+        hours, minutes, seconds = time_stamp
+        seconds = f"{seconds:06.3f}".rstrip("0").rstrip(".")
+        composite["GPSDateTime"] = tag(
+            f"{gps['GPSDateStamp']} {int(hours):02d}:{int(minutes):02d}:{seconds}Z"
+        )
+    for name, positive_ref, negative_ref in [
+        ("GPSLatitude", "N", "S"),
+        ("GPSLongitude", "E", "W"),
+    ]:
+        try:
+            degrees, minutes, seconds = gps[name]
+        except (KeyError, TypeError, ValueError):
+            continue
+        num = degrees + minutes / 60 + seconds / 3600
+        if gps.get(f"{name}Ref") == negative_ref:
+            num = -num
+        composite[name] = get_gps_coordinate(num, positive_ref, negative_ref)
+    if isinstance(gps.get("GPSAltitude"), float):
+        altitude = gps["GPSAltitude"]
+        if gps.get("GPSAltitudeRef") == 1:
+            # Below sea level
+            altitude = -altitude
+        composite["GPSAltitude"] = get_gps_altitude(altitude)
+    return composite
+
+
+def get_exif_group(values):
+    group = {}
+    for name, value in values.items():
+        if name == "Orientation":
+            group[name] = tag(ORIENTATIONS.get(value, f"Unknown ({value})"), value)
+        elif isinstance(value, (str, int)):
+            group[name] = tag(value)
+    return group
+
+
+def get_maker_notes_group(maker_note):
+    # Only Apple maker notes are read, see: utils.exif.get_content_identifier()
+    if isinstance(maker_note, tuple):
+        # Stored as BYTE rather than UNDEFINED by some writers
+        maker_note = bytes(maker_note)
+    if not isinstance(maker_note, bytes) or not maker_note.startswith(
+        APPLE_MAKER_NOTE_HEADER
+    ):
+        return {}
+    byte_order = {b"II": "<"}.get(maker_note[12:14], ">")
+    values, _ = parse_ifd(
+        maker_note, APPLE_MAKER_NOTE_IFD_OFFSET, byte_order, APPLE_TAGS
+    )
+    return {
+        name: tag(value)
+        for name, value in values.items()
+        if isinstance(value, str) and value
+    }
+
+
+def read_jpeg(reader):
+    # Returns (TIFF data or None, width, height)
+    tiff = None
+    offset = 2
+    while True:
+        marker, length = struct.unpack(">HH", reader.read(offset, 4))
+        if marker >> 8 != 0xFF:
+            raise FastExifException(f"Invalid JPEG marker at: {offset}")
+        marker &= 0xFF
+        if marker == 0xE1 and tiff is None:
+            segment = reader.read(offset + 4, length - 2)
+            if segment[:6] == b"Exif\0\0":
+                tiff = segment[6:]
+        elif marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", reader.read(offset + 5, 4))
+            return tiff, width, height
+        elif marker == 0xDA:
+            raise FastExifException("No SOF marker before image data")
+        offset += 2 + length
+
+
+def read_uint(data, offset, size):
+    # iloc field sizes are 0, 4 or 8 bytes
+    if size == 0:
+        return 0, offset
+    return int.from_bytes(data[offset : offset + size], "big"), offset + size
+
+
+def read_heic(reader):
+    # Returns (TIFF data or None, width, height) of the primary item
+    # See: ISO/IEC 14496-12 and ISO/IEC 23008-12
+    meta_offset, meta_end = get_box(reader, 0, reader.size, b"meta")
+    # meta is a full box, skip version and flags
+    meta_offset += 4
+
+    pitm_offset, _ = get_box(reader, meta_offset, meta_end, b"pitm")
+    version = reader.read(pitm_offset, 1)[0]
+    primary_item_id = int.from_bytes(
+        reader.read(pitm_offset + 4, 2 if version == 0 else 4), "big"
+    )
+
+    exif_item_id = None
+    iinf_offset, iinf_end = get_box(reader, meta_offset, meta_end, b"iinf")
+    version = reader.read(iinf_offset, 1)[0]
+    entries_offset = iinf_offset + 4 + (2 if version == 0 else 4)
+    for box_type, offset, _ in iter_boxes(reader, entries_offset, iinf_end):
+        version = reader.read(offset, 1)[0]
+        if box_type != b"infe" or version < 2:
+            continue
+        id_size = 2 if version == 2 else 4
+        item_id = int.from_bytes(reader.read(offset + 4, id_size), "big")
+        if reader.read(offset + 4 + id_size + 2, 4) == b"Exif":
+            exif_item_id = item_id
+
+    width = height = None
+    iprp_offset, iprp_end = get_box(reader, meta_offset, meta_end, b"iprp")
+    ipco_offset, ipco_end = get_box(reader, iprp_offset, iprp_end, b"ipco")
+    properties = list(iter_boxes(reader, ipco_offset, ipco_end))
+    ipma_offset, ipma_end = get_box(reader, iprp_offset, iprp_end, b"ipma")
+    ipma = reader.read(ipma_offset, ipma_end - ipma_offset)
+    version, flags = ipma[0], int.from_bytes(ipma[1:4], "big")
+    (count,) = struct.unpack_from(">I", ipma, 4)
+    offset = 8
+    for _ in range(count):
+        item_id, offset = read_uint(ipma, offset, 2 if version < 1 else 4)
+        associations = ipma[offset]
+        offset += 1
+        for _ in range(associations):
+            index, offset = read_uint(ipma, offset, 2 if flags & 1 else 1)
+            index &= 0x7FFF if flags & 1 else 0x7F
+            if item_id != primary_item_id or not 0 < index <= len(properties):
+                continue
+            box_type, property_offset, _ = properties[index - 1]
+            if box_type == b"ispe":
+                width, height = struct.unpack(
+                    ">II", reader.read(property_offset + 4, 8)
+                )
+
+    tiff = None
+    if exif_item_id is not None:
+        iloc_offset, iloc_end = get_box(reader, meta_offset, meta_end, b"iloc")
+        iloc = reader.read(iloc_offset, iloc_end - iloc_offset)
+        version = iloc[0]
+        offset_size, length_size = iloc[4] >> 4, iloc[4] & 0xF
+        base_offset_size = iloc[5] >> 4
+        index_size = iloc[5] & 0xF if version in [1, 2] else 0
+        offset = 6
+        count, offset = read_uint(iloc, offset, 2 if version < 2 else 4)
+        for _ in range(count):
+            item_id, offset = read_uint(iloc, offset, 2 if version < 2 else 4)
+            if version in [1, 2]:
+                construction_method = int.from_bytes(iloc[offset : offset + 2], "big")
+                offset += 2
+            else:
+                construction_method = 0
+            offset += 2  # data_reference_index
+            base_offset, offset = read_uint(iloc, offset, base_offset_size)
+            extent_count, offset = read_uint(iloc, offset, 2)
+            extents = []
+            for _ in range(extent_count):
+                _, offset = read_uint(iloc, offset, index_size)
+                extent_offset, offset = read_uint(iloc, offset, offset_size)
+                extent_length, offset = read_uint(iloc, offset, length_size)
+                extents.append((base_offset + extent_offset, extent_length))
+            if item_id != exif_item_id:
+                continue
+            if construction_method != 0:
+                raise FastExifException("Unsupported iloc construction method")
+            data = b"".join(reader.read(x, length) for x, length in extents)
+            # Exif items start with the offset to the TIFF header
+            (tiff_offset,) = struct.unpack_from(">I", data)
+            tiff = data[4 + tiff_offset :]
+            break
+    return tiff, width, height
+
+
+def get_duration(seconds):
+    if seconds < 30:
+        return tag(f"{seconds:.2f} s", seconds)
+    seconds_int = round(seconds)
+    return tag(
+        f"{seconds_int // 3600}:{seconds_int % 3600 // 60:02d}:{seconds_int % 60:02d}",
+        seconds,
+    )
+
+
+def get_video_groups(video):
+    # QuickTime and Composite groups, see: utils.bmff.get_video_metadata()
+    quicktime = {"Duration": get_duration(video["duration"])}
+    composite = {}
+    if video["create_date"] is not None:
+        quicktime["CreateDate"] = tag(
+            video["create_date"].strftime("%Y:%m:%d %H:%M:%S")
+        )
+    if video["width"] and video["height"]:
+        quicktime["ImageWidth"] = tag(video["width"])
+        quicktime["ImageHeight"] = tag(video["height"])
+        quicktime["Rotation"] = tag(video["rotation"])
+        composite["ImageSize"] = tag(f"{video['width']}x{video['height']}")
+        megapixels = video["width"] * video["height"] / 1000000
+        composite["Megapixels"] = tag(f"{megapixels:.1f}", megapixels)
+        composite["Rotation"] = tag(video["rotation"])
+    if video.get("creation_date"):
+        try:
+            creation_date = datetime.datetime.fromisoformat(video["creation_date"])
+            quicktime["CreationDate"] = tag(
+                creation_date.isoformat(sep=" ").replace("-", ":", 2)
+            )
+        except ValueError:
+            pass
+    for key, name in [
+        ("make", "Make"),
+        ("model", "Model"),
+        ("content_identifier", "ContentIdentifier"),
+    ]:
+        if video.get(key):
+            quicktime[name] = tag(video[key])
+    if video["location"] is not None:
+        latitude, longitude, altitude = video["location"]
+        composite["GPSLatitude"] = get_gps_coordinate(latitude, "N", "S")
+        composite["GPSLongitude"] = get_gps_coordinate(longitude, "E", "W")
+        if altitude is not None:
+            composite["GPSAltitude"] = get_gps_altitude(altitude)
+    return quicktime, composite
+
+
+def get_metadata(file_path):
+    # Reads the tags used by the utils.exif get_*() helpers in the same shape as
+    # exiftool -groupHeadings -json -long. Raises FastExifException for
+    # anything else, which should be handed to exiftool instead.
+    try:
+        with open(file_path, "rb") as file:
+            reader = Reader(file)
+            try:
+                magic = reader.read(0, min(reader.size, 8))
+                brand = get_brand(reader) if magic[4:8] == b"ftyp" else None
+                video = None
+                if magic.startswith(b"\xff\xd8\xff"):
+                    file_type_extension, mime_type = "jpg", "image/jpeg"
+                    tiff, width, height = read_jpeg(reader)
+                elif brand in HEIC_BRANDS:
+                    file_type_extension, mime_type = "heic", "image/heic"
+                    tiff, width, height = read_heic(reader)
+                elif brand in VIDEO_BRANDS:
+                    file_type_extension, mime_type = VIDEO_BRANDS[brand]
+                    video = get_video_metadata(reader)
+                else:
+                    raise FastExifException("Unsupported file type")
+            finally:
+                reader.close()
+        # Groups are built here too, so that a tag this module doesn't expect
+        # falls back to exiftool instead of failing the import
+        if video is not None:
+            quicktime, composite = get_video_groups(video)
+            return {
+                "SourceFile": str(file_path),
+                "File": {
+                    "FileTypeExtension": tag(file_type_extension),
+                    "MIMEType": tag(mime_type),
+                },
+                "QuickTime": quicktime,
+                "Composite": composite,
+            }
+        values, gps = parse_tiff(tiff) if tiff else ({}, {})
+        metadata = {
+            "SourceFile": str(file_path),
+            "File": {
+                "FileTypeExtension": tag(file_type_extension),
+                "MIMEType": tag(mime_type),
+                "ImageWidth": tag(width),
+                "ImageHeight": tag(height),
+            },
+            "EXIF": get_exif_group(values),
+            "MakerNotes": get_maker_notes_group(values.get("MakerNote")),
+            "Composite": get_composite(values, gps, width, height),
+        }
+    except (
+        OSError,
+        ValueError,
+        TypeError,
+        IndexError,
+        struct.error,
+        BMFFException,
+    ) as e:
+        raise FastExifException(f"Could not read: {file_path}") from e
+    return {key: value for key, value in metadata.items() if value}
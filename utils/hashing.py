@@ -0,0 +1,31 @@
+import hashlib
+import os
+
+
+# Number of bytes read from both the start and the end of a file
+PARTIAL_HASH_SIZE = 64 * 1024
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def get_partial_hash(file_path, size=PARTIAL_HASH_SIZE):
+    # Cheap first pass: same-size files rarely share their first and last bytes
+    # without being identical. Only files with matching partial hashes need
+    # get_content_hash().
+    hash = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        hash.update(file_size.to_bytes(8, "little"))
+        hash.update(f.read(size))
+        if file_size > size:
+            f.seek(max(size, file_size - size))
+            hash.update(f.read(size))
+    return hash.hexdigest()
+
+
+def get_content_hash(file_path, chunk_size=CHUNK_SIZE):
+    hash = hashlib.blake2b()
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            hash.update(chunk)
+    return hash.hexdigest()
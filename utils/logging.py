@@ -1,13 +1,67 @@
+import atexit
 import logging
+import logging.handlers
+import multiprocessing.util
+import os
+import queue
+import time
 
 
-def get_logger(name, log_level=logging.DEBUG):
-    logger = logging.getLogger(name)
-    logger.setLevel(log_level)
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-    )
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
+# Seconds between ProgressReporter lines
+PROGRESS_INTERVAL = 10
+
+
+def get_logger(name):
+    # Handlers and levels are configured once, see: LOGGING in settings.py
+    return logging.getLogger(name)
+
+
+class QueueStreamHandler(logging.handlers.QueueHandler):
+    # Hands records to a background thread which writes them, so a slow console
+    # or pipe never stalls the caller. Records are formatted by the caller, like
+    # QueueHandler does, arguments may be mutated once logged.
+    def __init__(self, stream=None):
+        super().__init__(queue.SimpleQueue())
+        # Writes the message formatted by prepare() as is
+        self.handler = logging.StreamHandler(stream)
+        self.listener = None
+        self.pid = None
+
+    def emit(self, record):
+        # Forked processes, see: ./manage.py reprocess, need their own listener
+        if self.listener is None or self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.queue = queue.SimpleQueue()
+            self.listener = logging.handlers.QueueListener(
+                self.queue, self.handler, respect_handler_level=True
+            )
+            self.listener.start()
+            atexit.register(self.close)
+            # multiprocessing workers exit with os._exit() and skip atexit,
+            # their finalizers still run
+            multiprocessing.util.Finalize(self, self.close, exitpriority=0)
+        super().emit(record)
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+        super().close()
+
+
+class ProgressReporter:
+    # Logs at most one progress line every interval seconds
+    def __init__(self, logger, interval=PROGRESS_INTERVAL):
+        self.logger = logger
+        self.interval = interval
+        self.last_report = time.monotonic()
+
+    def update(self, done, total, rate=None):
+        now = time.monotonic()
+        if now - self.last_report < self.interval and done != total:
+            return
+        self.last_report = now
+        if rate is None:
+            self.logger.info("Progress: %d/%d", done, total)
+        else:
+            self.logger.info("Progress: %d/%d, %.1f/sec", done, total, rate)
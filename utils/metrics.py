@@ -0,0 +1,214 @@
+import bisect
+import collections
+import contextlib
+import json
+import time
+
+
+# Upper bounds in seconds, the last bucket is +Inf
+HISTOGRAM_BUCKETS = [
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+]
+
+# Window over which Metrics.rate() is computed
+RATE_WINDOW_SECONDS = 10
+
+
+class Histogram:
+    def __init__(self, buckets=HISTOGRAM_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, percentile):
+        # Upper bound of the bucket containing the percentile
+        if self.count == 0:
+            return None
+        rank = percentile / 100 * self.count
+        total = 0
+        for bucket, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bucket, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": dict(zip([*self.buckets, "+Inf"], self.counts)),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.started_on = time.monotonic()
+        self.histograms = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.max_gauges = {}
+        # (time, number of files) within the rate window and their sum
+        self.events = collections.deque()
+        self.events_sum = 0
+        # e.g. utils.profiling.StageProfiler, profiles each stage by name
+        self.profiler = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.profiler is None:
+            profile = contextlib.nullcontext()
+        else:
+            profile = self.profiler.stage(name)
+        start = time.perf_counter()
+        try:
+            with profile:
+                yield
+        finally:
+            self.histograms[name].observe(time.perf_counter() - start)
+
+    def observe(self, name, value):
+        self.histograms[name].observe(value)
+
+    def increment(self, name, value=1):
+        self.counters[name] += value
+        if name == "files" and value != 0:
+            now = time.monotonic()
+            self.events.append((now, value))
+            self.events_sum += value
+            while self.events[0][0] < now - RATE_WINDOW_SECONDS:
+                self.events_sum -= self.events.popleft()[1]
+
+    def set_gauge(self, name, value):
+        # e.g. queue depths, the maximum is kept for the summary
+        self.gauges[name] = value
+        self.max_gauges[name] = max(self.max_gauges.get(name, value), value)
+
+    def elapsed(self):
+        return time.monotonic() - self.started_on
+
+    def rate(self):
+        # Rolling files/sec over the last RATE_WINDOW_SECONDS
+        if len(self.events) == 0:
+            return 0
+        window = min(RATE_WINDOW_SECONDS, self.elapsed())
+        return self.events_sum / window if window > 0 else 0
+
+    def to_dict(self):
+        elapsed = self.elapsed()
+        return {
+            "elapsed": elapsed,
+            "files_per_second": self.counters["files"] / elapsed if elapsed else 0,
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "max_gauges": dict(self.max_gauges),
+            "histograms": {
+                name: histogram.to_dict() for name, histogram in self.histograms.items()
+            },
+        }
+
+    def to_prometheus(self, prefix="phototrip_import"):
+        # Prometheus text exposition format
+        # See: https://prometheus.io/docs/instrumenting/exposition_formats/
+        lines = [
+            f"# TYPE {prefix}_elapsed_seconds gauge",
+            f"{prefix}_elapsed_seconds {self.elapsed()}",
+        ]
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, value in sorted(self.max_gauges.items()):
+            lines.append(f"# TYPE {prefix}_{name}_max gauge")
+            lines.append(f"{prefix}_{name}_max {value}")
+        lines.append(f"# TYPE {prefix}_stage_duration_seconds histogram")
+        for name, histogram in sorted(self.histograms.items()):
+            total = 0
+            for bucket, count in zip([*histogram.buckets, "+Inf"], histogram.counts):
+                total += count
+                lines.append(
+                    f'{prefix}_stage_duration_seconds_bucket{{stage="{name}",le="{bucket}"}} {total}'
+                )
+            lines.append(
+                f'{prefix}_stage_duration_seconds_sum{{stage="{name}"}} {histogram.sum}'
+            )
+            lines.append(
+                f'{prefix}_stage_duration_seconds_count{{stage="{name}"}} {histogram.count}'
+            )
+        return "\n".join(lines) + "\n"
+
+    def dump(self, file_path):
+        # .prom files are written in Prometheus text format, anything else as JSON
+        if str(file_path).endswith(".prom"):
+            contents = self.to_prometheus()
+        else:
+            contents = json.dumps(self.to_dict(), indent=4)
+        with open(file_path, "w") as f:
+            f.write(contents)
+
+    def summary_table(self):
+        elapsed = self.elapsed()
+        row = "{:<12} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>7}"
+        lines = [
+            row.format(
+                "stage",
+                "count",
+                "total (s)",
+                "mean (ms)",
+                "p50 (ms)",
+                "p90 (ms)",
+                "max (ms)",
+                "share",
+            )
+        ]
+        for name, histogram in self.histograms.items():
+            lines.append(
+                row.format(
+                    name,
+                    histogram.count,
+                    f"{histogram.sum:.2f}",
+                    f"{histogram.sum / histogram.count * 1000:.1f}",
+                    f"{histogram.percentile(50) * 1000:.1f}",
+                    f"{histogram.percentile(90) * 1000:.1f}",
+                    f"{histogram.max * 1000:.1f}",
+                    f"{histogram.sum / elapsed:.0%}" if elapsed else "",
+                )
+            )
+        lines.append("")
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name}: {value}")
+        for name, value in sorted(self.max_gauges.items()):
+            lines.append(f"max {name}: {value}")
+        files = self.counters["files"]
+        lines.append(
+            f"{files} files in {elapsed:.1f}s => {files / elapsed if elapsed else 0:.1f} files/sec"
+        )
+        return "\n".join(lines)
@@ -0,0 +1,81 @@
+import io
+
+from PIL import Image, UnidentifiedImageError
+
+from utils import exif
+
+
+# Embedded images to fall back to when Pillow cannot decode the file itself
+# e.g. .heic, .cr2, .nef, .arw
+EMBEDDED_IMAGE_TAGS = [
+    "PreviewImage",
+    "JpgFromRaw",
+    "ThumbnailImage",
+]
+
+HASH_SIZE = 8
+
+
+class PerceptualHashException(Exception):
+    pass
+
+
+def get_dhash(image, hash_size=HASH_SIZE):
+    # Difference hash: shrink to (hash_size + 1) x hash_size grayscale pixels and
+    # record whether each pixel is brighter than its right neighbour.
+    # See: https://www.hackerfactor.com/blog/index.php?/archives/529-Kind-of-Like-That.html
+    # JPEG images are decoded at a reduced scale, which is much faster than a
+    # full decode followed by a resize.
+    image.draft("L", (hash_size * 8, hash_size * 8))
+    image = image.convert("L").resize(
+        (hash_size + 1, hash_size), Image.Resampling.LANCZOS
+    )
+    pixels = list(image.getdata())
+    dhash = 0
+    for row in range(hash_size):
+        for column in range(hash_size):
+            left = pixels[row * (hash_size + 1) + column]
+            right = pixels[row * (hash_size + 1) + column + 1]
+            dhash = (dhash << 1) | (left > right)
+    return dhash
+
+
+def open_image(file_path):
+    try:
+        return Image.open(file_path)
+    except (UnidentifiedImageError, OSError):
+        pass
+    for tag in EMBEDDED_IMAGE_TAGS:
+        try:
+            image = exif.get_embedded_image(file_path, tag)
+        except exif.ExifException:
+            continue
+        if image is None:
+            continue
+        try:
+            return Image.open(io.BytesIO(image))
+        except (UnidentifiedImageError, OSError):
+            pass
+    raise PerceptualHashException(f"Could not open image: {file_path}")
+
+
+def get_perceptual_hash(file_path):
+    image = open_image(file_path)
+    try:
+        with image:
+            return to_signed(get_dhash(image))
+    except (OSError, ValueError) as e:
+        raise PerceptualHashException(f"Could not decode image: {file_path}") from e
+
+
+def to_signed(hash):
+    # Store 64-bit hashes in a PostgreSQL bigint (signed)
+    return hash - (1 << 64) if hash >= (1 << 63) else hash
+
+
+def to_unsigned(hash):
+    return hash + (1 << 64) if hash < 0 else hash
+
+
+def hamming_distance(a, b):
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
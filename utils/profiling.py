@@ -0,0 +1,157 @@
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import pathlib
+import pstats
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Number of functions in the .txt summaries next to the .pstats files
+SUMMARY_FUNCTIONS = 30
+
+# Number of queries kept per profiled request
+SLOWEST_QUERIES = 10
+
+# Held while a request is profiled. Python 3.12+ has a single profiler slot per
+# interpreter, concurrent requests are served unprofiled.
+request_profile_lock = threading.Lock()
+
+
+def get_timestamp():
+    return datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+
+def dump_profile(profile, file_path):
+    # <file_path>.pstats for snakeviz, pstats or gprof2dot and a <file_path>.txt
+    # summary sorted by cumulative time
+    file_path = pathlib.Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    profile.dump_stats(file_path.with_suffix(".pstats"))
+    stream = io.StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(SUMMARY_FUNCTIONS)
+    file_path.with_suffix(".txt").write_text(stream.getvalue())
+
+
+class StageProfiler:
+    # One cProfile.Profile per utils.metrics.Metrics.stage() name. Only one
+    # profile can be enabled per thread, time spent in a nested stage is
+    # attributed to the outer one.
+    def __init__(self):
+        self.profiles = {}
+        self.active = None
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.active is not None:
+            yield
+            return
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        self.active = name
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.active = None
+
+    def dump(self, directory):
+        # Returns the directory written to, one file pair per stage
+        directory = pathlib.Path(directory) / f"import-{get_timestamp()}"
+        for name, profile in self.profiles.items():
+            dump_profile(profile, directory / name)
+        return directory
+
+
+class ProfilingMiddleware:
+    # Profiles requests under PROFILE_REQUEST_PATHS and keeps those slower than
+    # PROFILE_REQUEST_THRESHOLD seconds in PROFILE_DIR/requests: a .pstats and
+    # .txt profile and a .json with the SQL query count and time, the Python
+    # time and the slowest queries. cProfile roughly doubles the Python time of
+    # profiled requests.
+    def __init__(self, get_response):
+        if getattr(settings, "PROFILE_DIR", None) is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.directory = pathlib.Path(settings.PROFILE_DIR) / "requests"
+        self.threshold = settings.PROFILE_REQUEST_THRESHOLD
+        self.paths = settings.PROFILE_REQUEST_PATHS
+
+    def __call__(self, request):
+        if not request.path.startswith(tuple(self.paths)):
+            return self.get_response(request)
+        queries = []
+
+        def record_query(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((time.perf_counter() - start, sql))
+
+        if not request_profile_lock.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiling tool is active, e.g. an import's StageProfiler
+                return self.get_response(request)
+            start = time.perf_counter()
+            try:
+                with connection.execute_wrapper(record_query):
+                    response = self.get_response(request)
+            finally:
+                profile.disable()
+        finally:
+            request_profile_lock.release()
+        elapsed = time.perf_counter() - start
+        if elapsed >= self.threshold:
+            self.dump(request, response, elapsed, profile, queries)
+        return response
+
+    def dump(self, request, response, elapsed, profile, queries):
+        slug = re.sub(r"[^\w]+", "-", request.path).strip("-")
+        file_path = self.directory / f"{get_timestamp()}-{request.method}-{slug}"
+        dump_profile(profile, file_path)
+        sql_time = sum(x[0] for x in queries)
+        file_path.with_suffix(".json").write_text(
+            json.dumps(
+                {
+                    "method": request.method,
+                    "path": request.get_full_path(),
+                    "status": response.status_code,
+                    "elapsed": elapsed,
+                    "sql_queries": len(queries),
+                    "sql_time": sql_time,
+                    "python_time": elapsed - sql_time,
+                    "slowest_queries": [
+                        {"time": x[0], "sql": x[1]}
+                        for x in sorted(queries, reverse=True)[:SLOWEST_QUERIES]
+                    ],
+                },
+                indent=4,
+            )
+        )
+        logger.warning(
+            "Slow request, %.2fs, %d queries: %s %s, see: %s",
+            elapsed,
+            len(queries),
+            request.method,
+            request.get_full_path(),
+            file_path.with_suffix(".json"),
+        )
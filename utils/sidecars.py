@@ -0,0 +1,71 @@
+import collections
+import os
+import pathlib
+
+
+# IMG_0001.CR2.xmp (darktable, digiKam) belongs to IMG_0001.CR2, IMG_0001.xmp
+# (Lightroom, Capture One) to every IMG_0001.* file without a sidecar of the
+# first kind. Extensions are matched case-insensitively.
+SIDECAR_EXTENSIONS = [".xmp"]
+
+
+def is_sidecar(file_path):
+    return pathlib.Path(file_path).suffix.lower() in SIDECAR_EXTENSIONS
+
+
+def list_directory(directory):
+    # {lower case name: path} of the files in directory
+    try:
+        with os.scandir(directory) as entries:
+            return {
+                x.name.lower(): pathlib.Path(x.path) for x in entries if x.is_file()
+            }
+    except OSError:
+        return {}
+
+
+def get_sidecar(file_path, names):
+    # names: see list_directory()
+    for extension in SIDECAR_EXTENSIONS:
+        for name in [f"{file_path.name}{extension}", f"{file_path.stem}{extension}"]:
+            if name.lower() in names:
+                return names[name.lower()]
+    return None
+
+
+def pair_sidecars(file_paths):
+    # Returns (file paths without sidecars, {file path: sidecar path}, sidecars
+    # without a file). Both are looked up in a single listing of their
+    # directory, so a changed sidecar reported by utils.watch brings in its
+    # file and a changed file its sidecar.
+    file_paths = [pathlib.Path(x) for x in file_paths]
+    listings = {x: list_directory(x) for x in {x.parent for x in file_paths}}
+    primaries = {x for x in file_paths if not is_sidecar(x)}
+    sidecars = {}
+    for file_path in primaries:
+        sidecar_path = get_sidecar(file_path, listings[file_path.parent])
+        if sidecar_path is not None:
+            sidecars[file_path] = sidecar_path
+    paired = set(sidecars.values())
+    # Sidecars without their file in file_paths, {directory: {sidecar path:
+    # [file paths]}} built once per directory
+    files_by_sidecar = {}
+    unpaired = []
+    for sidecar_path in file_paths:
+        if not is_sidecar(sidecar_path) or sidecar_path in paired:
+            continue
+        directory = sidecar_path.parent
+        if directory not in files_by_sidecar:
+            names = listings[directory]
+            files = collections.defaultdict(list)
+            for file_path in names.values():
+                if not is_sidecar(file_path):
+                    files[get_sidecar(file_path, names)].append(file_path)
+            files_by_sidecar[directory] = files
+        matches = files_by_sidecar[directory].get(sidecar_path, [])
+        if len(matches) == 0:
+            unpaired.append(sidecar_path)
+        for file_path in matches:
+            primaries.add(file_path)
+            sidecars[file_path] = sidecar_path
+    return sorted(primaries), sidecars, unpaired
@@ -0,0 +1,63 @@
+import io
+import math
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+# Width and height of the cell each thumbnail is fitted into
+TILE_SIZE = 256
+
+# Cells per row, 16 rows for a page of 256 thumbnails
+COLUMNS = 16
+
+QUALITY = 80
+
+
+class SpriteException(Exception):
+    pass
+
+
+def get_offset(index, size, tile_size=TILE_SIZE, columns=COLUMNS):
+    # [x, y, width, height], each thumbnail is centred in its cell
+    width, height = size
+    row, column = divmod(index, columns)
+    x = column * tile_size + (tile_size - width) // 2
+    y = row * tile_size + (tile_size - height) // 2
+    return [x, y, width, height]
+
+
+def make_sprite(files, tile_size=TILE_SIZE, columns=COLUMNS):
+    # files: [file object or None, ...] in grid order, unreadable files leave an
+    # empty cell. Returns (JPEG bytes, [offset or None, ...]), see: get_offset()
+    if len(files) == 0:
+        raise SpriteException("No files")
+    rows = math.ceil(len(files) / columns)
+    sprite = Image.new(
+        "RGB", (min(len(files), columns) * tile_size, rows * tile_size), "white"
+    )
+    offsets = []
+    for index, file in enumerate(files):
+        if file is None:
+            offsets.append(None)
+            continue
+        try:
+            with Image.open(file) as image:
+                # Thumbnails are usually JPEG, decoded at a reduced scale
+                image.draft("RGB", (tile_size, tile_size))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((tile_size, tile_size))
+                image = image.convert("RGB")
+        except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+            logger.warning("Could not read thumbnail: %s", e)
+            offsets.append(None)
+            continue
+        offset = get_offset(index, image.size, tile_size, columns)
+        sprite.paste(image, (offset[0], offset[1]))
+        offsets.append(offset)
+    output = io.BytesIO()
+    sprite.save(output, "JPEG", quality=QUALITY, optimize=True)
+    return output.getvalue(), offsets
@@ -0,0 +1,103 @@
+import json
+import math
+import re
+from collections import namedtuple
+
+from django.db.models import Lookup, Q
+
+
+# A tag path is "<Group>.<Tag>" as produced by exiftool -groupHeadings e.g:
+# "EXIF.ISO", "QuickTime.Rotation", "Composite.GPSLatitude"
+TAG_PREDICATE = re.compile(
+    r"""^\s*(?P<group>[\w-]+)\.(?P<tag>[\w-]+)\s*(?:(?P<operator>!=|>=|<=|=|>|<)\s*(?P<value>.*?))?\s*$"""
+)
+
+TagPredicate = namedtuple("TagPredicate", ["group", "tag", "operator", "value"])
+
+
+class TagPredicateException(Exception):
+    pass
+
+
+class JSONPathExists(Lookup):
+    # jsonb @? jsonpath
+    # GIN indexes only use the "accessors_chain == constant" clauses of the jsonpath,
+    # range comparisons are evaluated as a filter.
+    # See: https://www.postgresql.org/docs/current/datatype-json.html#JSON-INDEXING
+    lookup_name = "jsonpath_exists"
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return ("%s", [value])
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @? {rhs}::jsonpath", (*lhs_params, *rhs_params)
+
+
+def parse_value(string):
+    # Quoted values are always strings: EXIF.Model="iPhone 12"
+    if len(string) >= 2 and string[0] == string[-1] and string[0] in "\"'":
+        return string[1:-1]
+    for type in [int, float]:
+        try:
+            value = type(string)
+        except ValueError:
+            continue
+        # inf, nan and 1e999 are not valid JSON or jsonpath numbers
+        if not math.isfinite(value):
+            raise TagPredicateException(f"Non-finite value in tag predicate: {string}")
+        return value
+    return string
+
+
+def parse_tag_predicate(string):
+    match = TAG_PREDICATE.match(string)
+    if match is None:
+        raise TagPredicateException(f"Invalid tag predicate: {string}")
+    group, tag, operator, value = match.group("group", "tag", "operator", "value")
+    if operator is not None:
+        if value == "":
+            raise TagPredicateException(f"Missing value in tag predicate: {string}")
+        value = parse_value(value)
+        if operator in [">", ">=", "<", "<="] and isinstance(value, str):
+            raise TagPredicateException(f"Non-numeric value in tag predicate: {string}")
+    return TagPredicate(group, tag, operator, value)
+
+
+def jsonpath_literal(value):
+    # JSON string and number literals are valid jsonpath literals
+    return json.dumps(value)
+
+
+def tag_predicate_to_jsonpath(predicate):
+    path = f"$.{jsonpath_literal(predicate.group)}.{jsonpath_literal(predicate.tag)}"
+    if predicate.operator is None:
+        return path
+    operator = "==" if predicate.operator == "=" else predicate.operator
+    value = jsonpath_literal(predicate.value)
+    # exiftool -long stores the printed value in "val" and, when different, the
+    # numeric value in "num" e.g. "val": "1/60", "num": 0.0166666666666667
+    return f"{path} ? (@.num {operator} {value} || @.val {operator} {value})"
+
+
+def tag_predicate_to_q(predicate, field_name="metadata"):
+    if isinstance(predicate, str):
+        predicate = parse_tag_predicate(predicate)
+    if predicate.operator == "=":
+        # Containment (@>) can be answered by the jsonb_path_ops GIN index,
+        # which hashes the full path to every value
+        q = Q()
+        for key in ["val", "num"]:
+            value = {predicate.group: {predicate.tag: {key: predicate.value}}}
+            q |= Q(**{f"{field_name}__contains": value})
+        return q
+    return Q(**{f"{field_name}__jsonpath_exists": tag_predicate_to_jsonpath(predicate)})
+
+
+def tag_predicates_to_q(predicates, field_name="metadata"):
+    q = Q()
+    for predicate in predicates:
+        q &= tag_predicate_to_q(predicate, field_name=field_name)
+    return q
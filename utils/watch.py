@@ -0,0 +1,205 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import select
+import struct
+import time
+
+from utils.logging import get_logger
+
+
+logger = get_logger(__name__)
+
+
+# Seconds without new events before a batch of changes is emitted
+DEBOUNCE_SECONDS = 2
+
+# Upper bound on how long a continuous stream of events delays a batch
+MAX_DELAY_SECONDS = 30
+
+POLL_INTERVAL_SECONDS = 5
+
+# See: man 7 inotify
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT = struct.Struct("iIII")
+
+
+class WatchException(Exception):
+    pass
+
+
+def get_files(path):
+    return [x for x in pathlib.Path(path).glob("**/*") if x.is_file()]
+
+
+class InotifyWatcher:
+    # One inotify watch per directory, see: /proc/sys/fs/inotify/max_user_watches
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise WatchException("inotify is not available") from e
+        if self.fd < 0:
+            raise WatchException(f"inotify_init1: {os.strerror(ctypes.get_errno())}")
+        self.directories = {}
+        self.add_directory(self.path)
+
+    def add_directory(self, path):
+        for directory in [path, *[x for x in path.glob("**/*") if x.is_dir()]]:
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), IN_MASK | IN_ONLYDIR
+            )
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOENT:
+                    # Removed in the meantime
+                    continue
+                raise WatchException(
+                    f"inotify_add_watch: {os.strerror(ctypes.get_errno())}: {directory}"
+                )
+            self.directories[wd] = directory
+
+    def remove_directory(self, path):
+        for wd, directory in list(self.directories.items()):
+            if directory == path or path in directory.parents:
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.directories[wd]
+
+    def read(self, timeout=None):
+        # Returns [(path, deleted), ...]
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        changes = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                logger.warning("inotify queue overflow, rescanning: %s", self.path)
+                changes.extend((x, False) for x in get_files(self.path))
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            if wd not in self.directories:
+                continue
+            path = self.directories[wd] / os.fsdecode(name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have been written before the watch was added
+                    self.add_directory(path)
+                    changes.extend((x, False) for x in get_files(path))
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.remove_directory(path)
+                    changes.append((path, True))
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                changes.append((path, False))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                changes.append((path, True))
+        return changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Only directories are stat()ed on every poll, their mtime changes when an
+    # entry is created, deleted or renamed. Files rewritten in place keep the
+    # directory mtime and are not picked up.
+    def __init__(self, path, interval=POLL_INTERVAL_SECONDS):
+        self.path = pathlib.Path(path)
+        self.interval = interval
+        self.directories = {}
+        self.scan(self.path, initial=True)
+
+    def scan(self, directory, initial=False):
+        # Returns [(path, deleted), ...] for directory and new subdirectories
+        changes = []
+        old_files = self.directories.get(directory, (None, {}))[1]
+        try:
+            mtime = directory.stat().st_mtime_ns
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return changes
+        files = {}
+        for entry in entries:
+            path = pathlib.Path(entry.path)
+            if entry.is_dir(follow_symlinks=False):
+                if path not in self.directories:
+                    changes.extend(self.scan(path, initial=initial))
+            elif entry.is_file():
+                stat = entry.stat()
+                files[path] = (stat.st_size, stat.st_mtime_ns)
+                if not initial and old_files.get(path) != files[path]:
+                    changes.append((path, False))
+        changes.extend((x, True) for x in old_files if x not in files)
+        self.directories[directory] = (mtime, files)
+        return changes
+
+    def read(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        changes = []
+        for directory, (mtime, files) in list(self.directories.items()):
+            if directory not in self.directories:
+                # Removed below together with its parent
+                continue
+            try:
+                changed = directory.stat().st_mtime_ns != mtime
+            except FileNotFoundError:
+                for path in list(self.directories):
+                    if path == directory or directory in path.parents:
+                        changes.extend((x, True) for x in self.directories[path][1])
+                        del self.directories[path]
+                continue
+            if changed:
+                changes.extend(self.scan(directory))
+        return changes
+
+    def close(self):
+        pass
+
+
+def get_watcher(path, polling=False, poll_interval=POLL_INTERVAL_SECONDS):
+    if not polling:
+        try:
+            return InotifyWatcher(path)
+        except WatchException:
+            logger.exception("Falling back to polling: %s", path)
+    return PollingWatcher(path, interval=poll_interval)
+
+
+def watch(watcher, debounce=DEBOUNCE_SECONDS, max_delay=MAX_DELAY_SECONDS):
+    # Yields (changed paths, deleted paths), repeated events for the same path are
+    # coalesced and the last one wins e.g. create + delete => delete
+    pending = {}
+    first_event = None
+    while True:
+        changes = watcher.read(timeout=debounce if pending else None)
+        for path, deleted in changes:
+            pending[path] = deleted
+        if len(pending) == 0:
+            continue
+        if first_event is None:
+            first_event = time.monotonic()
+        if len(changes) == 0 or time.monotonic() - first_event >= max_delay:
+            yield (
+                sorted(x for x, deleted in pending.items() if not deleted),
+                sorted(x for x, deleted in pending.items() if deleted),
+            )
+            pending = {}
+            first_event = None